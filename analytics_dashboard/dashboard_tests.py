@@ -6,15 +6,22 @@ import googleapiclient
 import calendar
 from datetime import timedelta, datetime
 from api_wrappers.google_analytics_wrapper import GoogleAnalyticsWrapper
+from api_wrappers.google_analytics_cache import GACache
+from api_wrappers.google_analytics_quota import GARateLimiter
+from api_wrappers.google_analytics_planner import GAQueryPlanner
 from api_wrappers.bitly_wrapper import Bitly
+from api_wrappers.mailchimp_cache import MailchimpCache
+from api_wrappers.mailchimp_store import MailchimpCampaignStore
 from api_wrappers.mailchimp_wrapper import MailchimpWrapper
 
 
 class WebsiteInfo:
-    def __init__(self, name, google_analytics_profile_id):
+    def __init__(self, name, google_analytics_profile_id, ga_cache=None, ga_rate_limiter=None):
         self.name = name
         self.google_analytics_profile_id = google_analytics_profile_id
-        self.ga_wrapper = GoogleAnalyticsWrapper(profile_id=self.google_analytics_profile_id)
+        self.ga_wrapper = GoogleAnalyticsWrapper(profile_id=self.google_analytics_profile_id,
+                                                 cache=ga_cache,
+                                                 rate_limiter=ga_rate_limiter)
 
 
 class Account:
@@ -31,6 +38,10 @@ class Info:
     def __init__(self):
         with open('../../settings/dashboard.json') as json_file:
             self.accounts = []
+            self.ga_cache = GACache('ga_cache.sqlite')
+            self.ga_rate_limiter = GARateLimiter()
+            self.mailchimp_cache = MailchimpCache('mailchimp_cache.sqlite')
+            self.mailchimp_store = MailchimpCampaignStore('mailchimp_campaigns.sqlite')
 
             json_data = json.load(json_file)
             assert 'accounts' in json_data
@@ -38,7 +49,9 @@ class Info:
                 websites = []
                 for website in account['websites']:
                     websites.append(WebsiteInfo(name=website['website_name'],
-                                                google_analytics_profile_id=website['google_analytics_profile_id']))
+                                                google_analytics_profile_id=website['google_analytics_profile_id'],
+                                                ga_cache=self.ga_cache,
+                                                ga_rate_limiter=self.ga_rate_limiter))
 
                 self.accounts.append(Account(
                     name=account['name'],
@@ -80,6 +93,22 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                 print("       google_analytics_profile_id: {}".format(website.google_analytics_profile_id))
         print()
 
+    def test_portfolio(self):
+        # one parallel query across every website of every account
+        websites = [website for account in Globals.info.accounts for website in account.websites]
+        profile_ids = [website.google_analytics_profile_id for website in websites]
+        end_date = datetime.now() - timedelta(days=1)
+        start_date = end_date - timedelta(days=29)
+        portfolio_totals, profile_totals = websites[0].ga_wrapper.ga_get_portfolio_totals(profile_ids,
+                                                                                         'ga:sessions,ga:pageviews,ga:bounceRate',
+                                                                                         start_date=start_date,
+                                                                                         end_date=end_date)
+        assert len(profile_totals) == len(set(profile_ids))
+        assert int(portfolio_totals['ga:sessions']) == sum(int(totals['ga:sessions']) for totals in profile_totals.values())
+        for website in websites:
+            print("{}: {}".format(website.name, profile_totals[website.google_analytics_profile_id]))
+        print("total: {}".format(portfolio_totals))
+
     def test_website(self):
         # for each account, for each website within each account, update xlsx
         for account in Globals.info.accounts:
@@ -111,13 +140,40 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                        len(configurations['index'])
                 print('------')
 
-                for column in worksheet.columns[8:]:
-                    start_date = datetime.strptime(column[0].value, '%Y-%m')
-                    last_day = calendar.monthrange(start_date.year, start_date.month)[1]
-                    end_date = datetime(year=start_date.year, month=start_date.month, day=last_day)
-                    website.ga_wrapper.set_date_range(start_date=start_date, end_date=end_date)
-                    print("website date: {} - {}".format(start_date, end_date))
+                # plan all of the queries the empty cells need, so that rows sharing dimensions/filters are fetched
+                # together, for every month (column) at once
+                month_columns = [column for column in worksheet.columns[8:]
+                                 if any(row.value is None for row in column[1:])]
+                planner = GAQueryPlanner()
+                for row_index, metrics in enumerate(configurations['metrics']):
+                    if metrics is None:
+                        continue
+                    dimensions = configurations['dimensions'][row_index]
+                    filters = configurations['filters'][row_index]
+                    if configurations['max_results'][row_index] is not None:
+                        # top results are cached for the index rows below, which display them with their share of the total
+                        if all(column[row_index+2].value is not None for column in month_columns):
+                            continue
+                        planner.add(metrics, dimensions, filters, sort=configurations['sort'][row_index])
+                        planner.add(metrics, filters=filters)
+                    elif any(column[row_index+1].value is None for column in month_columns):
+                        if configurations['display_dimension'][row_index] is not None:
+                            planner.add(metrics, dimensions, filters)
+                        else:
+                            planner.add(metrics, filters=filters)
 
+                if len(month_columns) == 0:
+                    continue
+                start_date = datetime.strptime(month_columns[0][0].value, '%Y-%m')
+                last_month = datetime.strptime(month_columns[-1][0].value, '%Y-%m')
+                end_date = datetime(year=last_month.year,
+                                    month=last_month.month,
+                                    day=calendar.monthrange(last_month.year, last_month.month)[1])
+                print("website date: {} - {} ({} queries)".format(start_date, end_date, len(planner.get_queries())))
+                planner.execute(website.ga_wrapper, start_date, end_date)
+
+                for column in month_columns:
+                    year_month = column[0].value.replace('-', '')
                     cached_data = None
                     row_index = 0
                     for row in column[1:]:
@@ -134,7 +190,7 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                                         cached_data_row = cached_data[index -1]
                                         row.value = "{}% - {} ({})".format(round(cached_data_row[2]*100), cached_data_row[0], cached_data_row[1]) # get the data
 
-                            else: # we only want to go out to GA and get results if we are not retrieving cached data and we have metrics
+                            else:
                                 dimensions = configurations['dimensions'][row_index]
                                 sort = configurations['sort'][row_index]
                                 filters = configurations['filters'][row_index]
@@ -145,30 +201,22 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                                     row_index += 1
                                     continue
 
-                                print("{} - {}".format(metrics, dimensions))
-                                results = website.ga_wrapper.ga_get(metrics=metrics,
-                                                           dimensions=dimensions,
-                                                           sort=sort,
-                                                           filters=filters,
-                                                           max_results=max_results)
-                                metrics_parts = metrics.split(',')
-                                if max_results is not None: # we need to save the 'results' array, no cell updates necessary
-                                    total_results = float(results['totalsForAllResults'][metrics])
-                                    if 'rows' not in results:
-                                        cached_data = []
-                                    else:
-                                        cached_data = results['rows']
-                                    for data in cached_data:
-                                        data.append(float(data[1])/total_results)
-                                elif len(metrics_parts) == 1:
-                                    if display_dimension is not None:
-                                        for result_row in results['rows']:
-                                            if display_dimension == result_row[0]:
-                                                row.value = float(result_row[1])
-                                    else:
-                                        row.value = float(results['totalsForAllResults'][metrics])
+                                if max_results is not None: # we need to save the top rows, no cell updates necessary
+                                    metric = metrics.split(',')[0]
+                                    total = float(planner.get_value(year_month, metric, filters=filters))
+                                    # rows of (dimension, metric, share of the metric's total)
+                                    cached_data = [(result_row[0], result_row[1], float(result_row[1]) / total if total else 0.0)
+                                                   for result_row in planner.get_rows(year_month, metric, dimensions, filters,
+                                                                                      sort=sort)[:max_results]]
+                                elif display_dimension is not None:
+                                    for result_row in planner.get_rows(year_month, metrics, dimensions, filters):
+                                        if display_dimension == result_row[0]:
+                                            row.value = float(result_row[1]) if len(result_row) == 2 else \
+                                                ', '.join(result_row[1:])
                                 else:
-                                    raise IndexError("unsupported number of metrics: {}".format(metrics))
+                                    values = [planner.get_value(year_month, metric, filters=filters)
+                                              for metric in metrics.split(',')]
+                                    row.value = float(values[0]) if len(values) == 1 else ', '.join(values)
                         row_index += 1
 
                 workbook.save(account.excel_file_path)
@@ -176,7 +224,7 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
     def test_campaigns(self):
         for account in Globals.info.accounts:
             workbook, worksheet, headers = open_workbook_worksheet(account.excel_file_path, 'campaigns')
-            mailchimp = MailchimpWrapper(api_key=account.mailchimp_api_key)
+            mailchimp = MailchimpWrapper(api_key=account.mailchimp_api_key, cache=Globals.info.mailchimp_cache)
             bitly_wrapper = Bitly()
             bitly_wrapper.authenticate_http_basic_auth(username=account.bitly_username,
                                                        password=account.bitly_password)
@@ -230,8 +278,10 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                             column_index += 1
                     elif type == 'analytics':
                         end_date = campaign_date + timedelta(days=campaign_duration)
-                        account.websites[0].ga_wrapper.set_date_range(start_date=campaign_date, end_date=datetime.today())
-                        long_term_page_stats = account.websites[0].ga_wrapper.get_page_stats(GoogleAnalyticsWrapper.get_url_path(data))
+                        # lifetime and campaign duration stats in one request
+                        long_term_page_stats, duration_page_stats = account.websites[0].ga_wrapper.get_page_stats_date_ranges(
+                            GoogleAnalyticsWrapper.get_url_path(data),
+                            date_ranges=[(campaign_date, datetime.today()), (campaign_date, end_date)])
 
                         row[2].value = long_term_page_stats['ga:newUsers']
                         row[3].value = long_term_page_stats['ga:entrances']
@@ -241,7 +291,9 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                         row[6].value = "{}:{}".format(minutes, seconds)
 
                         # executes every time to keep a running total
-                        source_page_views, source_unique_page_views, source_mediums = account.websites[0].ga_wrapper.get_pageviews_source(GoogleAnalyticsWrapper.get_url_path(data))
+                        source_page_views, source_unique_page_views, source_mediums = account.websites[0].ga_wrapper.get_pageviews_source(GoogleAnalyticsWrapper.get_url_path(data),
+                                                                                                                                                          start_date=campaign_date,
+                                                                                                                                                          end_date=datetime.today())
                         row[7].value = source_unique_page_views or 'Not Found'
 
                         if source_mediums is None or len(source_mediums) < 1:
@@ -255,10 +307,7 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                         else:
                             row[9].value = "{}: {}".format(source_mediums[1][0],
                                                         source_mediums[1][6])
-                        # get duration stats
-                        account.websites[0].ga_wrapper.set_date_range(start_date=campaign_date, end_date=end_date)
-                        duration_page_stats = account.websites[0].ga_wrapper.get_page_stats(GoogleAnalyticsWrapper.get_url_path(data))
-
+                        # duration stats
                         row[10].value = duration_page_stats['ga:newUsers']
                         row[11].value = duration_page_stats['ga:entrances']
                         row[12].value = duration_page_stats['ga:uniquePageViews']
@@ -275,15 +324,23 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
     def test_newsletter_links(self):
         for account in Globals.info.accounts:
             workbook, worksheet, headers = open_workbook_worksheet(account.excel_file_path, 'newsletter_links')
-            mailchimp = MailchimpWrapper(api_key=account.mailchimp_api_key)
+            mailchimp = MailchimpWrapper(api_key=account.mailchimp_api_key, cache=Globals.info.mailchimp_cache)
 
             google_source = 'newsletter'
             google_medium = 'email'
             account_google_campaign = None
             non_account_google_campaign = account.websites[0].name
 
-            campaign_links = None
+            click_index = None
             newsletter_campaign_id = None
+            # click details of every newsletter, fetched concurrently
+            id_column_index = headers.index('newsletter_campaign_id')
+            newsletter_campaign_ids = [row[id_column_index].value for row in worksheet.rows[1:]
+                                       if row[id_column_index].value is not None and len(row[id_column_index].value) > 3]
+            newsletter_links = mailchimp.get_campaigns_bulk(newsletter_campaign_ids,
+                                                            campaign=False,
+                                                            report=False,
+                                                            click_index=True)
 
             for row in worksheet.rows[1:]:
                 link = None
@@ -297,8 +354,11 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                         newsletter_campaign_id = column.value
                         if len(newsletter_campaign_id) > 3:
                             account_google_campaign = row[1].value.replace(' ', '-')
-                            campaign_links = mailchimp.get_campaign_links(campaign_id=newsletter_campaign_id)
-                            assert campaign_links['campaign_id'] == newsletter_campaign_id
+                            results, exception = newsletter_links[newsletter_campaign_id]
+                            if exception is not None:
+                                raise exception
+                            click_index = results['click_index']
+                            assert click_index.campaign_id == newsletter_campaign_id
                         break
                     elif headers[column_index] == 'link':
                         if column.value[-1:] != '/':
@@ -334,13 +394,12 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                     elif headers[column_index] == 'is_domain':
                         column.value = is_account_domain(url=link, website_name=account.websites[0].name)
                     elif headers[column_index].split('/')[0] == 'mailchimp':
-                        if len(newsletter_campaign_id) > 3 and len(campaign_links['urls_clicked']) > 0:
+                        if len(newsletter_campaign_id) > 3 and len(click_index) > 0:
                             field = headers[column_index].split('/')[1]
                             column.value = get_mailchimp_link_field(
                                 field=field,
-                                campaign_links=campaign_links,
-                                link=google_url,
-                                newsletter_campaign_id=newsletter_campaign_id)
+                                click_index=click_index,
+                                link=google_url)
 
                     column_index += 1
                 print("{} - {} - {} - {} - {}".format(newsletter_campaign_id, account_google_campaign, link, header, text))
@@ -350,13 +409,27 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
     def test_newsletters(self):
         for account in Globals.info.accounts:
             workbook, worksheet, headers = open_workbook_worksheet(account.excel_file_path, 'newsletters')
-            mailchimp = MailchimpWrapper(api_key=account.mailchimp_api_key)
+            mailchimp = MailchimpWrapper(api_key=account.mailchimp_api_key, cache=Globals.info.mailchimp_cache)
+            # campaigns and reports synced incrementally into the local store; any newsletter that isn't in it
+            # (e.g. without a report yet) is fetched concurrently
+            campaigns = {campaign['id']: campaign for campaign in mailchimp.sync_campaigns(Globals.info.mailchimp_store)}
+            account_id = mailchimp.get_account_id()
+            newsletters = {}
+            for row in worksheet.rows[1:]:
+                report = Globals.info.mailchimp_store.get_report(account_id, row[0].value)
+                if row[0].value in campaigns and report is not None:
+                    newsletters[row[0].value] = ({'campaign': campaigns[row[0].value], 'report': report}, None)
+            newsletters.update(mailchimp.get_campaigns_bulk([row[0].value for row in worksheet.rows[1:]
+                                                             if row[0].value not in newsletters]))
 
             for row in worksheet.rows[1:]:
                 campaign_id = row[0].value
                 print("id: {}".format(campaign_id))
-                campaign = mailchimp.get_campaign(campaign_id=campaign_id)
-                campaign_report = mailchimp.get_campaign_report(campaign_id=campaign_id)
+                results, exception = newsletters[campaign_id]
+                if exception is not None:
+                    raise exception
+                campaign = results['campaign']
+                campaign_report = results['report']
                 assert campaign['id'] == campaign_id
 
                 column_index = 0
@@ -396,6 +469,13 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
             bitly_wrapper = Bitly()
             bitly_wrapper.authenticate_http_basic_auth(account.bitly_username, account.bitly_password)
 
+            # one bulk pull of every article's daily stats; the (30d) and (at) windows are then answered locally
+            article_dates = [row[headers.index('date')].value for row in worksheet.rows[1:]]
+            article_paths = [GoogleAnalyticsWrapper.get_url_path(row[headers.index('url')].value) for row in worksheet.rows[1:]]
+            page_rollup = account.websites[0].ga_wrapper.get_page_rollup(url_paths=article_paths,
+                                                                          start_date=min(article_dates),
+                                                                          end_date=datetime.today())
+
             for row in worksheet.rows[1:]:
                 column_index = 0
                 article_name = None
@@ -425,7 +505,6 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                     elif column_name == 'date':
                         start_date = col.value
                         end_date = start_date + timedelta(days=number_of_days_stats_collected)
-                        account.websites[0].ga_wrapper.set_date_range(start_date=start_date, end_date=end_date)
                         assert start_date is not None
                         assert end_date is not None
                     elif column_name == 'url':
@@ -464,10 +543,10 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                         assert bitly_link is not None
                     elif column_name == 'ga:newUsers (at)':
                         # executes every time to keep a running total
-                        account.websites[0].ga_wrapper.set_date_range(start_date=start_date, end_date=datetime.today())
-                        long_term_page_stats = account.websites[0].ga_wrapper.get_page_stats(GoogleAnalyticsWrapper.get_url_path(url))
+                        long_term_page_stats = page_rollup.get_page_stats(GoogleAnalyticsWrapper.get_url_path(url),
+                                                                          start_date=start_date,
+                                                                          end_date=datetime.today())
                         col.value = int(long_term_page_stats[column_name.split()[0]])
-                        account.websites[0].ga_wrapper.set_date_range(start_date=start_date,end_date=end_date)
                     elif column_name == 'ga:entrances (at)':
                         assert long_term_page_stats is not None
                         col.value = int(long_term_page_stats[column_name.split()[0]])
@@ -486,10 +565,11 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                             if campaign_total_users is None:
                                 assert start_date is not None
                                 assert end_date is not None
-                                account.websites[0].ga_wrapper.set_date_range(start_date=start_date,end_date=end_date)
                                 assert campaign is not None
                                 try:
-                                    campaign_total_users, campaign_new_users = account.websites[0].ga_wrapper.get_total_users_campaign(campaign_name=campaign)
+                                    campaign_total_users, campaign_new_users = account.websites[0].ga_wrapper.get_total_users_campaign(campaign_name=campaign,
+                                                                                                                                       start_date=start_date,
+                                                                                                                                       end_date=end_date)
                                 except googleapiclient.errors.HttpError:
                                     campaign_new_users = "Not Found"
                                     campaign_total_users = "Not Found"
@@ -503,10 +583,11 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                             if ga_page_stats is None:
                                 assert start_date is not None
                                 assert end_date is not None
-                                account.websites[0].ga_wrapper.set_date_range(start_date=start_date,end_date=end_date)
 
                                 assert url is not None
-                                ga_page_stats = account.websites[0].ga_wrapper.get_page_stats(GoogleAnalyticsWrapper.get_url_path(url))
+                                ga_page_stats = page_rollup.get_page_stats(GoogleAnalyticsWrapper.get_url_path(url),
+                                                                           start_date=start_date,
+                                                                           end_date=end_date)
                                 assert ga_page_stats is not None
                             col.value = int(ga_page_stats[column_name.split()[0]])
                     elif column_name == 'ga:entrances (30d)':
@@ -536,10 +617,10 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                             col.value = "{}:{}".format(minutes, seconds)
                     elif column_name == 'Source Unique Page Views (at)':
                         # executes every time to keep a running total
-                        account.websites[0].ga_wrapper.set_date_range(start_date=start_date, end_date=datetime.today())
-                        source_page_views, source_unique_page_views, source_mediums = account.websites[0].ga_wrapper.get_pageviews_source(GoogleAnalyticsWrapper.get_url_path(url))
+                        source_page_views, source_unique_page_views, source_mediums = account.websites[0].ga_wrapper.get_pageviews_source(GoogleAnalyticsWrapper.get_url_path(url),
+                                                                                                                                                          start_date=start_date,
+                                                                                                                                                          end_date=datetime.today())
                         col.value = source_unique_page_views or 'Not Found'
-                        account.websites[0].ga_wrapper.set_date_range(start_date=start_date,end_date=end_date)
                     elif column_name == 'Top Source':
                         if source_mediums is None or len(source_mediums) < 1:
                             col.value = "Not Found"
@@ -567,10 +648,16 @@ class IntelliTectBlogArticlesTests(unittest.TestCase):
                     #print(col.value, end="\t")
                     column_index += 1
                 #print('--------')
-                print("date range: {} - {} -- {}".format(account.websites[0].ga_wrapper.get_start_date(), account.websites[0].ga_wrapper.get_end_date(), article_name))
+                print("date range: {} - {} -- {}".format(GoogleAnalyticsWrapper.format_date(start_date), GoogleAnalyticsWrapper.format_date(end_date), article_name))
             # save at end, only if everything succeeds
             workbook.save(account.excel_file_path)
             print("bitly API calls: {}".format(bitly_wrapper.get_total_api_request_count()))
+            for path, stats in bitly_wrapper.get_stats().items():
+                print("    {}: {} calls, {} bytes, {:.2f}s, errors: {}".format(path,
+                                                                          stats['count'],
+                                                                          stats['bytes'],
+                                                                          stats['seconds'],
+                                                                          stats['errors']))
 
 
 def open_workbook_worksheet(workbook_name, worksheet_name):
@@ -606,13 +693,14 @@ def date_is_before_today(date):
     return difference.days >= 1
 
 
-def get_mailchimp_link_field(field, campaign_links=None, link=None, newsletter_campaign_id=None):
-    assert campaign_links is not None
+def get_mailchimp_link_field(field, click_index=None, link=None):
+    """
+    :param click_index: MailchimpClickIndex of the newsletter; the link is looked up by its canonical url, so the
+        mc_cid/mc_eid parameters Mailchimp adds don't need to be added to it
+    """
+    assert click_index is not None
     assert link is not None
-    assert newsletter_campaign_id is not None
-    target_url = '{}&mc_cid={}&mc_eid=[UNIQID]'.format(link, newsletter_campaign_id)
-    assert target_url in campaign_links['urls_clicked']
-    return campaign_links['urls_clicked'][target_url][field]
+    return click_index.get(link, field)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,116 @@
+import json
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from api_wrappers.bitly_wrapper import Bitly, BitlyStats
+
+
+class FakeBitlyHandler(BaseHTTPRequestHandler):
+    """
+    local stand-in for the Bitly API (keep-alive, HTTP/1.1); records the connections it gets
+    """
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    headers_received = []
+
+    def do_GET(self):
+        FakeBitlyHandler.connections.add(self.client_address)
+        FakeBitlyHandler.headers_received.append(dict(self.headers))
+        url = urllib.parse.urlparse(self.path)
+        parameters = urllib.parse.parse_qs(url.query)
+        if parameters['access_token'][0] != 'token':
+            self.send_json(200, {'status_code': 500, 'status_txt': 'INVALID_ARG_ACCESS_TOKEN', 'data': None})
+        elif url.path == '/v3/link/clicks':
+            self.send_json(200, {'status_code': 200, 'status_txt': 'OK', 'data': {'link_clicks': 5}})
+        elif url.path == '/v3/expand':
+            self.send_json(200, {'status_code': 200,
+                                 'status_txt': 'OK',
+                                 'data': {'expand': [{'long_url': 'http://example.com/'}]}})
+        else:
+            self.send_json(404, {'status_code': 404, 'status_txt': 'NOT_FOUND', 'data': None})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        content = b'token'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_json(self, status, content):
+        content = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BitlyLocalTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBitlyHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_address = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeBitlyHandler.connections = set()
+        FakeBitlyHandler.headers_received = []
+        self.bitly = Bitly(access_token='token', api_address=self.api_address)
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            assert self.bitly.get_total_clicks('http://bit.ly/1aSjH6j') == 5
+            assert self.bitly.get_target_url('http://bit.ly/1aSjH6j') == 'http://example.com/'
+        assert Bitly(access_token='token', api_address=self.api_address).get_total_clicks('http://bit.ly/1aSjH6j') == 5
+        assert len(FakeBitlyHandler.connections) == 1
+        assert 'gzip' in FakeBitlyHandler.headers_received[0]['Accept-Encoding']
+        assert self.bitly.get_total_api_request_count() == 6
+        # one session per host, shared with the other wrappers (see http_session.get_session)
+        assert self.bitly.session is Bitly(api_address=self.api_address).session
+        assert self.bitly.session is not Bitly().session
+
+    def test_stats(self):
+        self.bitly.get_total_clicks('http://bit.ly/1aSjH6j')
+        self.bitly.get_total_clicks('http://bit.ly/1aSjH6j')
+        self.assertRaises(ConnectionError, self.bitly.get, '/invalidPath', {'link': 'http://bit.ly/1aSjH6j'})
+        self.bitly.set_access_token('invalid')
+        self.assertRaises(PermissionError, self.bitly.get_total_clicks, 'http://bit.ly/1aSjH6j')
+
+        stats = self.bitly.get_stats()
+        assert set(stats) == {'/v3/link/clicks', '/invalidPath'}
+        clicks = stats['/v3/link/clicks']
+        assert clicks['count'] == 3
+        assert clicks['bytes'] > 0
+        assert clicks['errors'] == {500: 1}
+        assert sum(clicks['latency_histogram']) == 3
+        assert stats['/invalidPath']['errors'] == {404: 1}
+
+    def test_authenticate_http_basic_auth(self):
+        bitly = Bitly(api_address=self.api_address)
+        bitly.authenticate_http_basic_auth(username='user', password='password')
+        assert bitly.get_access_token() == 'token'
+        assert bitly.get_total_api_request_count() == 1
+        assert bitly.get_stats()['/oauth/access_token']['errors'] == {}
+
+    def test_latency_histogram(self):
+        stats = BitlyStats()
+        for seconds in [0.01, 0.05, 0.3, 10]:
+            stats.record('/v3/expand', seconds, 100)
+        assert stats.get_stats()['/v3/expand']['latency_histogram'] == [2, 0, 0, 1, 0, 0, 0, 1]
+        assert stats.get_stats()['/v3/expand']['bytes'] == 400
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from datetime import timedelta, datetime
+from api_wrappers.google_analytics_cache import GACache
+
+
+def get_query(start_date='2016-02-01', end_date='2016-02-29', metrics='ga:users', dimensions='ga:date'):
+    return {'ids': 'ga:1234',
+            'start_date': start_date,
+            'end_date': end_date,
+            'metrics': metrics,
+            'dimensions': dimensions,
+            'filters': None,
+            'max_results': 50}
+
+
+class GACacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'ga_cache.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_put(self):
+        cache = GACache(self.path)
+        assert cache.get(get_query()) is None
+        cache.put(get_query(), {'totalsForAllResults': {'ga:users': '75'}})
+        assert cache.get(get_query()) == {'totalsForAllResults': {'ga:users': '75'}}
+        assert cache.get(get_query(end_date='2016-02-28')) is None
+        assert cache.get_stats() == {'hits': 1, 'misses': 2, 'entries': 1}
+
+    def test_persistent(self):
+        GACache(self.path).put(get_query(), {'rows': [['20160201', '3']]})
+        assert GACache(self.path).get(get_query()) == {'rows': [['20160201', '3']]}
+
+    def test_normalized_key(self):
+        cache = GACache(self.path)
+        cache.put(get_query(metrics='ga:users,ga:newUsers'), {'rows': []})
+        assert cache.get(get_query(metrics='ga:users, ga:newUsers')) == {'rows': []}
+        assert cache.get(get_query(metrics='ga:newUsers,ga:users')) is None
+
+    def test_ttl(self):
+        today = datetime.now().strftime('%Y-%m-%d')
+        cache = GACache(self.path, ttl_seconds=-1)
+        cache.put(get_query(end_date=today), {'rows': []})
+        assert cache.get(get_query(end_date=today)) is None
+        cache.put(get_query(end_date='today'), {'rows': []})
+        assert cache.get(get_query(end_date='today')) is None
+        # closed date ranges never expire
+        cache.put(get_query(), {'rows': []})
+        assert cache.get(get_query()) == {'rows': []}
+
+    def test_is_closed_range(self):
+        cache = GACache(self.path, latency_days=2)
+        assert cache.is_closed_range('2016-02-29')
+        assert cache.is_closed_range((datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d'))
+        assert not cache.is_closed_range((datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d'))
+        assert not cache.is_closed_range(datetime.now().strftime('%Y-%m-%d'))
+        assert not cache.is_closed_range('today')
+        assert not cache.is_closed_range('7daysAgo')
+
+    def test_eviction(self):
+        cache = GACache(self.path, max_entries=2)
+        cache.put(get_query(dimensions='ga:date'), {'rows': [1]})
+        cache.put(get_query(dimensions='ga:source'), {'rows': [2]})
+        assert cache.get(get_query(dimensions='ga:date')) is not None # most recently used
+        cache.put(get_query(dimensions='ga:medium'), {'rows': [3]})
+        assert cache.get_stats()['entries'] == 2
+        assert cache.get(get_query(dimensions='ga:source')) is None
+        assert cache.get(get_query(dimensions='ga:date')) == {'rows': [1]}
+        assert cache.get(get_query(dimensions='ga:medium')) == {'rows': [3]}
+
+
+if __name__ == '__main__':
+    unittest.main()
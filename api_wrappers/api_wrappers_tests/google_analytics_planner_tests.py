@@ -0,0 +1,95 @@
+import unittest
+from api_wrappers import google_analytics_metrics
+from api_wrappers.google_analytics_planner import GAQueryPlanner
+
+# ga:yearMonth, ga:source -> ga:sessions, ga:pageviews
+DATA = {('201601', 'google'): (10, 30), ('201601', 'bing'): (2, 3), ('201601', 't.co'): (5, 6),
+        ('201602', 'google'): (20, 50), ('201602', 'bing'): (4, 4)}
+
+
+class FakeWrapper:
+    """answers ga:yearMonth[,ga:source] queries for ga:sessions/ga:pageviews from DATA"""
+    MAX_RESULTS_PER_PAGE = 10000
+
+    def __init__(self):
+        self.queries = []
+
+    def ga_get_many(self, queries):
+        self.queries.extend(queries)
+        return [(self.ga_get_all(**query), None) for query in queries]
+
+    def ga_get_all(self, metrics, dimensions, **parameters):
+        metrics = metrics.split(',')
+        indexes = [['ga:sessions', 'ga:pageviews'].index(metric.lower()) for metric in metrics]
+        rows = {}
+        for (year_month, source), values in DATA.items():
+            key = (year_month, source) if ',' in dimensions else (year_month,)
+            totals = rows.setdefault(key, [0] * len(metrics))
+            for position, index in enumerate(indexes):
+                totals[position] += values[index]
+        return {'columnHeaders': [{'name': name} for name in dimensions.split(',') + metrics],
+                'rows': [list(key) + [str(value) for value in values] for key, values in rows.items()],
+                'totalResults': len(rows)}
+
+
+class ZeroRowsWrapper(FakeWrapper):
+    """answers ga:yearMonth,ga:source queries with 1 for every metric, but bing only has values in the query with
+    ga:sessions (GA leaves out the rows whose metrics are all 0)"""
+
+    def ga_get_all(self, metrics, dimensions, **parameters):
+        metrics = metrics.split(',')
+        sources = ['google', 'bing'] if 'ga:sessions' in metrics else ['google']
+        return {'columnHeaders': [{'name': name} for name in dimensions.split(',') + metrics],
+                'rows': [['201601', source] + ['1'] * len(metrics) for source in sources],
+                'totalResults': len(sources)}
+
+
+class GAQueryPlannerTests(unittest.TestCase):
+
+    def test_grouping(self):
+        planner = GAQueryPlanner()
+        planner.add('ga:sessions', filters='ga:medium==organic')
+        planner.add('ga:pageviews,ga:sessions', filters='ga:medium==organic')
+        planner.add('ga:sessions', 'ga:source', sort='-ga:pageviews')
+        assert planner.get_queries() == [{'metrics': 'ga:sessions,ga:pageviews',
+                                          'dimensions': 'ga:yearMonth',
+                                          'filters': 'ga:medium==organic',
+                                          'segment': None},
+                                         {'metrics': 'ga:sessions,ga:pageviews',
+                                          'dimensions': 'ga:yearMonth,ga:source',
+                                          'filters': None,
+                                          'segment': None}]
+
+        planner = GAQueryPlanner()
+        planner.add(','.join('ga:metric{}'.format(index) for index in range(25)))
+        assert [len(query['metrics'].split(',')) for query in planner.get_queries()] == [10, 10, 5]
+
+    def test_execute(self):
+        planner = GAQueryPlanner()
+        planner.add('ga:sessions')
+        planner.add('ga:sessions', 'ga:source', sort='-ga:pageviews')
+        wrapper = FakeWrapper()
+        planner.execute(wrapper, '2016-01-01', '2016-02-29')
+        assert len(wrapper.queries) == 2
+
+        assert planner.get_value('201601', 'ga:sessions') == '17'
+        assert planner.get_value('201602', 'ga:visits') == '24'
+        assert planner.get_value('201603', 'ga:sessions') == '0'
+        assert planner.get_rows('201601', 'ga:sessions', 'ga:source', sort='-ga:pageviews') == \
+            [['google', '10'], ['t.co', '5'], ['bing', '2']]
+        assert planner.get_rows('201602', 'ga:sessions', 'ga:source') == [['bing', '4'], ['google', '20']]
+        self.assertRaises(LookupError, planner.get_value, '201601', 'ga:sessions', filters='ga:medium==organic')
+
+    def test_rows_missing_from_split_queries(self):
+        metrics = ','.join(google_analytics_metrics.INTEGER_METRICS + ('ga:timeOnPage',))
+        planner = GAQueryPlanner()
+        planner.add(metrics, 'ga:source')
+        wrapper = ZeroRowsWrapper()
+        planner.execute(wrapper, '2016-01-01', '2016-01-31')
+        assert len(wrapper.queries) == 2
+        rows = planner.get_rows('201601', metrics, 'ga:source', sort='ga:goalCompletionsAll')
+        assert rows == [['bing'] + ['1'] * 10 + ['0', '0.0'], ['google'] + ['1'] * 12]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import unittest
+import httplib2
+from googleapiclient.errors import HttpError
+from api_wrappers.google_analytics_quota import GARateLimiter, TokenBucket
+
+
+class FakeClock:
+    """clock that only moves when sleep is called"""
+
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def get_http_error(status, reason=None):
+    content = json.dumps({'error': {'errors': [{'reason': reason}], 'code': status}}).encode('utf-8')
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+class GARateLimiterTests(unittest.TestCase):
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, clock=clock)
+        assert bucket.reserve(10) == 0
+        assert bucket.reserve() == 0.1
+        clock.now += 1
+        assert bucket.reserve() == 0
+
+    def test_acquire(self):
+        clock = FakeClock()
+        limiter = GARateLimiter(profile_qps=2, project_qps=10, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            limiter.acquire('ga:1')
+        limiter.acquire('ga:2')
+        stats = limiter.get_stats()
+        assert stats['throttled_waits'] == 2
+        assert stats['quota_consumed'] == 5
+        assert stats['quota_consumed_by_profile'] == {'ga:1': 4, 'ga:2': 1}
+        assert clock.sleeps == [0.5, 0.5]
+
+    def test_retry(self):
+        clock = FakeClock()
+        limiter = GARateLimiter(clock=clock, sleep=clock.sleep, base_delay=1)
+        errors = [get_http_error(403, 'userRateLimitExceeded'), get_http_error(503, 'backendError')]
+
+        def request():
+            if len(errors) > 0:
+                raise errors.pop(0)
+            return {'rows': []}
+
+        assert limiter.execute('ga:1', request) == {'rows': []}
+        assert limiter.get_stats()['retries'] == 2
+        assert limiter.get_stats()['quota_consumed'] == 3
+        assert 0.5 <= clock.sleeps[0] <= 1
+        assert 1 <= clock.sleeps[1] <= 2
+
+    def test_fail_fast(self):
+        clock = FakeClock()
+        limiter = GARateLimiter(clock=clock, sleep=clock.sleep)
+
+        def request():
+            raise get_http_error(403, 'dailyLimitExceeded')
+
+        self.assertRaises(HttpError, limiter.execute, 'ga:1', request)
+        assert limiter.get_stats()['retries'] == 0
+
+        def request():
+            raise get_http_error(400, 'invalidParameter')
+
+        self.assertRaises(HttpError, limiter.execute, 'ga:1', request)
+        assert limiter.get_stats()['retries'] == 0
+
+    def test_max_retries(self):
+        clock = FakeClock()
+        limiter = GARateLimiter(clock=clock, sleep=clock.sleep, max_retries=3)
+
+        def request():
+            raise get_http_error(500)
+
+        self.assertRaises(HttpError, limiter.execute, 'ga:1', request)
+        assert limiter.get_stats()['retries'] == 3
+        assert limiter.get_stats()['quota_consumed'] == 4
+
+    def test_is_retryable(self):
+        assert GARateLimiter.is_retryable(get_http_error(403, 'userRateLimitExceeded'))
+        assert GARateLimiter.is_retryable(get_http_error(403, 'quotaExceeded'))
+        assert GARateLimiter.is_retryable(get_http_error(429))
+        assert GARateLimiter.is_retryable(get_http_error(502))
+        assert GARateLimiter.is_retryable(ConnectionError())
+        assert not GARateLimiter.is_retryable(get_http_error(403, 'dailyLimitExceeded'))
+        assert not GARateLimiter.is_retryable(get_http_error(403, 'insufficientPermissions'))
+        assert not GARateLimiter.is_retryable(get_http_error(400, 'invalidParameter'))
+        assert not GARateLimiter.is_retryable(ValueError())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import httplib2
+from googleapiclient.errors import HttpError
+from api_wrappers.google_analytics_quota import GARateLimiter
+from api_wrappers.google_analytics_reporting_v4 import GAReportingV4Backend
+from api_wrappers.google_analytics_wrapper import GoogleAnalyticsWrapper
+
+SOURCES = ['a', 'b', 'c', 'd', 'e']
+MAX_PAGE_SIZE = 3
+
+
+class FakeReportingHandler(BaseHTTPRequestHandler):
+    """
+    reports:batchGet returning a row per SOURCES value, with metric values of (row number) * (date range number),
+    at most MAX_PAGE_SIZE rows per page
+    """
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        FakeReportingHandler.requests.append((self.path, body))
+        if any(request['viewId'] == 'bad' for request in body['reportRequests']):
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': {'code': 400, 'message': 'bad view', 'status': 'INVALID_ARGUMENT'}})
+                             .encode('utf-8'))
+            return
+
+        reports = []
+        for request in body['reportRequests']:
+            metrics = [metric['expression'] for metric in request['metrics']]
+            ranges = range(1, len(request['dateRanges']) + 1)
+            rows = [{'dimensions': [source],
+                     'metrics': [{'values': [str((index + 1) * number) for _ in metrics]} for number in ranges]}
+                    for index, source in enumerate(SOURCES)]
+            start = int(request.get('pageToken', '0'))
+            end = start + min(request['pageSize'], MAX_PAGE_SIZE)
+            report = {'columnHeader': {'dimensions': [dimension['name'] for dimension in request['dimensions']],
+                                       'metricHeader': {'metricHeaderEntries': [{'name': metric, 'type': 'INTEGER'}
+                                                                                for metric in metrics]}},
+                      'data': {'rows': rows[start:end],
+                               'totals': [{'values': [str(15 * number) for _ in metrics]} for number in ranges],
+                               'rowCount': len(rows)}}
+            if end < len(rows):
+                report['nextPageToken'] = str(end)
+            reports.append(report)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'reports': reports}).encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GAReportingV4BackendTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), FakeReportingHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.root_url = 'http://127.0.0.1:{}/'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeReportingHandler.requests = []
+        self.backend = GAReportingV4Backend(http_factory=httplib2.Http, root_url=self.root_url)
+
+    @staticmethod
+    def get_query(**parameters):
+        return dict({'ids': 'ga:1234', 'start_date': '2016-02-01', 'end_date': '2016-02-29', 'metrics': 'ga:sessions',
+                     'dimensions': 'ga:source', 'max_results': 2}, **parameters)
+
+    def test_report_request(self):
+        report_request = GAReportingV4Backend.get_report_request(self.get_query(sort='-ga:sessions,ga:source',
+                                                                                filters='ga:medium==organic',
+                                                                                samplingLevel='HIGHER_PRECISION',
+                                                                                segment='gaid::-1'))
+        assert report_request['viewId'] == '1234'
+        assert report_request['dateRanges'] == [{'startDate': '2016-02-01', 'endDate': '2016-02-29'}]
+        assert report_request['dimensions'] == [{'name': 'ga:source'}, {'name': 'ga:segment'}]
+        assert report_request['orderBys'] == [{'fieldName': 'ga:sessions', 'sortOrder': 'DESCENDING'},
+                                              {'fieldName': 'ga:source', 'sortOrder': 'ASCENDING'}]
+        assert report_request['filtersExpression'] == 'ga:medium==organic'
+        assert report_request['samplingLevel'] == 'LARGE'
+        assert report_request['segments'] == [{'segmentId': 'gaid::-1'}]
+        assert report_request['pageSize'] == 2
+
+    def test_get_many(self):
+        responses = self.backend.get_many([self.get_query() for _ in range(7)] + [self.get_query(ids='ga:5678')])
+        # 5 + 2 reports of the same view/date range, and 1 of the other view
+        assert len(FakeReportingHandler.requests) == 3
+        assert FakeReportingHandler.requests[0][0] == '/v4/reports:batchGet'
+        assert [len(body['reportRequests']) for _, body in FakeReportingHandler.requests] == [5, 2, 1]
+
+        results, exception = responses[0]
+        assert exception is None
+        assert len(results) == 1
+        assert results[0]['rows'] == [['a', '1'], ['b', '2']]
+        assert results[0]['totalResults'] == 5
+        assert results[0]['totalsForAllResults'] == {'ga:sessions': '15'}
+        assert results[0]['columnHeaders'][1] == {'name': 'ga:sessions', 'columnType': 'METRIC', 'dataType': 'INTEGER'}
+
+    def test_date_ranges(self):
+        results, exception = self.backend.get_many([self.get_query(date_ranges=[('2016-02-01', '2016-02-29'),
+                                                                                ('2015-01-01', '2016-02-29')])])[0]
+        assert len(FakeReportingHandler.requests) == 1
+        assert results[0]['rows'] == [['a', '1'], ['b', '2']]
+        assert results[1]['rows'] == [['a', '2'], ['b', '4']]
+        assert results[1]['totalsForAllResults'] == {'ga:sessions': '30'}
+        assert results[1]['query']['start_date'] == '2015-01-01'
+        self.assertRaises(ValueError, self.backend.get_many, [self.get_query(date_ranges=[('a', 'b')] * 3)])
+
+    def test_paging(self):
+        results, exception = self.backend.get_many([self.get_query(max_results=None)])[0]
+        assert [row[0] for row in results[0]['rows']] == SOURCES
+        assert len(FakeReportingHandler.requests) == 2
+        assert FakeReportingHandler.requests[1][1]['reportRequests'][0]['pageToken'] == '3'
+
+        results, exception = self.backend.get_many([self.get_query(max_results=4)])[0]
+        assert len(results[0]['rows']) == 4
+        assert FakeReportingHandler.requests[3][1]['reportRequests'][0]['pageSize'] == 1
+
+    def test_error(self):
+        responses = self.backend.get_many([self.get_query(ids='ga:bad'), self.get_query()])
+        assert responses[0][0] is None
+        assert isinstance(responses[0][1], HttpError)
+        assert responses[1][1] is None
+
+    def test_wrapper_backend(self):
+        wrapper = GoogleAnalyticsWrapper(profile_id='1234',
+                                         rate_limiter=GARateLimiter(sleep=lambda seconds: None),
+                                         backend=self.backend)
+        results = wrapper.ga_get('ga:sessions', dimensions='ga:source', start_date='2016-02-01', end_date='2016-02-29')
+        assert len(results['rows']) == 5
+        assert len(wrapper.ga_get_all('ga:sessions', dimensions='ga:source')['rows']) == 5
+
+        responses = wrapper.ga_get_many([{'metrics': 'ga:sessions', 'dimensions': 'ga:source'},
+                                         {'metrics': 'ga:sessions', 'dimensions': 'ga:source', 'ids': 'ga:bad'}])
+        assert responses[0][0]['totalsForAllResults'] == {'ga:sessions': '15'}
+        assert isinstance(responses[1][1], HttpError)
+
+        FakeReportingHandler.requests = []
+        lifetime, window = wrapper.ga_get_date_ranges('ga:sessions',
+                                                      [('2015-01-01', '2016-02-29'), ('2016-02-01', '2016-02-29')],
+                                                      dimensions='ga:source',
+                                                      max_results=MAX_PAGE_SIZE)
+        assert len(FakeReportingHandler.requests) == 1
+        assert lifetime['totalsForAllResults'] == {'ga:sessions': '15'}
+        assert window['totalsForAllResults'] == {'ga:sessions': '30'}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from api_wrappers.google_analytics_result import GAResult
+
+RESULTS = {'columnHeaders': [{'name': 'ga:sourceMedium', 'columnType': 'DIMENSION', 'dataType': 'STRING'},
+                             {'name': 'ga:pageViews', 'columnType': 'METRIC', 'dataType': 'INTEGER'},
+                             {'name': 'ga:bounceRate', 'columnType': 'METRIC', 'dataType': 'PERCENT'}],
+           'rows': [['bing / organic', '3', '50.0'],
+                    ['google / organic', '31', '96.42857142857143'],
+                    ['(direct) / (none)', '6', '0.0'],
+                    ['t.co / referral', '3', '100.0']],
+           'totalsForAllResults': {'ga:pageViews': '50', 'ga:bounceRate': '80.0'}}
+
+
+class GAResultTests(unittest.TestCase):
+
+    def setUp(self):
+        self.result = GAResult.build(RESULTS)
+
+    def test_columns(self):
+        assert len(self.result) == 4
+        assert list(self.result.get_column('ga:pageviews')) == [3, 31, 6, 3]
+        assert self.result.get_column('ga:pageViews').typecode == 'q'
+        assert self.result.get_column('ga:bounceRate')[1] == 96.42857142857143
+        assert self.result.get_column('ga:sourceMedium')[0] == 'bing / organic'
+        assert self.result.get_total('ga:pageViews') == 50
+        assert self.result.get_row(1) == ('google / organic', 31, 96.42857142857143)
+        self.assertRaises(LookupError, self.result.get_column, 'ga:sessions')
+
+    def test_sort_top(self):
+        assert self.result.get_order('ga:pageViews', descending=True) == [1, 2, 0, 3]
+        top = self.result.top('ga:pageViews', 2)
+        assert top.get_rows() == [('google / organic', 31, 96.42857142857143), ('(direct) / (none)', 6, 0.0)]
+        assert top.get_total('ga:pageViews') == 50
+        assert list(self.result.sort('ga:bounceRate').get_column('ga:sourceMedium')) == \
+            ['(direct) / (none)', 'bing / organic', 'google / organic', 't.co / referral']
+
+    def test_share(self):
+        assert list(self.result.get_share('ga:pageViews')) == [0.06, 0.62, 0.12, 0.06]
+
+    def test_no_rows(self):
+        result = GAResult.build({'columnHeaders': RESULTS['columnHeaders'], 'totalsForAllResults': {'ga:pageViews': '0'}})
+        assert len(result) == 0
+        assert list(result.get_share('ga:pageViews')) == []
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from api_wrappers import google_analytics_metrics
+from api_wrappers.google_analytics_rollup import GAPageRollup
+
+# ga:pagePath, ga:date, ga:sessions, ga:pageviews, ga:uniquePageviews, ga:newUsers, ga:entrances, ga:bounces,
+# ga:timeOnPage, ga:exits
+ROWS = [['/a/', '20160201', '10', '12', '11', '9', '10', '8', '120.0', '10'],
+        ['/a/', '20160202', '5', '8', '6', '4', '5', '3', '90.0', '5'],
+        ['/a/', '20160210', '1', '2', '2', '1', '1', '1', '30.0', '1'],
+        ['/b/', '20160205', '2', '3', '3', '2', '2', '0', '60.0', '2']]
+
+
+class GAPageRollupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rollup = GAPageRollup.build(ROWS, '2016-02-01', '2016-02-29')
+
+    def test_get_totals(self):
+        totals = self.rollup.get_totals('/a/', '2016-02-01', '2016-02-29')
+        assert totals['ga:sessions'] == 16
+        assert totals['ga:pageviews'] == 22
+        assert totals['ga:timeonpage'] == 240
+
+        totals = self.rollup.get_totals('/a/', '2016-02-02', '2016-02-09')
+        assert totals['ga:sessions'] == 5
+        assert totals['ga:exits'] == 5
+
+        assert self.rollup.get_totals('/a/', '2016-02-03', '2016-02-09')['ga:pageviews'] == 0
+        assert self.rollup.get_totals('/doesntexist/', '2016-02-01', '2016-02-29')['ga:pageviews'] == 0
+
+    def test_get_page_stats(self):
+        stats = self.rollup.get_page_stats('/a/', '2016-02-01', '2016-02-02')
+        assert stats == {'ga:visits': '15',
+                         'ga:pageViews': '20',
+                         'ga:uniquePageViews': '17',
+                         'ga:newUsers': '13',
+                         'ga:bounceRate': repr(100 * 11 / 15),
+                         'ga:avgTimeOnPage': repr(210 / (20 - 15)),
+                         'ga:entrances': '15'}
+
+        stats = self.rollup.get_page_stats('/doesntexist/', '2016-02-01', '2016-02-02')
+        assert stats['ga:pageViews'] == '0'
+        assert stats['ga:bounceRate'] == '0.0'
+        assert stats['ga:avgTimeOnPage'] == '0.0'
+
+    def test_outside_of_range(self):
+        self.assertRaises(ValueError, self.rollup.get_totals, '/a/', '2016-01-31', '2016-02-10')
+        self.assertRaises(ValueError, self.rollup.get_totals, '/a/', '2016-02-01', '2016-03-01')
+
+    def test_metrics(self):
+        assert google_analytics_metrics.get_metric_key('ga:Visits') == 'ga:sessions'
+        assert google_analytics_metrics.get_component_metrics(['ga:pageViews', 'ga:bounceRate', 'ga:avgTimeOnPage']) == \
+            ['ga:pageviews', 'ga:bounces', 'ga:sessions', 'ga:timeonpage', 'ga:exits']
+        self.assertRaises(ValueError, google_analytics_metrics.get_component_metrics, ['ga:users'])
+        assert google_analytics_metrics.format_value('ga:pageViews', 12.0) == '12'
+        assert google_analytics_metrics.format_value('ga:timeOnPage', 12.0) == '12.0'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import re
+import unittest
+from datetime import date
+from api_wrappers import google_analytics_sampling
+from api_wrappers.google_analytics_wrapper import GoogleAnalyticsWrapper
+
+HEADERS = [{'name': 'ga:source', 'columnType': 'DIMENSION', 'dataType': 'STRING'},
+           {'name': 'ga:sessions', 'columnType': 'METRIC', 'dataType': 'INTEGER'},
+           {'name': 'ga:bounces', 'columnType': 'METRIC', 'dataType': 'INTEGER'}]
+
+
+class GASamplingTests(unittest.TestCase):
+
+    def test_split_window(self):
+        assert google_analytics_sampling.split_window(date(2016, 2, 1), date(2016, 2, 29)) == \
+            [(date(2016, 2, 1), date(2016, 2, 15)), (date(2016, 2, 16), date(2016, 2, 29))]
+        assert google_analytics_sampling.split_window(date(2016, 2, 1), date(2016, 2, 2)) == \
+            [(date(2016, 2, 1), date(2016, 2, 1)), (date(2016, 2, 2), date(2016, 2, 2))]
+
+    def test_merge_responses(self):
+        responses = [{'columnHeaders': HEADERS,
+                      'rows': [['google', '10', '5'], ['bing', '2', '2']],
+                      'totalsForAllResults': {'ga:sessions': '12', 'ga:bounces': '7'}},
+                     {'columnHeaders': HEADERS,
+                      'rows': [['google', '30', '5']],
+                      'totalsForAllResults': {'ga:sessions': '30', 'ga:bounces': '5'}}]
+        rows, totals = google_analytics_sampling.merge_responses(['ga:visits', 'ga:bounceRate'],
+                                                                 ['ga:sessions', 'ga:bounces'],
+                                                                 responses)
+        assert sorted(rows) == [['bing', '2', '100.0'], ['google', '40', '25.0']]
+        assert totals == {'ga:visits': '42', 'ga:bounceRate': repr(100 * 12 / 42)}
+
+    def test_sort_rows(self):
+        rows = [['google', '40', '10'], ['bing', '2', '2'], ['yahoo', '40', '1']]
+        assert google_analytics_sampling.sort_rows(list(rows), HEADERS) == \
+            [['bing', '2', '2'], ['google', '40', '10'], ['yahoo', '40', '1']]
+        assert google_analytics_sampling.sort_rows(list(rows), HEADERS, '-ga:sessions,ga:bounces') == \
+            [['yahoo', '40', '1'], ['google', '40', '10'], ['bing', '2', '2']]
+
+
+class GAUnsampledTests(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = []
+        self.wrapper = GoogleAnalyticsWrapper(profile_id='1234', pool_size=2)
+        self.wrapper.execute_query = self.execute_query
+
+    def execute_query(self, query):
+        """
+        the full date range is sampled; each window returns google (5 sessions, 1 bounce) and bing (1 session, 1 bounce);
+        only the top level fields of the field mask (if any) are returned
+        """
+        self.queries.append(query)
+        sampled = query['start_date'] == '2016-02-01' and query['end_date'] == '2016-02-29'
+        headers = [{'name': 'ga:source', 'columnType': 'DIMENSION', 'dataType': 'STRING'}] + \
+                  [{'name': metric, 'columnType': 'METRIC', 'dataType': 'INTEGER'}
+                   for metric in query['metrics'].split(',')]
+        values = {'ga:sessions': {'google': 5, 'bing': 1},
+                  'ga:bounces': {'google': 1, 'bing': 1},
+                  'ga:bounceRate': {}} # only requested by the (sampled) full date range query
+        rows = [[source] + [str(values[metric][source]) for metric in query['metrics'].split(',')]
+                for source in ('google', 'bing')] if not sampled else []
+        results = {'columnHeaders': headers,
+                   'rows': rows,
+                   'totalResults': len(rows),
+                   'containsSampledData': sampled,
+                   'totalsForAllResults': {metric: str(sum(values[metric].values()))
+                                           for metric in query['metrics'].split(',')}}
+        if query.get('fields') is not None:
+            fields = re.findall(r'(\w+)(?:\([^)]*\))?', query['fields'])
+            results = {name: value for name, value in results.items() if name in fields}
+        return results
+
+    def test_sort_by_ratio_metric(self):
+        results = self.wrapper.ga_get('ga:sessions,ga:bounceRate',
+                                      dimensions='ga:source',
+                                      sort='-ga:bounceRate',
+                                      start_date='2016-02-01',
+                                      end_date='2016-02-29',
+                                      split_sampled=True)
+        windows = self.queries[1:]
+        assert len(windows) == 2
+        assert all(window['metrics'] == 'ga:sessions,ga:bounces' for window in windows)
+        # GA rejects sorting by a metric that isn't in the query, so the windows aren't sorted (rows are, locally)
+        assert all(window.get('sort') is None for window in windows)
+        assert [row[0] for row in results['rows']] == ['bing', 'google']
+        assert results['rows'][0][2] == '100.0'
+
+    def test_metric_filters(self):
+        self.assertRaises(ValueError, self.wrapper.ga_get, 'ga:sessions,ga:bounceRate', dimensions='ga:source',
+                          filters='ga:bounceRate>50', start_date='2016-02-01', end_date='2016-02-29',
+                          split_sampled=True)
+        self.assertRaises(ValueError, self.wrapper.ga_get, 'ga:sessions', dimensions='ga:source',
+                          filters='ga:source==google;ga:sessions>3', start_date='2016-02-01',
+                          end_date='2016-02-29', split_sampled=True)
+        # dimension filters are fine
+        results = self.wrapper.ga_get('ga:sessions', dimensions='ga:source', filters='ga:source!=yahoo',
+                                      start_date='2016-02-01', end_date='2016-02-29', split_sampled=True)
+        assert results['totalsForAllResults'] == {'ga:sessions': '12'}
+
+    def test_field_mask(self):
+        results = self.wrapper.ga_get('ga:sessions,ga:bounceRate',
+                                      dimensions='ga:source',
+                                      start_date='2016-02-01',
+                                      end_date='2016-02-29',
+                                      fields=GoogleAnalyticsWrapper.TOTALS_FIELDS,
+                                      split_sampled=True)
+        # the fields needed to detect and split sampled data are requested, whatever the mask
+        assert self.queries[0]['fields'] == 'totalsForAllResults,containsSampledData,' \
+                                            'columnHeaders(name,columnType,dataType)'
+        assert len(self.queries) == 3
+        assert results['totalsForAllResults'] == {'ga:sessions': '12', 'ga:bounceRate': repr(100 * 4 / 12)}
+
+
+if __name__ == '__main__':
+    unittest.main()
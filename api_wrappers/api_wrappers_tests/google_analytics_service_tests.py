@@ -0,0 +1,157 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from oauth2client.client import AccessTokenCredentials
+from api_wrappers.google_analytics_service import GAHttp, GAServicePool, GATransferStats, get_cached_profile, \
+    get_discovery_document
+
+
+class CountingServicePool(GAServicePool):
+    """builds placeholder objects instead of authorized service objects"""
+
+    def __init__(self, size):
+        super().__init__(credentials=None, discovery_document=None, size=size)
+        self.built = 0
+
+    def build_service(self):
+        self.built += 1
+        return object()
+
+
+class GAServicePoolTests(unittest.TestCase):
+
+    def test_reuses_services(self):
+        pool = CountingServicePool(size=3)
+        with pool.service() as first:
+            pass
+        with pool.service() as second:
+            assert second is first
+        assert pool.built == 1
+
+    def test_services_are_not_shared(self):
+        pool = CountingServicePool(size=3)
+        in_use = set()
+        lock = threading.Lock()
+        shared = []
+        concurrent = []
+
+        def use_service(_):
+            with pool.service() as service:
+                with lock:
+                    if id(service) in in_use:
+                        shared.append(service)
+                    in_use.add(id(service))
+                    concurrent.append(len(in_use))
+                time.sleep(0.01)
+                with lock:
+                    in_use.remove(id(service))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(use_service, range(40)))
+
+        assert len(shared) == 0
+        assert max(concurrent) <= 3
+        assert pool.built == 3
+
+
+class GAStartupCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_cached_profile(self):
+        path = os.path.join(self.directory.name, 'analytics_profiles.json')
+        resolved = []
+
+        def resolve_profile():
+            resolved.append(True)
+            return {'account_id': '1', 'webproperty_id': 'UA-1-1', 'profile_id': '1234'}
+
+        assert get_cached_profile('client', resolve_profile, cache_path=path)['profile_id'] == '1234'
+        assert get_cached_profile('client', resolve_profile, cache_path=path)['profile_id'] == '1234'
+        assert len(resolved) == 1
+        get_cached_profile('other client', resolve_profile, cache_path=path)
+        assert len(resolved) == 2
+
+    def test_get_discovery_document_cached(self):
+        path = os.path.join(self.directory.name, 'analytics_discovery.json')
+        with open(path, 'w') as cache_file:
+            cache_file.write('{"name": "analytics"}')
+        assert get_discovery_document(cache_path=path) == '{"name": "analytics"}'
+
+
+class GzipHandler(BaseHTTPRequestHandler):
+    """compresses the response only if 'gzip' is in the User-Agent (as Google APIs do)"""
+    CONTENT = b'{"totalsForAllResults": {"ga:sessions": "10"}}' * 10
+
+    authorizations = []
+
+    def do_GET(self):
+        GzipHandler.authorizations.append(self.headers.get('Authorization'))
+        content = GzipHandler.CONTENT
+        self.send_response(200)
+        if 'gzip' in self.headers.get('User-Agent', '') and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            content = gzip.compress(content)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GAHttpTests(unittest.TestCase):
+
+    def test_gzip_and_stats(self):
+        server = HTTPServer(('127.0.0.1', 0), GzipHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            stats = GATransferStats()
+            http = GAHttp(stats)
+            uri = 'http://127.0.0.1:{}/'.format(server.server_port)
+            response, content = http.request(uri)
+            assert content == GzipHandler.CONTENT
+            response, content = http.request(uri, headers={'User-Agent': 'google-api-python-client/1.5.0'})
+            assert content == GzipHandler.CONTENT
+            assert stats.get_stats() == {'requests': 2,
+                                         'bytes': 2 * len(GzipHandler.CONTENT),
+                                         'gzip_responses': 2,
+                                         'bytes_per_request': len(GzipHandler.CONTENT),
+                                         'max_bytes': len(GzipHandler.CONTENT),
+                                         'size_histogram': [2, 0, 0, 0, 0]}
+            stats.record({}, b'x' * 2048)
+            assert stats.get_stats()['size_histogram'] == [2, 1, 0, 0, 0]
+            assert stats.get_stats()['max_bytes'] == 2048
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_authorized(self):
+        # oauth2client's authorize() wraps request and calls the original with positional arguments
+        server = HTTPServer(('127.0.0.1', 0), GzipHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            GzipHandler.authorizations = []
+            stats = GATransferStats()
+            http = AccessTokenCredentials('token', 'api-wrappers-tests').authorize(GAHttp(stats))
+            response, content = http.request('http://127.0.0.1:{}/'.format(server.server_port))
+            assert response.status == 200
+            assert content == GzipHandler.CONTENT
+            assert GzipHandler.authorizations == ['Bearer token']
+            assert stats.get_stats()['gzip_responses'] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
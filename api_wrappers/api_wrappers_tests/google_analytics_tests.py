@@ -1,5 +1,6 @@
 import json
 import unittest
+import googleapiclient.errors
 from datetime import timedelta, datetime
 from api_wrappers.google_analytics_wrapper import GoogleAnalyticsWrapper
 
@@ -68,6 +69,52 @@ class GoogleAnalyticsTests(unittest.TestCase):
         assert values['ga:avgTimeOnPage'] == '313.52941176470586'
         assert values['ga:entrances'] == '122'
 
+    def test_get_page_stats_bulk(self):
+        start_date = datetime(2015,month=1,day=1)
+        end_date = datetime(2016,month=3,day=1)
+        TestGA.globalGAWrapper.set_date_range(start_date, end_date)
+        url_paths = ['/blog/monitor-the-web-with-google-alerts-and-slack-screenshots/',
+                     '/blog/kanban-vs-scrum-pull-vs-push/',
+                     'doesntexist']
+        page_stats = TestGA.globalGAWrapper.get_page_stats_bulk(url_paths)
+        assert len(page_stats) == 3
+        for url_path in url_paths:
+            assert page_stats[url_path] == TestGA.globalGAWrapper.get_page_stats(url_path)
+
+        values = page_stats['/blog/monitor-the-web-with-google-alerts-and-slack-screenshots/']
+        assert values['ga:visits'] == '122'
+        assert values['ga:pageViews'] == '144'
+        assert values['ga:bounceRate'] == '91.80327868852459'
+
+        pageviews_source = TestGA.globalGAWrapper.get_pageviews_source_bulk(url_paths)
+        for url_path in url_paths:
+            assert pageviews_source[url_path] == TestGA.globalGAWrapper.get_pageviews_source(url_path)
+
+    def test_get_page_rollup(self):
+        url_path = '/blog/monitor-the-web-with-google-alerts-and-slack-screenshots/'
+        rollup = TestGA.globalGAWrapper.get_page_rollup(url_paths=[url_path],
+                                                        start_date=datetime(2015,month=1,day=1),
+                                                        end_date=datetime(2016,month=3,day=1))
+        for start_date, end_date in [(datetime(2015,1,1), datetime(2016,3,1)), (datetime(2016,2,1), datetime(2016,2,29))]:
+            expected = TestGA.globalGAWrapper.get_page_stats(url_path, start_date=start_date, end_date=end_date)
+            values = rollup.get_page_stats(url_path, start_date, end_date)
+            for metric in ['ga:visits', 'ga:pageViews', 'ga:uniquePageViews', 'ga:newUsers', 'ga:entrances']:
+                assert values[metric] == expected[metric]
+            assert round(float(values['ga:bounceRate']), 6) == round(float(expected['ga:bounceRate']), 6)
+            assert round(float(values['ga:avgTimeOnPage']), 6) == round(float(expected['ga:avgTimeOnPage']), 6)
+
+    def test_get_or_filters(self):
+        filters = GoogleAnalyticsWrapper.get_or_filters('ga:pagePath', ['/a/', '/b/', '/a/'])
+        assert filters == ['ga:pagePath==/a/,ga:pagePath==/b/']
+
+        filters = GoogleAnalyticsWrapper.get_or_filters('ga:pagePath', ['/a,b/', '/c;d/', '/e\\f/'])
+        assert filters == ['ga:pagePath==/a\\,b/,ga:pagePath==/c\\;d/,ga:pagePath==/e\\\\f/']
+
+        filters = GoogleAnalyticsWrapper.get_or_filters('ga:pagePath', ['/a/', '/b/', '/c/'], max_length=40)
+        assert filters == ['ga:pagePath==/a/,ga:pagePath==/b/', 'ga:pagePath==/c/']
+        for url_filter in GoogleAnalyticsWrapper.get_or_filters('ga:pagePath', ['/page{}/'.format(i) for i in range(500)]):
+            assert len(url_filter) <= GoogleAnalyticsWrapper.MAX_FILTER_LENGTH
+
     def test_get_url_path_param(self):
         url1 = 'http://intellitect.com/building-single-page-applications-spa-with-the-journey-framework/'
         url2 = 'http://intellitect.com/building-single-page-applications-spa-with-the-journey-framework/?utm_source=social&utm_medium=blog%20article&utm_campaign=Building%20Single%20Page%20Applications%20(SPA)%20with%20the%20Journey%20Framework%20%2F%20Grant%20Erickson'
@@ -131,6 +178,10 @@ class GoogleAnalyticsTests(unittest.TestCase):
     def test_init_without_profile_id(self):
         assert GoogleAnalyticsWrapper().profile_id == TestGA.globalGAWrapper.get_first_profile_id()
 
+    def test_shared_service_pool(self):
+        wrapper = GoogleAnalyticsWrapper(profile_id=TestGA.gaValues.profile_main)
+        assert wrapper.service_pool is TestGA.globalGAWrapper.service_pool
+
     def test_get_account_by_id(self):
         account = TestGA.globalGAWrapper.get_account_by_id(TestGA.gaValues.account)
         assert account['name'] == TestGA.gaValues.account_name
@@ -152,6 +203,104 @@ class GoogleAnalyticsTests(unittest.TestCase):
         assert result['query']['max-results'] == 40
         assert result['totalsForAllResults']['ga:users'] == '75'
 
+    def test_ga_iter_rows(self):
+        rows = list(TestGA.globalGAWrapper.ga_iter_rows(metrics='ga:users',
+                                                        dimensions='ga:date',
+                                                        max_results=10))
+        assert len(rows) == 29
+        assert rows[0][0] == '20160201'
+        assert rows[0][1] == '3'
+        assert rows[28][0] == '20160229'
+
+        result = TestGA.globalGAWrapper.ga_get_all(metrics='ga:users',
+                                                   dimensions='ga:date',
+                                                   max_results=10)
+        assert len(result['rows']) == 29
+        assert result['rows'] == rows
+        assert result['totalsForAllResults']['ga:users'] == '75'
+
+    def test_ga_get_many(self):
+        queries = [{'metrics': 'ga:users'},
+                   {'metrics': 'ga:users', 'dimensions': 'ga:date', 'max_results': 40},
+                   {'metrics': 'ga:doesntexist'}]
+        results = TestGA.globalGAWrapper.ga_get_many(queries)
+        assert len(results) == 3
+
+        result, exception = results[0]
+        assert exception is None
+        assert result['totalsForAllResults']['ga:users'] == '71'
+
+        result, exception = results[1]
+        assert exception is None
+        assert len(result['rows']) == 29
+        assert result['totalsForAllResults']['ga:users'] == '75'
+
+        result, exception = results[2]
+        assert result is None
+        assert isinstance(exception, googleapiclient.errors.HttpError)
+
+    def test_ga_get_concurrent(self):
+        queries = [{'metrics': 'ga:users', 'start_date': datetime(2016,2,1), 'end_date': datetime(2016,2,29)},
+                   {'metrics': 'ga:users', 'dimensions': 'ga:date', 'start_date': '2016-02-01', 'end_date': '2016-02-29'},
+                   {'metrics': 'ga:doesntexist'}] * 5
+        results = TestGA.globalGAWrapper.ga_get_concurrent(queries)
+        assert len(results) == 15
+        for index in range(0, 15, 3):
+            assert results[index][0]['totalsForAllResults']['ga:users'] == '71'
+            assert results[index + 1][0]['totalsForAllResults']['ga:users'] == '75'
+            assert results[index + 2][0] is None
+            assert isinstance(results[index + 2][1], googleapiclient.errors.HttpError)
+
+    def test_ga_get_profiles(self):
+        results = TestGA.globalGAWrapper.ga_get_profiles([TestGA.gaValues.profile_main, '0'],
+                                                         metrics='ga:sessions',
+                                                         start_date='2016-02-01',
+                                                         end_date='2016-02-29')
+        assert results[TestGA.gaValues.profile_main][1] is None
+        assert results['0'][0] is None
+        assert isinstance(results['0'][1], googleapiclient.errors.HttpError)
+
+        portfolio_totals, profile_totals = TestGA.globalGAWrapper.ga_get_portfolio_totals([TestGA.gaValues.profile_main],
+                                                                                          'ga:sessions,ga:bounceRate',
+                                                                                          start_date='2016-02-01',
+                                                                                          end_date='2016-02-29')
+        assert portfolio_totals == profile_totals[TestGA.gaValues.profile_main]
+        assert portfolio_totals['ga:sessions'] == results[TestGA.gaValues.profile_main][0]['totalsForAllResults']['ga:sessions']
+
+    def test_fields(self):
+        results = TestGA.globalGAWrapper.ga_get('ga:users', fields=GoogleAnalyticsWrapper.TOTALS_FIELDS)
+        assert list(results.keys()) == ['totalsForAllResults']
+        results = TestGA.globalGAWrapper.ga_get_all('ga:users', dimensions='ga:date', max_results=10,
+                                                    fields=GoogleAnalyticsWrapper.ROWS_FIELDS)
+        assert 'profileInfo' not in results
+        assert len(results['rows']) == 29
+
+        stats = TestGA.globalGAWrapper.get_transfer_stats()
+        assert stats['requests'] > 0
+        assert stats['gzip_responses'] > 0
+
+    def test_per_call_date_range(self):
+        start_date = datetime(2015,month=1,day=1)
+        end_date = datetime(2016,month=3,day=1)
+        values = TestGA.globalGAWrapper.get_page_stats('/blog/monitor-the-web-with-google-alerts-and-slack-screenshots/',
+                                                       start_date=start_date,
+                                                       end_date=end_date)
+        assert values['ga:visits'] == '122'
+        # the default date range is unchanged
+        assert TestGA.globalGAWrapper.get_start_date() == '2016-02-01'
+        assert TestGA.globalGAWrapper.get_end_date() == '2016-02-29'
+
+    def test_ga_get_split_sampled(self):
+        expected = TestGA.globalGAWrapper.ga_get('ga:sessions,ga:bounceRate', dimensions='ga:source', sort='-ga:sessions')
+        results = TestGA.globalGAWrapper.ga_get('ga:sessions,ga:bounceRate',
+                                                dimensions='ga:source',
+                                                sort='-ga:sessions',
+                                                split_sampled=True)
+        assert len(results['splitReport']) >= 1
+        assert not any(window['sampled'] for window in results['splitReport'])
+        if not expected.get('containsSampledData'):
+            assert results['rows'] == expected['rows']
+
     def test_get_pageviews_source(self):
         page_views, unique_page_views, source_mediums = TestGA.globalGAWrapper.get_pageviews_source('/blog/kanban-vs-scrum-pull-vs-push/')
         assert page_views == 38
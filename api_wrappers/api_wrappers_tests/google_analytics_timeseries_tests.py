@@ -0,0 +1,144 @@
+import math
+import tempfile
+import threading
+import unittest
+from datetime import date, timedelta
+from api_wrappers.google_analytics_timeseries import GATimeSeriesStore, GADailySeries
+
+
+class FakeFetch:
+    """returns a row for every day in the range, with the day of the month as the value"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def __call__(self, start_date, end_date):
+        self.ranges.append((start_date, end_date))
+        day = start_date
+        while day <= end_date:
+            yield [day.strftime('%Y%m%d'), str(day.day)]
+            day += timedelta(days=1)
+
+
+class GATimeSeriesStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_daily(self):
+        store = GATimeSeriesStore(self.directory.name)
+        fetch = FakeFetch()
+        total, rows = store.get_daily('1234', 'ga:sessions', '2016-02-01', '2016-02-29', fetch)
+        assert total == str(sum(range(1, 30)))
+        assert len(rows) == 29
+        assert rows[0] == ['20160201', '1']
+        assert rows[28] == ['20160229', '29']
+        assert len(fetch.ranges) == 1
+
+        # known, final days are answered locally
+        total, rows = store.get_daily('1234', 'ga:sessions', '2016-02-10', '2016-02-11', fetch)
+        assert total == '21'
+        assert rows == [['20160210', '10'], ['20160211', '11']]
+        assert len(fetch.ranges) == 1
+
+        # only the missing days are fetched
+        store.get_daily('1234', 'ga:sessions', '2016-02-20', '2016-03-05', fetch)
+        assert fetch.ranges[1] == (date(2016, 3, 1), date(2016, 3, 5))
+
+        # runs of missing days on both sides of the stored days are fetched separately
+        total, rows = store.get_daily('1234', 'ga:sessions', '2016-01-30', '2016-03-06', fetch)
+        assert fetch.ranges[2:] == [(date(2016, 1, 30), date(2016, 1, 31)), (date(2016, 3, 6), date(2016, 3, 6))]
+        assert len(rows) == 37
+        assert store.fetched_days == 29 + 5 + 3
+
+    def test_persistent(self):
+        fetch = FakeFetch()
+        GATimeSeriesStore(self.directory.name).get_daily('1234', 'ga:pageviews', '2016-02-01', '2016-02-29', fetch)
+        total, rows = GATimeSeriesStore(self.directory.name).get_daily('1234', 'ga:pageviews', '2016-02-01',
+                                                                       '2016-02-29', fetch)
+        assert len(fetch.ranges) == 1
+        assert len(rows) == 29
+        # other profiles/metrics are separate series
+        GATimeSeriesStore(self.directory.name).get_daily('1234', 'ga:sessions', '2016-02-01', '2016-02-29', fetch)
+        GATimeSeriesStore(self.directory.name).get_daily('5678', 'ga:pageviews', '2016-02-01', '2016-02-29', fetch)
+        assert len(fetch.ranges) == 3
+
+    def test_non_additive_total(self):
+        store = GATimeSeriesStore(self.directory.name)
+        fetch = FakeFetch()
+        totals = []
+
+        def fetch_total(start_date, end_date):
+            totals.append((start_date, end_date))
+            return '20'
+
+        # users who visited on several days are counted once in GA's total, so it isn't the sum of the days
+        total, rows = store.get_daily('1234', 'ga:users', '2016-02-01', '2016-02-29', fetch, fetch_total=fetch_total)
+        assert total == '20'
+        assert sum(int(row[1]) for row in rows) == sum(range(1, 30))
+        assert totals == [(date(2016, 2, 1), date(2016, 2, 29))]
+        self.assertRaises(ValueError, store.get_daily, '1234', 'ga:users', '2016-02-01', '2016-02-29', fetch)
+
+    def test_series_fetched_concurrently(self):
+        store = GATimeSeriesStore(self.directory.name)
+        pageviews_fetching = threading.Event()
+        sessions_fetched = threading.Event()
+        waited = []
+
+        def fetch_pageviews(start_date, end_date):
+            # a fetch of one series doesn't keep the others waiting
+            pageviews_fetching.set()
+            waited.append(sessions_fetched.wait(5))
+            return FakeFetch()(start_date, end_date)
+
+        def fetch_sessions(start_date, end_date):
+            sessions_fetched.set()
+            return FakeFetch()(start_date, end_date)
+
+        thread = threading.Thread(target=store.get_daily,
+                                  args=('1234', 'ga:pageviews', '2016-02-01', '2016-02-29', fetch_pageviews))
+        thread.start()
+        pageviews_fetching.wait(5)
+        store.get_daily('1234', 'ga:sessions', '2016-02-01', '2016-02-29', fetch_sessions)
+        thread.join()
+        assert waited == [True]
+        assert store.fetched_days == 58
+
+    def test_mutable_days_are_refetched(self):
+        store = GATimeSeriesStore(self.directory.name, latency_days=2)
+        fetch = FakeFetch()
+        today = date.today()
+        store.get_daily('1234', 'ga:sessions', today - timedelta(days=10), today, fetch)
+        store.get_daily('1234', 'ga:sessions', today - timedelta(days=10), today, fetch)
+        assert fetch.ranges[1] == (today - timedelta(days=2), today)
+
+    def test_days_without_rows(self):
+        store = GATimeSeriesStore(self.directory.name)
+        total, rows = store.get_daily('1234', 'ga:sessions', '2016-02-01', '2016-02-03', lambda start, end: [])
+        assert total == '0'
+        assert rows == [['20160201', '0'], ['20160202', '0'], ['20160203', '0']]
+
+    def test_daily_series(self):
+        series = GADailySeries()
+        series.set(10, 1, final=True)
+        series.set(8, 2, final=False)
+        series.set(12, 3, final=True)
+        assert series.first_day == 8
+        assert series.get(8) == 2
+        assert math.isnan(series.get(9))
+        assert math.isnan(series.get(13))
+        assert series.get_missing_days(7, 13) == [7, 8, 9, 11, 13]
+        assert series.get_missing_ranges(7, 13) == [[7, 9], [11, 11], [13, 13]]
+        assert list(series.slice(10, 12))[0] == 1
+
+        loaded = GADailySeries.from_bytes(series.to_bytes())
+        assert loaded.first_day == 8
+        assert loaded.get(12) == 3
+        assert loaded.get_missing_days(7, 13) == [7, 8, 9, 11, 13]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from api_wrappers.mailchimp_cache import MailchimpCache
+
+CAMPAIGN = 'https://us12.api.mailchimp.com/3.0/campaigns/17c90e3ad8/'
+REPORT = 'https://us12.api.mailchimp.com/3.0/reports/17c90e3ad8/'
+
+
+def get_send_time(days_ago):
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat(timespec='seconds')
+
+
+class MailchimpCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'mailchimp_cache.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_put(self):
+        cache = MailchimpCache(self.path)
+        assert cache.get(REPORT, {}) is None
+        cache.put(REPORT, {}, {'id': '17c90e3ad8'}, etag='"abc"')
+        assert cache.get(REPORT, {}) == ({'id': '17c90e3ad8'}, '"abc"', False)
+        assert cache.get(REPORT, {'fields': 'id'}) is None
+        assert MailchimpCache(self.path).get(REPORT, {})[0] == {'id': '17c90e3ad8'}
+        stats = cache.get_stats()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+        assert stats['bytes_saved'] == len('{"id": "17c90e3ad8"}')
+
+    def test_expires(self):
+        cache = MailchimpCache(self.path, fresh_days=7, fresh_max_age=3600, max_age=86400)
+        now = time.time()
+        # campaigns (their report_summary) and reports are refreshed hourly in the first week after they were sent,
+        # then daily
+        assert cache.get_expires({'status': 'sent', 'send_time': get_send_time(1)}, now) == now + 3600
+        assert cache.get_expires({'status': 'sent', 'send_time': get_send_time(8)}, now) == now + 86400
+        assert cache.get_expires({'send_time': get_send_time(8)}, now) == now + 86400
+        # campaigns that weren't sent yet, and anything else, are refreshed hourly
+        assert cache.get_expires({'status': 'save', 'send_time': ''}, now) == now + 3600
+        assert cache.get_expires({}, now) == now + 3600
+
+    def test_sent_campaign_expires(self):
+        cache = MailchimpCache(self.path, fresh_max_age=-1, max_age=-1)
+        cache.put(CAMPAIGN, {}, {'status': 'sent', 'send_time': get_send_time(30), 'report_summary': {'opens': 1}})
+        assert cache.get(CAMPAIGN, {})[2]
+
+    def test_revalidate(self):
+        cache = MailchimpCache(self.path, fresh_max_age=-1)
+        cache.put(REPORT, {}, {'send_time': get_send_time(1)}, etag='"abc"')
+        assert cache.get(REPORT, {})[2]
+        cache.fresh_max_age = 3600
+        cache.revalidate(REPORT, {})
+        assert not cache.get(REPORT, {})[2]
+        assert cache.get_stats()['revalidations'] == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from api_wrappers.mailchimp_links import MailchimpClickIndex, normalize_url
+
+
+def get_link(url, total_clicks=1, unique_clicks=1):
+    return {'url': url,
+            'total_clicks': total_clicks,
+            'click_percentage': total_clicks / 10,
+            'unique_clicks': unique_clicks,
+            'unique_click_percentage': unique_clicks / 10}
+
+
+class MailchimpLinksTests(unittest.TestCase):
+
+    def test_normalize_url(self):
+        assert normalize_url('HTTP://IntelliTect.com/code-reviews/?utm_source=newsletter1&utm_medium=email'
+                             '&mc_cid=17c90e3ad8&mc_eid=[UNIQID]') == \
+            ('http://intellitect.com/code-reviews', {'utm_source': 'newsletter1',
+                                                     'utm_medium': 'email',
+                                                     'mc_cid': '17c90e3ad8',
+                                                     'mc_eid': '[UNIQID]'})
+        assert normalize_url('http://www.testthisblog.com?utm_source=newsletters')[0] == 'http://www.testthisblog.com'
+        assert normalize_url('http://www.testthisblog.com/')[0] == 'http://www.testthisblog.com'
+        # other parameters are kept (sorted), and the path's case matters
+        assert normalize_url('https://example.com/Page?b=2&utm_campaign=x&a=1#top')[0] == \
+            'https://example.com/Page?a=1&b=2'
+
+    def test_click_index(self):
+        index = MailchimpClickIndex.build('17c90e3ad8',
+                                          [get_link('http://intellitect.com/code-reviews/?utm_source=newsletter1'
+                                                    '&mc_cid=17c90e3ad8&mc_eid=[UNIQID]', 2, 2),
+                                           get_link('http://intellitect.com/code-reviews?utm_source=newsletters'
+                                                    '&mc_cid=17c90e3ad8&mc_eid=[UNIQID]', 3, 1),
+                                           get_link('https://medium.com', 0, 0)])
+        assert len(index) == 2
+        assert index.urls == ['http://intellitect.com/code-reviews', 'https://medium.com']
+        assert index.get('http://intellitect.com/code-reviews/?utm_source=newsletter1', 'total_clicks') == 5
+        assert index.get('http://IntelliTect.com/code-reviews', 'unique_clicks') == 3
+        assert abs(index.get('http://intellitect.com/code-reviews', 'click_percentage') - 0.5) < 1e-9
+        assert index.get_link('https://medium.com/')['total_clicks'] == 0
+        assert 'https://medium.com/?utm_source=newsletters' in index
+        assert 'https://medium.com/other' not in index
+        self.assertRaises(LookupError, index.get, 'https://medium.com/other', 'total_clicks')
+        assert index.columns['total_clicks'].typecode == 'q'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,453 @@
+import csv
+import io
+import json
+import tarfile
+import threading
+import time
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from datetime import datetime, timezone
+from api_wrappers.mailchimp_cache import MailchimpCache
+from api_wrappers.mailchimp_store import MailchimpCampaignStore
+from api_wrappers.mailchimp_wrapper import MailchimpWrapper
+
+CAMPAIGNS = [{'id': 'campaign{}'.format(index),
+              'status': 'sent',
+              'recipients': {'list_id': 'list{}'.format(index % 2)},
+              'create_time': '2015-12-{:02d}T10:00:00+00:00'.format(index + 1),
+              'send_time': '2016-01-{:02d}T10:00:00+00:00'.format(index + 1)}
+             for index in range(25)]
+LINKS = [{'url': 'http://example.com/{}'.format(index % 5),
+          'total_clicks': 1,
+          'click_percentage': 0.1,
+          'unique_clicks': 1,
+          'unique_click_percentage': 0.1}
+         for index in range(7)]
+MEMBERS = [{'id': 'member{}'.format(index),
+            'email_address': 'member{}@example.com'.format(index),
+            'status': 'subscribed',
+            'last_changed': '2016-02-{:02d}T10:00:00+00:00'.format(index + 1),
+            'stats': {'avg_open_rate': index / 10, 'avg_click_rate': 0}}
+           for index in range(23)]
+# path -> (items key, items) of the collections that are paged with count/offset
+COLLECTIONS = {'/3.0/campaigns': ('campaigns', CAMPAIGNS),
+               '/3.0/reports/campaign1/click-details/': ('urls_clicked', LINKS),
+               '/3.0/lists/list1/members': ('members', MEMBERS)}
+
+
+class FakeMailchimpHandler(BaseHTTPRequestHandler):
+    """
+    local stand-in for the Mailchimp API (keep-alive, HTTP/1.1); records the requests and connections it gets
+    """
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    connections = set()
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    throttled = {} # path -> number of times it still responds with 429
+    failing_pages = {} # path -> offset of the page of the collection that responds with 500 (once)
+    delay = 0
+    batches = {} # batch id -> [number of status checks before it is finished, gzipped tar archive of responses]
+    batch_status_checks = 1 # number of status checks before a new batch is finished
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        FakeMailchimpHandler.requests.append((url.path, body, dict(self.headers)))
+        if url.path != '/3.0/batches':
+            self.send_json(404, {'title': 'Resource Not Found', 'status': 404})
+            return
+        batch_id = 'batch{}'.format(len(FakeMailchimpHandler.batches))
+        FakeMailchimpHandler.batches[batch_id] = [FakeMailchimpHandler.batch_status_checks,
+                                                  FakeMailchimpHandler.get_batch_archive(body['operations'])]
+        self.send_json(200, {'id': batch_id, 'status': 'pending'})
+
+    @staticmethod
+    def get_batch_archive(operations):
+        """
+        :return: gzipped tar archive with the responses of the operations, two per file
+        """
+        archive_bytes = io.BytesIO()
+        with tarfile.open(fileobj=archive_bytes, mode='w:gz') as archive:
+            for start in range(0, len(operations), 2):
+                responses = []
+                for operation in operations[start:start + 2]:
+                    parts = operation['path'].strip('/').split('/')
+                    if parts[0] == 'campaigns' and len(parts) == 2 and parts[1].startswith('campaign'):
+                        status_code, response = 200, {'id': parts[1], 'params': operation['params']}
+                    else:
+                        status_code, response = 404, {'title': 'Resource Not Found', 'status': 404}
+                    responses.append({'status_code': status_code,
+                                      'operation_id': operation['operation_id'],
+                                      'response': json.dumps(response)})
+                content = json.dumps(responses).encode('utf-8')
+                info = tarfile.TarInfo('{}.json'.format(start))
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+        return archive_bytes.getvalue()
+
+    def do_GET(self):
+        with FakeMailchimpHandler.lock:
+            FakeMailchimpHandler.in_flight += 1
+            FakeMailchimpHandler.max_in_flight = max(FakeMailchimpHandler.max_in_flight, FakeMailchimpHandler.in_flight)
+        try:
+            time.sleep(FakeMailchimpHandler.delay)
+            self.respond()
+        finally:
+            with FakeMailchimpHandler.lock:
+                FakeMailchimpHandler.in_flight -= 1
+
+    def respond(self):
+        FakeMailchimpHandler.connections.add(self.client_address)
+        url = urllib.parse.urlparse(self.path)
+        FakeMailchimpHandler.requests.append((url.path, urllib.parse.parse_qs(url.query), dict(self.headers)))
+        parameters = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        if FakeMailchimpHandler.throttled.get(url.path, 0) > 0:
+            FakeMailchimpHandler.throttled[url.path] -= 1
+            self.send_json(429, {'title': 'Too Many Requests', 'status': 429})
+        elif url.path == '/3.0/':
+            self.send_json(200, {'account_id': '1234', 'account_name': 'fake'})
+        elif len(parts) == 3 and parts[1] == 'batches' and parts[2] in FakeMailchimpHandler.batches:
+            batch = FakeMailchimpHandler.batches[parts[2]]
+            if batch[0] > 0:
+                batch[0] -= 1
+                self.send_json(200, {'id': parts[2], 'status': 'started'})
+            else:
+                self.send_json(200, {'id': parts[2],
+                                     'status': 'finished',
+                                     'response_body_url': 'http://{}:{}/download/{}.tar.gz'
+                                     .format(*self.server.server_address, parts[2])})
+        elif len(parts) == 2 and parts[0] == 'download':
+            content = FakeMailchimpHandler.batches[parts[1].split('.')[0]][1]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-gzip')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif url.path in COLLECTIONS:
+            items_key, items = COLLECTIONS[url.path]
+            items = [item for item in items if FakeMailchimpHandler.matches(item, parameters)]
+            offset = int(parameters.get('offset', ['0'])[0])
+            count = int(parameters.get('count', ['10'])[0])
+            if FakeMailchimpHandler.failing_pages.get(url.path) == offset:
+                del FakeMailchimpHandler.failing_pages[url.path]
+                self.send_json(500, {'title': 'Internal Server Error', 'status': 500})
+            else:
+                self.send_json(200, {items_key: items[offset:offset + count], 'total_items': len(items)})
+        elif len(parts) == 3 and parts[1] in ('campaigns', 'reports') and parts[2].startswith('campaign'):
+            etag = '"{}-{}"'.format(parts[1], parts[2])
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+            else:
+                self.send_json(200, {'id': parts[2], 'type': parts[1]}, headers={'ETag': etag})
+        else:
+            self.send_json(404, {'title': 'Resource Not Found', 'status': 404})
+
+    @staticmethod
+    def matches(item, parameters):
+        """
+        :return: True if the item matches the (list_id, status, since/before_send_time, since_create_time) filters
+            of the request
+        """
+        if 'list_id' in parameters and item['recipients']['list_id'] != parameters['list_id'][0]:
+            return False
+        if 'status' in parameters and item['status'] != parameters['status'][0]:
+            return False
+        if 'before_send_time' in parameters and item['send_time'] >= parameters['before_send_time'][0]:
+            return False
+        if 'since_create_time' in parameters and item['create_time'] <= parameters['since_create_time'][0]:
+            return False
+        if 'since_send_time' in parameters and item['send_time'] <= parameters['since_send_time'][0]:
+            return False
+        if 'since_last_changed' in parameters and item['last_changed'] <= parameters['since_last_changed'][0]:
+            return False
+        return True
+
+    def send_json(self, status, content, headers=None):
+        content = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MailchimpLocalTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMailchimpHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeMailchimpHandler.requests = []
+        FakeMailchimpHandler.connections = set()
+        FakeMailchimpHandler.max_in_flight = 0
+        FakeMailchimpHandler.throttled = {}
+        FakeMailchimpHandler.failing_pages = {}
+        FakeMailchimpHandler.delay = 0
+        FakeMailchimpHandler.batches = {}
+        FakeMailchimpHandler.batch_status_checks = 1
+        self.sleeps = []
+        self.mailchimp = self.get_wrapper()
+
+    def get_wrapper(self, api_key='0123456789abcdef-us99', cache=None, store=None):
+        mailchimp = MailchimpWrapper(api_key=api_key,
+                                     sleep=lambda seconds: self.sleeps.append(seconds),
+                                     cache=cache,
+                                     store=store)
+        mailchimp.config.api_root = 'http://127.0.0.1:{}/3.0/'.format(self.server.server_port)
+        return mailchimp
+
+    def test_shared_session(self):
+        assert self.mailchimp.session is self.get_wrapper(api_key='fedcba9876543210-us99').session
+        assert self.mailchimp.session is not self.get_wrapper(api_key='0123456789abcdef-us98').session
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            assert self.mailchimp.generic_get('')['account_id'] == '1234'
+        self.get_wrapper().generic_get('')
+        self.assertRaises(requests.exceptions.HTTPError, self.mailchimp.generic_get, 'doesntexist')
+        # every call reused the same connection
+        assert len(FakeMailchimpHandler.requests) == 5
+        assert len(FakeMailchimpHandler.connections) == 1
+        assert 'gzip' in FakeMailchimpHandler.requests[0][2]['Accept-Encoding']
+        assert FakeMailchimpHandler.requests[0][2]['Authorization'].startswith('Basic ')
+
+
+    def test_generic_iter(self):
+        campaigns = self.mailchimp.generic_iter('campaigns', items_key='campaigns', fields='campaigns.id', page_size=10)
+        assert next(campaigns)['id'] == 'campaign0'
+        assert [campaign['id'] for campaign in campaigns] == ['campaign{}'.format(index) for index in range(1, 25)]
+        assert [(request[1]['offset'], request[1]['count']) for request in FakeMailchimpHandler.requests] == \
+            [(['0'], ['10']), (['10'], ['10']), (['20'], ['10'])]
+        assert FakeMailchimpHandler.requests[0][1]['fields'] == ['campaigns.id,total_items']
+        self.assertRaises(ValueError, list, self.mailchimp.generic_iter('campaigns', 'campaigns', page_size=1001))
+
+    def test_get_campaigns(self):
+        assert len(self.mailchimp.get_campaigns(pagination_count=7)) == 25
+        assert [campaign['id'] for campaign in self.mailchimp.get_campaigns(list_id='list1')] == \
+            ['campaign{}'.format(index) for index in range(1, 25, 2)]
+        # the filters are applied by the API
+        assert FakeMailchimpHandler.requests[-1][1]['list_id'] == ['list1']
+        assert len(FakeMailchimpHandler.requests) == 5
+        campaigns = self.mailchimp.get_campaigns(list_id='list0',
+                                                 status='sent',
+                                                 since_send_time='2016-01-10T10:00:00+00:00',
+                                                 before_send_time='2016-01-15T10:00:00+00:00')
+        assert [campaign['id'] for campaign in campaigns] == ['campaign10', 'campaign12']
+        assert self.mailchimp.get_campaigns(status='save') == []
+
+    def test_get_campaigns_store(self):
+        mailchimp = self.get_wrapper(store=MailchimpCampaignStore(':memory:'))
+        assert len(mailchimp.get_campaigns(list_id='list0')) == 13
+        mailchimp.sync_campaigns(mailchimp.store, list_id='list0')
+        FakeMailchimpHandler.requests = []
+        # answered from the store's list_id/send_time index, without any request
+        campaigns = mailchimp.get_campaigns(list_id='list0',
+                                            status='sent',
+                                            since_send_time='2016-01-10T10:00:00+00:00',
+                                            before_send_time='2016-01-15T10:00:00+00:00')
+        assert [campaign['id'] for campaign in campaigns] == ['campaign10', 'campaign12']
+        assert mailchimp.get_campaigns(list_id='list0', status='save') == []
+        assert len(FakeMailchimpHandler.requests) == 0
+        # other lists weren't synced
+        assert len(mailchimp.get_campaigns(list_id='list1')) == 12
+        assert len(FakeMailchimpHandler.requests) == 1
+
+    def test_get_campaign_links(self):
+        links = self.mailchimp.get_campaign_links('campaign1', page_size=3)
+        assert links['campaign_id'] == 'campaign1'
+        assert len(links['urls_clicked']) == 5
+        assert links['urls_clicked']['http://example.com/0']['total_clicks'] == 2
+        assert len(FakeMailchimpHandler.requests) == 3
+
+
+    def test_get_click_index(self):
+        index = self.mailchimp.get_click_index('campaign1', page_size=3)
+        assert index.campaign_id == 'campaign1'
+        assert len(index) == 5
+        assert index.get('http://EXAMPLE.com/0/?utm_source=newsletter&mc_cid=campaign1', 'total_clicks') == 2
+        assert FakeMailchimpHandler.requests[0][1]['fields'][0].startswith('urls_clicked.url,')
+
+        bulk = self.mailchimp.get_campaigns_bulk(['campaign1'], campaign=False, report=False, click_index=True)
+        assert len(bulk['campaign1'][0]['click_index']) == 5
+
+    def test_export_members(self):
+        output = io.StringIO()
+        stats = self.mailchimp.export_members('list1', output, page_size=10)
+        lines = output.getvalue().splitlines()
+        assert len(lines) == 23
+        assert json.loads(lines[0]) == MEMBERS[0]
+        assert stats['members'] == 23 and stats['offset'] == 23
+        assert stats['members_per_second'] > 0
+        assert len(FakeMailchimpHandler.requests) == 3
+        assert FakeMailchimpHandler.requests[0][1]['fields'][0].startswith('members.id,members.email_address,')
+        assert FakeMailchimpHandler.requests[0][1]['fields'][0].endswith(',members.stats.avg_open_rate,'
+                                                                         'members.stats.avg_click_rate,total_items')
+
+        output = io.StringIO()
+        stats = self.mailchimp.export_members('list1',
+                                              output,
+                                              output_format='csv',
+                                              columns=['email_address', 'stats/avg_open_rate', 'doesntexist'],
+                                              since_last_changed='2016-02-20T10:00:00+00:00')
+        assert list(csv.reader(io.StringIO(output.getvalue()))) == [['email_address', 'stats/avg_open_rate', 'doesntexist'],
+                                                                    ['member20@example.com', '2.0', ''],
+                                                                    ['member21@example.com', '2.1', ''],
+                                                                    ['member22@example.com', '2.2', '']]
+        assert stats['members'] == 3
+
+        # resumed: no header row, starting at the offset
+        output = io.StringIO()
+        stats = self.mailchimp.export_members('list1', output, output_format='csv', columns=['id'], offset=20)
+        assert output.getvalue().split() == ['member20', 'member21', 'member22']
+        assert stats['offset'] == 23
+        self.assertRaises(ValueError, self.mailchimp.export_members, 'list1', output, output_format='xml')
+
+    def test_export_members_resume(self):
+        # the second page fails: the export is resumed from the offset set on the exception
+        FakeMailchimpHandler.failing_pages = {'/3.0/lists/list1/members': 10}
+        output = io.StringIO()
+        with self.assertRaises(requests.exceptions.HTTPError) as context:
+            self.mailchimp.export_members('list1', output, output_format='csv', columns=['id'], page_size=10)
+        assert context.exception.offset == 10
+        stats = self.mailchimp.export_members('list1',
+                                              output,
+                                              output_format='csv',
+                                              columns=['id'],
+                                              page_size=10,
+                                              offset=context.exception.offset)
+        assert output.getvalue().split() == ['id'] + [member['id'] for member in MEMBERS]
+        assert stats['members'] == 13 and stats['offset'] == 23
+
+    def test_retry_throttled(self):
+        FakeMailchimpHandler.throttled = {'/3.0/campaigns/campaign1/': 2}
+        assert self.mailchimp.get_campaign('campaign1')['id'] == 'campaign1'
+        assert len(self.sleeps) == 2
+        assert 0.5 <= self.sleeps[0] <= 1 and 1 <= self.sleeps[1] <= 2
+
+        FakeMailchimpHandler.throttled = {'/3.0/campaigns/campaign1/': 10}
+        self.mailchimp.max_retries = 1
+        self.assertRaises(requests.exceptions.HTTPError, self.mailchimp.get_campaign, 'campaign1')
+
+    def test_get_campaigns_bulk(self):
+        FakeMailchimpHandler.delay = 0.05
+        FakeMailchimpHandler.throttled = {'/3.0/reports/campaign3/': 1}
+        campaign_ids = ['campaign{}'.format(index) for index in range(15)] + ['doesntexist', 'campaign0']
+        bulk = self.mailchimp.get_campaigns_bulk(campaign_ids, max_workers=20)
+        assert len(bulk) == 16
+        results, exception = bulk['campaign3']
+        assert exception is None
+        assert results == {'campaign': {'id': 'campaign3', 'type': 'campaigns'},
+                           'report': {'id': 'campaign3', 'type': 'reports'}}
+        assert bulk['doesntexist'][0] is None
+        assert isinstance(bulk['doesntexist'][1], requests.exceptions.HTTPError)
+        assert 1 < FakeMailchimpHandler.max_in_flight <= MailchimpWrapper.MAX_CONNECTIONS
+
+        bulk = self.mailchimp.get_campaigns_bulk(['campaign1'], campaign=False, report=False, links=True)
+        assert bulk['campaign1'][0]['links']['campaign_id'] == 'campaign1'
+
+    def test_batch_get(self):
+        operations = [{'endpoint': 'campaigns/campaign{}'.format(index), 'fields': 'id'} for index in range(4)] + \
+                     [{'endpoint': 'doesntexist'}]
+        results = list(self.mailchimp.batch_get(operations))
+        assert len(results) == 5
+        assert results[1] == (1, {'id': 'campaign1', 'params': {'fields': 'id'}}, None)
+        index, results, exception = results[4]
+        assert index == 4 and results is None
+        assert isinstance(exception, requests.exceptions.HTTPError)
+
+        paths = [request[0] for request in FakeMailchimpHandler.requests]
+        assert paths == ['/3.0/batches', '/3.0/batches/batch0', '/3.0/batches/batch0', '/download/batch0.tar.gz']
+        assert FakeMailchimpHandler.requests[0][1]['operations'][0] == {'method': 'GET',
+                                                                       'path': '/campaigns/campaign0',
+                                                                       'operation_id': '0',
+                                                                       'params': {'fields': 'id'}}
+        # the archive url is pre-signed, so it's fetched without the api key, and not on the api's connection
+        assert 'Authorization' not in FakeMailchimpHandler.requests[3][2]
+        assert len(FakeMailchimpHandler.connections) == 2
+        assert self.sleeps == [1, 2]
+
+    def test_batch_get_timeout(self):
+        FakeMailchimpHandler.batch_status_checks = 1000000 # never finishes
+        with self.assertRaises(TimeoutError) as context:
+            list(self.mailchimp.batch_get([{'endpoint': 'campaigns/campaign1'}], max_wait=100))
+        assert 'batch0' in str(context.exception)
+        assert self.sleeps == [1, 2, 4, 8, 16, 32, 32, 5]
+
+    def test_cache(self):
+        cache = MailchimpCache(':memory:')
+        mailchimp = self.get_wrapper(cache=cache)
+        assert mailchimp.get_campaign_report('campaign1') == {'id': 'campaign1', 'type': 'reports'}
+        assert mailchimp.get_campaign_report('campaign1') == {'id': 'campaign1', 'type': 'reports'}
+        assert len(FakeMailchimpHandler.requests) == 1
+        assert cache.get_stats()['hits'] == 1 and cache.get_stats()['misses'] == 1
+        # other fields are cached separately, and calls that don't use the cache are always sent
+        mailchimp.generic_get('reports/campaign1/', fields='id', use_cache=True)
+        mailchimp.generic_get('reports/campaign1/')
+        assert len(FakeMailchimpHandler.requests) == 3
+
+        # expired responses are revalidated with their ETag
+        cache.fresh_max_age = -1
+        cache.clear()
+        assert mailchimp.get_campaign('campaign2')['id'] == 'campaign2'
+        assert mailchimp.get_campaign('campaign2')['id'] == 'campaign2'
+        assert FakeMailchimpHandler.requests[-1][2]['If-None-Match'] == '"campaigns-campaign2"'
+        stats = cache.get_stats()
+        assert stats['revalidations'] == 1
+        assert stats['bytes_saved'] > 0
+        assert stats['entries'] == 1
+
+    def test_sync_campaigns(self):
+        store = MailchimpCampaignStore(':memory:')
+        assert len(self.mailchimp.sync_campaigns(store)) == 25
+        assert store.get_report('1234', 'campaign3') == {'id': 'campaign3', 'type': 'reports'}
+        assert store.get_watermark('1234') == ('2015-12-25T10:00:00+00:00', '2016-01-25T10:00:00+00:00')
+
+        # nothing new: only the campaigns after the watermark or sent in the last refresh_days are requested (none),
+        # and old reports aren't refreshed
+        FakeMailchimpHandler.requests = []
+        assert len(self.mailchimp.sync_campaigns(store)) == 25
+        assert [request[0] for request in FakeMailchimpHandler.requests] == ['/3.0/campaigns'] * 3
+        assert FakeMailchimpHandler.requests[0][1]['since_create_time'] == ['2015-12-25T10:00:00+00:00']
+        assert FakeMailchimpHandler.requests[1][1]['since_send_time'] == ['2016-01-25T10:00:00+00:00']
+        assert FakeMailchimpHandler.requests[2][1]['since_send_time'][0] > '2016-01-25T10:00:00+00:00'
+
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        CAMPAIGNS.append({'id': 'campaign25', 'recipients': {'list_id': 'list1'}, 'create_time': now, 'send_time': now})
+        self.addCleanup(CAMPAIGNS.pop)
+        FakeMailchimpHandler.requests = []
+        campaigns = self.mailchimp.sync_campaigns(store, list_id='list1')
+        assert len(campaigns) == 13
+        assert campaigns[-1]['id'] == 'campaign25'
+        assert FakeMailchimpHandler.requests[0][1]['list_id'] == ['list1']
+        assert store.get_report('1234', 'campaign25') == {'id': 'campaign25', 'type': 'reports'}
+
+        # the recently sent campaign (its report_summary) and its report are refreshed until it is older than
+        # refresh_days
+        CAMPAIGNS[-1]['report_summary'] = {'opens': 10}
+        FakeMailchimpHandler.requests = []
+        campaigns = self.mailchimp.sync_campaigns(store, list_id='list1')
+        assert campaigns[-1]['report_summary'] == {'opens': 10}
+        assert [request[0] for request in FakeMailchimpHandler.requests][-1] == '/3.0/reports/campaign25/'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from api_wrappers.mailchimp_store import MailchimpCampaignStore
+
+
+def get_campaign(campaign_id, list_id='list1', send_time=None):
+    return {'id': campaign_id,
+            'recipients': {'list_id': list_id},
+            'create_time': '2016-01-01T10:00:00+00:00',
+            'send_time': send_time or ''}
+
+
+class MailchimpCampaignStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store = MailchimpCampaignStore(':memory:')
+
+    def test_upsert(self):
+        self.store.upsert_campaigns('1234', [get_campaign('b', send_time='2016-01-03T10:00:00+00:00'),
+                                             get_campaign('a', send_time='2016-01-02T10:00:00+00:00'),
+                                             get_campaign('draft'),
+                                             get_campaign('c', list_id='list2')])
+        self.store.upsert_report('1234', 'a', {'emails_sent': 3})
+        self.store.upsert_campaigns('1234', [dict(get_campaign('a', send_time='2016-01-02T10:00:00+00:00'),
+                                                  status='sent')])
+        assert [campaign['id'] for campaign in self.store.get_campaigns('1234', list_id='list1')] == ['a', 'b', 'draft']
+        assert self.store.get_campaigns('1234', list_id='list1')[0]['status'] == 'sent'
+        # the report is kept when the campaign is replaced
+        assert self.store.get_report('1234', 'a') == {'emails_sent': 3}
+        assert self.store.get_report('1234', 'b') is None
+        assert self.store.get_campaigns('5678') == []
+        assert self.store.get_sent_since('1234', '2016-01-03T00:00:00+00:00') == ['b']
+        assert [campaign['id'] for campaign in self.store.get_campaigns('1234',
+                                                                        status='sent',
+                                                                        since_send_time='2016-01-01T00:00:00+00:00',
+                                                                        before_send_time='2016-01-03T00:00:00+00:00')] \
+            == ['a']
+
+    def test_watermark(self):
+        assert self.store.get_watermark('1234') == (None, None)
+        self.store.set_watermark('1234', '2016-01-01T10:00:00+00:00', None)
+        self.store.set_watermark('1234', '2016-01-02T10:00:00+00:00', '2016-01-03T10:00:00+00:00', list_id='list1')
+        assert self.store.get_watermark('1234') == ('2016-01-01T10:00:00+00:00', None)
+        assert self.store.get_watermark('1234', list_id='list1') == ('2016-01-02T10:00:00+00:00',
+                                                                     '2016-01-03T10:00:00+00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
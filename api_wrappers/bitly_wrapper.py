@@ -1,15 +1,67 @@
+import bisect
 import requests
 import logging
+import threading
+import time
 import urllib.parse
+from api_wrappers.http_session import get_session
+
+
+class BitlyStats:
+    """
+    per endpoint (e.g. '/v3/link/clicks') counts of requests, bytes (of the decoded responses), error codes (HTTP
+    status, or the status_code of the json response) and a histogram of the latencies
+    """
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5] # upper bounds (seconds); the last bucket is everything slower
+
+    def __init__(self):
+        self.__endpoints = {}
+        self.__lock = threading.Lock()
+
+    def record(self, path, seconds, size, error_code=None):
+        with self.__lock:
+            if path not in self.__endpoints:
+                self.__endpoints[path] = {'count': 0,
+                                          'bytes': 0,
+                                          'seconds': 0,
+                                          'errors': {},
+                                          'latency_histogram': [0] * (len(BitlyStats.LATENCY_BUCKETS) + 1)}
+            endpoint = self.__endpoints[path]
+            endpoint['count'] += 1
+            endpoint['bytes'] += size
+            endpoint['seconds'] += seconds
+            endpoint['latency_histogram'][bisect.bisect_left(BitlyStats.LATENCY_BUCKETS, seconds)] += 1
+            if error_code is not None:
+                endpoint['errors'][error_code] = endpoint['errors'].get(error_code, 0) + 1
+
+    def get_stats(self):
+        """
+        :return: dictionary of path -> dictionary of count, bytes, seconds (total), errors (dictionary of error code
+            -> count) and latency_histogram (list of counts per LATENCY_BUCKETS bucket, plus the slower ones)
+        """
+        with self.__lock:
+            return {path: dict(endpoint,
+                               errors=dict(endpoint['errors']),
+                               latency_histogram=list(endpoint['latency_histogram']))
+                    for path, endpoint in self.__endpoints.items()}
 
 
 class Bitly:
     __access_token = None
     __total_api_request_count = 0
+    API_ADDRESS = "https://api-ssl.bitly.com"
+    DEFAULT_TIMEOUT = (10, 30)
 
-    def __init__(self, access_token=None):
-        self.api_address = "https://api-ssl.bitly.com"
+    def __init__(self, access_token=None, timeout=DEFAULT_TIMEOUT, api_address=API_ADDRESS):
+        """
+        :param timeout: timeout (seconds) of each call, passed to requests
+        :param api_address: root of the API, e.g. of a local server when testing
+        """
+        self.api_address = api_address
         self.__access_token = access_token
+        self.timeout = timeout
+        self.stats = BitlyStats()
+        self.session = get_session(urllib.parse.urlparse(api_address).netloc)
 
     def get_target_url(self, bitly):
         args = {'shortUrl': bitly}
@@ -80,8 +132,7 @@ class Bitly:
 
     def get(self, path, arguments, ignore_json_status_code=None):
         """generic method to handle API get requests"""
-        r = requests.get(self.get_url(path, arguments))
-        self.__total_api_request_count += 1
+        r = self.request('get', path, self.get_url(path, arguments))
         if r.ok is not True:
             raise ConnectionError('(get)status_code: "{}"'.format(r.status_code))
 
@@ -113,11 +164,11 @@ class Bitly:
 
             from requests.auth import HTTPBasicAuth
             data = {'format': 'json'}
-            r = requests.post('https://api-ssl.bitly.com/oauth/access_token',
-                              data=data,
-                              auth=HTTPBasicAuth(username, password))
-
-            self.__total_api_request_count += 1
+            r = self.request('post',
+                             '/oauth/access_token',
+                             self.api_address + '/oauth/access_token',
+                             data=data,
+                             auth=HTTPBasicAuth(username, password))
 
             if r.ok is not True:
                 raise ConnectionError("status_code: '{}'"
@@ -130,5 +181,37 @@ class Bitly:
     def get_access_token(self):
         return self.__access_token
 
+    def request(self, method, path, url, **kwargs):
+        """
+        sends the request with the shared session, recording it in stats (under path)
+        """
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as exception:
+            self.stats.record(path, time.perf_counter() - start, 0, error_code=type(exception).__name__)
+            raise
+        finally:
+            self.__total_api_request_count += 1
+
+        error_code = None
+        if r.ok is not True:
+            error_code = r.status_code
+        elif r.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                status_code = r.json().get('status_code', 200)
+            except ValueError:
+                status_code = 200
+            if status_code != 200:
+                error_code = status_code
+        self.stats.record(path, time.perf_counter() - start, len(r.content), error_code=error_code)
+        return r
+
     def get_total_api_request_count(self):
         return self.__total_api_request_count
+
+    def get_stats(self):
+        """
+        :return: per endpoint stats (see BitlyStats.get_stats)
+        """
+        return self.stats.get_stats()
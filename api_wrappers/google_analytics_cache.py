@@ -0,0 +1,107 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class GACache:
+    """
+    persistent (sqlite) cache of Core Reporting API responses, keyed by the full normalized query
+    - responses for date ranges that ended before GA's processing latency window never expire
+    - responses for date ranges that touch the latency window (e.g. "today") expire after ttl_seconds
+    - once there are more than max_entries responses, the least recently used are evicted
+    """
+
+    def __init__(self, path='ga_cache.sqlite', ttl_seconds=3600, latency_days=2, max_entries=10000):
+        """
+        :param path: sqlite file the responses are stored in (':memory:' for a non-persistent cache)
+        :param ttl_seconds: how long responses for date ranges that are still changing are kept
+        :param latency_days: number of days GA may still be processing; ranges ending before that are immutable
+        :param max_entries: maximum number of cached responses
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.latency_days = latency_days
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                                      '(key TEXT PRIMARY KEY, response TEXT, expires REAL, last_access REAL)')
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access '
+                                      'ON responses (last_access)')
+
+    def get(self, query):
+        """
+        :param query: dictionary of Core Reporting API parameters
+        :return: the cached response, or None if it is not cached (or has expired)
+        """
+        key = GACache.get_key(query)
+        now = time.time()
+        with self.__lock:
+            row = self.__connection.execute('SELECT response, expires FROM responses WHERE key = ?',
+                                            (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    with self.__connection:
+                        self.__connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.misses += 1
+                return None
+
+            with self.__connection:
+                self.__connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, query, response):
+        key = GACache.get_key(query)
+        now = time.time()
+        expires = None if self.is_closed_range(query.get('end_date')) else now + self.ttl_seconds
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                      (key, json.dumps(response), expires, now))
+            self.__connection.execute('DELETE FROM responses WHERE key IN '
+                                      '(SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                                      (self.max_entries,))
+
+    def clear(self):
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM responses')
+
+    def get_stats(self):
+        """
+        :return: dictionary with the number of hits, misses and cached responses
+        """
+        with self.__lock:
+            entries = self.__connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def is_closed_range(self, end_date):
+        """
+        :param end_date: end date of the query ('YYYY-MM-DD'); relative dates (e.g. 'today', '7daysAgo') are never closed
+        :return: True if the range ended before GA's processing latency window, i.e. the data can no longer change
+        """
+        try:
+            end_date = datetime.strptime(end_date, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return False
+        cutoff = datetime.now() - timedelta(days=self.latency_days)
+        return end_date.date() < cutoff.date()
+
+    @staticmethod
+    def get_key(query):
+        """
+        normalizes the query (drops unset parameters, strips whitespace from the metrics/dimensions/sort lists)
+        so that equivalent queries share the same key
+        """
+        normalized = {}
+        for name, value in query.items():
+            if value is None:
+                continue
+            if name in ('metrics', 'dimensions', 'sort'):
+                value = ','.join(part.strip() for part in value.split(','))
+            normalized[name] = value
+        return json.dumps(normalized, sort_keys=True)
@@ -0,0 +1,101 @@
+"""
+definitions of how GA metrics combine across days, date ranges and rows: additive metrics are summed, and ratio
+metrics are recomputed from their (additive) components. Metric names are case-insensitive in GA, so definitions
+are keyed by the lower case name.
+"""
+
+PAGE_STATS_METRICS = 'ga:visits,ga:pageViews,ga:uniquePageViews,ga:newUsers,ga:bounceRate,ga:avgTimeOnPage,ga:entrances'
+
+ALIASES = {'ga:visits': 'ga:sessions',
+           'ga:newvisits': 'ga:newusers',
+           'ga:visitbouncerate': 'ga:bouncerate',
+           'ga:timeonsite': 'ga:sessionduration',
+           'ga:avgtimeonsite': 'ga:avgsessionduration'}
+
+INTEGER_METRICS = ('ga:sessions', 'ga:pageviews', 'ga:uniquepageviews', 'ga:newusers', 'ga:entrances', 'ga:exits',
+                   'ga:bounces', 'ga:hits', 'ga:organicsearches', 'ga:transactions', 'ga:goalcompletionsall')
+
+ADDITIVE_METRICS = INTEGER_METRICS + ('ga:timeonpage', 'ga:sessionduration', 'ga:transactionrevenue')
+
+
+def percent(numerator, denominator):
+    return 100.0 * numerator / denominator if denominator else 0.0
+
+
+def ratio(numerator, denominator):
+    return float(numerator) / denominator if denominator else 0.0
+
+
+# ratio metric -> (additive components, function computing the metric from the component totals)
+RATIO_METRICS = {
+    'ga:bouncerate': (('ga:bounces', 'ga:sessions'),
+                      lambda totals: percent(totals['ga:bounces'], totals['ga:sessions'])),
+    'ga:avgtimeonpage': (('ga:timeonpage', 'ga:pageviews', 'ga:exits'),
+                         lambda totals: ratio(totals['ga:timeonpage'], totals['ga:pageviews'] - totals['ga:exits'])),
+    'ga:avgsessionduration': (('ga:sessionduration', 'ga:sessions'),
+                              lambda totals: ratio(totals['ga:sessionduration'], totals['ga:sessions'])),
+    'ga:pageviewspersession': (('ga:pageviews', 'ga:sessions'),
+                               lambda totals: ratio(totals['ga:pageviews'], totals['ga:sessions'])),
+    'ga:percentnewsessions': (('ga:newusers', 'ga:sessions'),
+                              lambda totals: percent(totals['ga:newusers'], totals['ga:sessions'])),
+    'ga:entrancerate': (('ga:entrances', 'ga:pageviews'),
+                        lambda totals: percent(totals['ga:entrances'], totals['ga:pageviews'])),
+    'ga:exitrate': (('ga:exits', 'ga:pageviews'),
+                    lambda totals: percent(totals['ga:exits'], totals['ga:pageviews'])),
+}
+
+
+def get_metric_key(metric):
+    """
+    :return: the lower case (un-aliased) name the definitions are keyed by, e.g. 'ga:visits' -> 'ga:sessions'
+    """
+    key = metric.strip().lower()
+    return ALIASES.get(key, key)
+
+
+def is_additive(metric):
+    return get_metric_key(metric) in ADDITIVE_METRICS
+
+
+def is_ratio(metric):
+    return get_metric_key(metric) in RATIO_METRICS
+
+
+def get_component_metrics(metrics):
+    """
+    :param metrics: list of metric names
+    :return: list of the additive metrics (keys) needed to compute every metric
+    """
+    components = []
+    for metric in metrics:
+        key = get_metric_key(metric)
+        if key in ADDITIVE_METRICS:
+            needed = (key,)
+        elif key in RATIO_METRICS:
+            needed = RATIO_METRICS[key][0]
+        else:
+            raise ValueError('{} is neither additive nor a known ratio of additive metrics'.format(metric))
+        components.extend(component for component in needed if component not in components)
+    return components
+
+
+def compute_metrics(metrics, totals):
+    """
+    :param metrics: list of metric names (as they should be returned)
+    :param totals: dictionary of metric key -> total of each component metric
+    :return: dictionary of metric name -> value
+    """
+    values = {}
+    for metric in metrics:
+        key = get_metric_key(metric)
+        values[metric] = totals[key] if key in ADDITIVE_METRICS else RATIO_METRICS[key][1](totals)
+    return values
+
+
+def format_value(metric, value):
+    """
+    :return: the value formatted the way the Core Reporting API returns it (e.g. '122', '91.80327868852459', '0.0')
+    """
+    if get_metric_key(metric) in INTEGER_METRICS:
+        return str(int(round(value)))
+    return repr(float(value))
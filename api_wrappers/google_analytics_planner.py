@@ -0,0 +1,103 @@
+from api_wrappers import google_analytics_metrics, google_analytics_sampling
+
+
+class GAQueryPlanner:
+    """
+    plans the queries for many (metrics, dimensions, filters, segment) requests over a range of months: requests
+    that share dimensions, filters and segment are grouped into queries of up to MAX_METRICS_PER_QUERY metrics, with
+    ga:yearMonth added as the first dimension so that a single query covers every month at once. Once executed, the
+    values of any request are looked up per month ('YYYYMM') locally.
+    """
+    MAX_METRICS_PER_QUERY = 10
+
+    def __init__(self):
+        self.__metrics = {}  # (dimensions, filters, segment) -> list of metric names
+        self.__values = {}  # (dimensions, filters, segment) -> {year_month -> {dimension values -> {metric key -> value}}}
+
+    def add(self, metrics, dimensions=None, filters=None, segment=None, sort=None):
+        """
+        :param metrics: comma separated metric names, e.g. 'ga:sessions,ga:users'
+        :param sort: sort the rows will be retrieved with (see get_rows); metrics it refers to are added as well
+        """
+        group = self.__metrics.setdefault((dimensions, filters, segment), [])
+        metrics = metrics.split(',')
+        if sort is not None:
+            dimension_names = [] if dimensions is None else [name.strip().lower() for name in dimensions.split(',')]
+            metrics += [key.strip().lstrip('-') for key in sort.split(',')
+                        if key.strip().lstrip('-').lower() not in dimension_names]
+        for metric in metrics:
+            if metric.strip().lower() not in [name.lower() for name in group]:
+                group.append(metric.strip())
+
+    def get_queries(self):
+        """
+        :return: list of dictionaries of ga_get parameters (without the date range), one per query needed
+        """
+        queries = []
+        for (dimensions, filters, segment), metrics in self.__metrics.items():
+            for index in range(0, len(metrics), GAQueryPlanner.MAX_METRICS_PER_QUERY):
+                queries.append({'metrics': ','.join(metrics[index:index + GAQueryPlanner.MAX_METRICS_PER_QUERY]),
+                                'dimensions': 'ga:yearMonth' if dimensions is None else 'ga:yearMonth,' + dimensions,
+                                'filters': filters,
+                                'segment': segment})
+        return queries
+
+    def execute(self, ga_wrapper, start_date, end_date):
+        """
+        executes the planned queries (batched) for the months within the date range
+        :param ga_wrapper: GoogleAnalyticsWrapper
+        """
+        queries = [dict(query, start_date=start_date, end_date=end_date, max_results=ga_wrapper.MAX_RESULTS_PER_PAGE)
+                   for query in self.get_queries()]
+        self.__values = {}
+        for query, (results, exception) in zip(queries, ga_wrapper.ga_get_many(queries)):
+            if exception is not None:
+                raise exception
+            if results.get('totalResults', 0) > len(results.get('rows', [])):
+                results = ga_wrapper.ga_get_all(**query)
+
+            dimensions = query['dimensions'].split(',', 1)[1] if ',' in query['dimensions'] else None
+            months = self.__values.setdefault((dimensions, query['filters'], query['segment']), {})
+            metrics = [google_analytics_metrics.get_metric_key(metric) for metric in query['metrics'].split(',')]
+            dimension_count = len(results['columnHeaders']) - len(metrics)
+            for row in results.get('rows', []):
+                values = months.setdefault(row[0], {}).setdefault(tuple(row[1:dimension_count]), {})
+                values.update(zip(metrics, row[dimension_count:]))
+
+    def get_value(self, year_month, metric, filters=None, segment=None):
+        """
+        :param year_month: 'YYYYMM'
+        :return: total of the metric for the month (a request added without dimensions), as GA returns it
+        """
+        values = self.__get_month(year_month, None, filters, segment).get((), {})
+        return values.get(google_analytics_metrics.get_metric_key(metric),
+                          google_analytics_metrics.format_value(metric, 0))
+
+    def get_rows(self, year_month, metrics, dimensions, filters=None, segment=None, sort=None):
+        """
+        :param year_month: 'YYYYMM'
+        :return: list of [dimension values..., metric values...] rows for the month, as ga_get would return them
+        """
+        metrics = metrics.split(',')
+        dimension_names = dimensions.split(',')
+        sort_metrics = [] if sort is None else [key.strip().lstrip('-') for key in sort.split(',')
+                                                if key.strip().lstrip('-').lower() not in
+                                                [name.lower() for name in dimension_names + metrics]]
+        column_headers = [{'name': name, 'columnType': 'DIMENSION'} for name in dimension_names] + \
+                         [{'name': name, 'columnType': 'METRIC'} for name in metrics + sort_metrics]
+        defaults = [(google_analytics_metrics.get_metric_key(metric), google_analytics_metrics.format_value(metric, 0))
+                    for metric in metrics + sort_metrics]
+
+        # a row can be missing from the query of some of the metrics (when there are more than
+        # MAX_METRICS_PER_QUERY), since GA leaves out rows whose metrics are all 0
+        rows = [list(dimension_values) + [values.get(key, default) for key, default in defaults]
+                for dimension_values, values in self.__get_month(year_month, dimensions, filters, segment).items()]
+        rows = google_analytics_sampling.sort_rows(rows, column_headers, sort)
+        return [row[:len(dimension_names) + len(metrics)] for row in rows]
+
+    def __get_month(self, year_month, dimensions, filters, segment):
+        key = (dimensions, filters, segment)
+        if key not in self.__values:
+            raise LookupError('no query was planned/executed for dimensions {}, filters {} and segment {}'
+                              .format(dimensions, filters, segment))
+        return self.__values[key].get(year_month, {})
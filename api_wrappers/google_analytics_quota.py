@@ -0,0 +1,140 @@
+import json
+import random
+import socket
+import threading
+import time
+from googleapiclient.errors import HttpError
+
+RETRYABLE_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded', 'quotaExceeded', 'backendError', 'internalServerError')
+
+
+class TokenBucket:
+    """
+    token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens; reserving more tokens than
+    are available puts the bucket in debt, and the caller waits until the debt would have been refilled
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.clock = clock
+        self.__tokens = self.capacity
+        self.__updated = clock()
+        self.__lock = threading.Lock()
+
+    def reserve(self, count=1):
+        """
+        :return: number of seconds the caller has to wait before using the reserved tokens
+        """
+        with self.__lock:
+            now = self.clock()
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            self.__tokens -= count
+            return 0 if self.__tokens >= 0 else -self.__tokens / self.rate
+
+
+class GARateLimiter:
+    """
+    keeps requests under GA's per-profile (view) and per-project query rates and retries rate limit (403/429) and
+    server (5xx) errors with jittered exponential backoff; other errors (e.g. invalid queries, daily limit exceeded)
+    are raised immediately. Share one limiter between every wrapper that uses the same project (credentials).
+    """
+
+    def __init__(self, profile_qps=10, project_qps=10, max_retries=5, base_delay=1, max_delay=32,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        :param profile_qps: maximum queries per second per profile id
+        :param project_qps: maximum queries per second across all profiles
+        :param max_retries: number of times a retryable error is retried before it is raised
+        :param base_delay: seconds waited before the first retry; doubled on each retry (up to max_delay)
+        """
+        self.profile_qps = profile_qps
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.throttled_waits = 0
+        self.throttled_seconds = 0
+        self.retries = 0
+        self.quota_consumed = 0
+        self.quota_consumed_by_profile = {}
+        self.__project_bucket = TokenBucket(project_qps, clock=clock)
+        self.__profile_buckets = {}
+        self.__lock = threading.Lock()
+
+    def acquire(self, profile_id, count=1):
+        """
+        waits until `count` queries may be sent for the profile, and records them as consumed quota
+        :param profile_id: profile id (or the 'ga:<profile id>' ids parameter)
+        """
+        with self.__lock:
+            if profile_id not in self.__profile_buckets:
+                self.__profile_buckets[profile_id] = TokenBucket(self.profile_qps, clock=self.clock)
+            profile_bucket = self.__profile_buckets[profile_id]
+            self.quota_consumed += count
+            self.quota_consumed_by_profile[profile_id] = self.quota_consumed_by_profile.get(profile_id, 0) + count
+
+        wait = max(self.__project_bucket.reserve(count), profile_bucket.reserve(count))
+        if wait > 0:
+            with self.__lock:
+                self.throttled_waits += 1
+                self.throttled_seconds += wait
+            self.sleep(wait)
+
+    def execute(self, profile_id, request):
+        """
+        :param request: function that sends the request and returns its results
+        :return: the results of the first attempt that succeeds
+        """
+        attempt = 0
+        while True:
+            self.acquire(profile_id)
+            try:
+                return request()
+            except Exception as exception:
+                if not self.should_retry(exception, attempt):
+                    raise
+            self.backoff(attempt)
+            attempt += 1
+
+    def should_retry(self, exception, attempt):
+        return attempt < self.max_retries and GARateLimiter.is_retryable(exception)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        with self.__lock:
+            self.retries += 1
+        self.sleep(random.uniform(delay / 2, delay))
+
+    def get_stats(self):
+        with self.__lock:
+            return {'throttled_waits': self.throttled_waits,
+                    'throttled_seconds': self.throttled_seconds,
+                    'retries': self.retries,
+                    'quota_consumed': self.quota_consumed,
+                    'quota_consumed_by_profile': dict(self.quota_consumed_by_profile)}
+
+    @staticmethod
+    def is_retryable(exception):
+        if isinstance(exception, (socket.timeout, ConnectionError)):
+            return True
+        if not isinstance(exception, HttpError):
+            return False
+        if exception.resp.status >= 500 or exception.resp.status == 429:
+            return True
+        if exception.resp.status == 403:
+            return GARateLimiter.get_error_reason(exception) in RETRYABLE_REASONS
+        return False
+
+    @staticmethod
+    def get_error_reason(exception):
+        """
+        :return: the reason of an HttpError (e.g. 'userRateLimitExceeded', 'dailyLimitExceeded'), or None
+        """
+        try:
+            content = exception.content.decode('utf-8') if isinstance(exception.content, bytes) else exception.content
+            return json.loads(content)['error']['errors'][0]['reason']
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
@@ -0,0 +1,196 @@
+import json
+import threading
+from googleapiclient.errors import HttpError
+from api_wrappers.google_analytics_service import GAHttp, GATransferStats, get_credentials, get_flags
+
+
+class GAReportingV4Backend:
+    """
+    executes Core Reporting API (v3) style queries (see GoogleAnalyticsWrapper.build_query) with the Analytics
+    Reporting API v4 reports:batchGet method, and maps the reports back into v3 style results, so that:
+        - up to MAX_REPORTS_PER_REQUEST queries are sent per HTTP request (v4 requires the queries of a request to
+          have the same view, date ranges, segments and sampling level, so only those are grouped together)
+        - a query may have several date ranges ('date_ranges': list of (start_date, end_date)), e.g. a 30 day window
+          and the lifetime of a page in a single report
+        - results with more rows than fit in a page are followed with pageToken
+    Segments are passed as segmentId (e.g. 'gaid::-1'); v3 dynamic segments aren't supported.
+    """
+    ROOT_URL = 'https://analyticsreporting.googleapis.com/'
+    MAX_REPORTS_PER_REQUEST = 5
+    MAX_DATE_RANGES = 2
+    MAX_PAGE_SIZE = 100000
+    SAMPLING_LEVELS = {'DEFAULT': 'DEFAULT', 'FASTER': 'SMALL', 'HIGHER_PRECISION': 'LARGE'}
+
+    def __init__(self, http_factory=None, root_url=ROOT_URL):
+        """
+        :param http_factory: function returning a new authorized httplib2.Http (one is created per thread, since
+            httplib2.Http isn't thread-safe); by default a GAHttp (recording to transfer_stats) authorized with the
+            stored OAuth2 credentials
+        :param root_url: root url of the API, e.g. of a local server when testing
+        """
+        self.transfer_stats = GATransferStats()
+        self.http_factory = http_factory or self.build_authorized_http
+        self.root_url = root_url
+        self.__local = threading.local()
+
+    def get_many(self, queries, rate_limiter=None):
+        """
+        :param queries: list of query dictionaries (see GoogleAnalyticsWrapper.build_query); 'max_results' of None
+            returns every row
+        :param rate_limiter: optional GARateLimiter each HTTP request is throttled (and retried) with
+        :return: list of (results, exception) tuples in the same order as queries, where results is a list of v3
+            style results, one per date range of the query
+        """
+        report_requests = [GAReportingV4Backend.get_report_request(query) for query in queries]
+        groups = {}
+        for index, report_request in enumerate(report_requests):
+            key = json.dumps([report_request['viewId'],
+                              report_request['dateRanges'],
+                              report_request.get('segments'),
+                              report_request.get('samplingLevel')], sort_keys=True)
+            groups.setdefault(key, []).append(index)
+
+        responses = [None] * len(queries)
+        for indexes in groups.values():
+            for start in range(0, len(indexes), GAReportingV4Backend.MAX_REPORTS_PER_REQUEST):
+                chunk = indexes[start:start + GAReportingV4Backend.MAX_REPORTS_PER_REQUEST]
+                try:
+                    reports = self.__get_reports([queries[index] for index in chunk],
+                                                 [report_requests[index] for index in chunk],
+                                                 rate_limiter)
+                except Exception as exception:
+                    for index in chunk:
+                        responses[index] = (None, exception)
+                    continue
+                for index, report in zip(chunk, reports):
+                    responses[index] = (GAReportingV4Backend.to_v3_results(queries[index], report), None)
+        return responses
+
+    def batch_get(self, report_requests):
+        """
+        sends a single reports:batchGet request
+        :return: list of v4 reports
+        """
+        uri = self.root_url.rstrip('/') + '/v4/reports:batchGet'
+        response, content = self.__get_http().request(uri,
+                                                      method='POST',
+                                                      body=json.dumps({'reportRequests': report_requests}),
+                                                      headers={'Content-Type': 'application/json'})
+        if response.status >= 400:
+            raise HttpError(response, content, uri=uri)
+        return json.loads(content.decode('utf-8'))['reports']
+
+    def __get_reports(self, queries, report_requests, rate_limiter):
+        """
+        executes the (compatible) report requests, requesting following pages until each has all of its rows
+        """
+        reports = [None] * len(report_requests)
+        pending = list(range(len(report_requests)))
+        while len(pending) > 0:
+            batch = [report_requests[index] for index in pending]
+            if rate_limiter is None:
+                pages = self.batch_get(batch)
+            else:
+                pages = rate_limiter.execute('ga:' + batch[0]['viewId'], lambda: self.batch_get(batch))
+
+            next_pending = []
+            for index, page in zip(pending, pages):
+                if reports[index] is None:
+                    reports[index] = page
+                else:
+                    reports[index]['data'].setdefault('rows', []).extend(page.get('data', {}).get('rows', []))
+
+                max_results = queries[index].get('max_results')
+                row_count = len(reports[index].get('data', {}).get('rows', []))
+                if 'nextPageToken' in page and (max_results is None or row_count < max_results):
+                    remaining = GAReportingV4Backend.MAX_PAGE_SIZE if max_results is None else max_results - row_count
+                    report_requests[index] = dict(report_requests[index],
+                                                  pageToken=page['nextPageToken'],
+                                                  pageSize=min(remaining, GAReportingV4Backend.MAX_PAGE_SIZE))
+                    next_pending.append(index)
+            pending = next_pending
+        return reports
+
+    def __get_http(self):
+        if getattr(self.__local, 'http', None) is None:
+            self.__local.http = self.http_factory()
+        return self.__local.http
+
+    def build_authorized_http(self):
+        return get_credentials(get_flags()).authorize(GAHttp(self.transfer_stats))
+
+    @staticmethod
+    def get_date_ranges(query):
+        """
+        :return: list of (start_date, end_date) of the query
+        """
+        date_ranges = query.get('date_ranges') or [(query['start_date'], query['end_date'])]
+        if len(date_ranges) > GAReportingV4Backend.MAX_DATE_RANGES:
+            raise ValueError('at most {} date ranges are allowed per query'.format(GAReportingV4Backend.MAX_DATE_RANGES))
+        return date_ranges
+
+    @staticmethod
+    def get_report_request(query):
+        """
+        :return: the v4 reportRequest of a v3 style query
+        """
+        dimensions = [] if query.get('dimensions') is None else query['dimensions'].split(',')
+        report_request = {'viewId': query['ids'].replace('ga:', '', 1),
+                          'dateRanges': [{'startDate': start_date, 'endDate': end_date}
+                                         for start_date, end_date in GAReportingV4Backend.get_date_ranges(query)],
+                          'metrics': [{'expression': metric.strip()} for metric in query['metrics'].split(',')],
+                          'includeEmptyRows': query.get('include_empty_rows') is not False,
+                          'pageSize': min(query.get('max_results') or GAReportingV4Backend.MAX_PAGE_SIZE,
+                                          GAReportingV4Backend.MAX_PAGE_SIZE)}
+        if query.get('segment') is not None:
+            report_request['segments'] = [{'segmentId': query['segment']}]
+            dimensions.append('ga:segment')
+        if len(dimensions) > 0:
+            report_request['dimensions'] = [{'name': dimension.strip()} for dimension in dimensions]
+        if query.get('filters') is not None:
+            report_request['filtersExpression'] = query['filters']
+        if query.get('sort') is not None:
+            report_request['orderBys'] = [{'fieldName': key.strip().lstrip('-'),
+                                           'sortOrder': 'DESCENDING' if key.strip().startswith('-') else 'ASCENDING'}
+                                          for key in query['sort'].split(',')]
+        if query.get('samplingLevel') is not None:
+            report_request['samplingLevel'] = GAReportingV4Backend.SAMPLING_LEVELS[query['samplingLevel']]
+        if query.get('start_index') is not None:
+            report_request['pageToken'] = str(query['start_index'] - 1)
+        return report_request
+
+    @staticmethod
+    def to_v3_results(query, report):
+        """
+        :return: list of v3 style results (columnHeaders, rows, totalsForAllResults, ...), one per date range
+        """
+        dimension_names = report['columnHeader'].get('dimensions', [])
+        if query.get('segment') is not None:
+            dimension_names = dimension_names[:-1]
+        metric_headers = report['columnHeader']['metricHeader']['metricHeaderEntries']
+        column_headers = [{'name': name, 'columnType': 'DIMENSION', 'dataType': 'STRING'} for name in dimension_names] + \
+                         [{'name': header['name'], 'columnType': 'METRIC', 'dataType': header['type']}
+                          for header in metric_headers]
+        data = report.get('data', {})
+
+        results = []
+        for index, (start_date, end_date) in enumerate(GAReportingV4Backend.get_date_ranges(query)):
+            totals = data['totals'][index]['values'] if 'totals' in data else ['0'] * len(metric_headers)
+            range_results = {'kind': 'analytics#gaData',
+                             'query': dict({name: value for name, value in query.items() if name != 'date_ranges'},
+                                           start_date=start_date,
+                                           end_date=end_date),
+                             'columnHeaders': column_headers,
+                             'totalResults': data.get('rowCount', 0),
+                             'itemsPerPage': query.get('max_results'),
+                             'containsSampledData': 'samplesReadCounts' in data,
+                             'totalsForAllResults': {header['name']: value for header, value in zip(metric_headers, totals)}}
+            if 'samplesReadCounts' in data:
+                range_results['sampleSize'] = data['samplesReadCounts'][index]
+                range_results['sampleSpace'] = data['samplingSpaceSizes'][index]
+            rows = [row['dimensions'][:len(dimension_names)] + row['metrics'][index]['values']
+                    for row in data.get('rows', [])]
+            if len(rows) > 0:
+                range_results['rows'] = rows
+            results.append(range_results)
+        return results
@@ -0,0 +1,109 @@
+from array import array
+
+# GA dataType -> (array typecode, conversion); columns of other types (e.g. STRING) are kept as lists of strings
+COLUMN_TYPES = {'INTEGER': ('q', int),
+                'FLOAT': ('d', float),
+                'PERCENT': ('d', float),
+                'TIME': ('d', float),
+                'CURRENCY': ('d', float)}
+
+
+class GAResult:
+    """
+    columnar view of a Core Reporting API response: each column is converted once, using the dataType of its
+    columnHeader, into an array (numeric columns) or list (dimensions), instead of converting the string cells of
+    every row wherever they are used. Column names are case-insensitive, as in GA.
+    """
+
+    def __init__(self, column_headers, columns, totals=None):
+        """
+        :param column_headers: GA columnHeaders (dictionaries with 'name', 'columnType' and 'dataType')
+        :param columns: one array/list per column header
+        :param totals: dictionary of metric name -> total (converted); see build
+        """
+        self.column_headers = column_headers
+        self.column_names = [header['name'] for header in column_headers]
+        self.__columns = columns
+        self.__indexes = {name.lower(): index for index, name in enumerate(self.column_names)}
+        self.totals = {name.lower(): value for name, value in (totals or {}).items()}
+
+    def __len__(self):
+        return len(self.__columns[0]) if len(self.__columns) > 0 else 0
+
+    def get_column(self, name):
+        """
+        :return: the array (or list, for non-numeric columns) of values of the column
+        """
+        if name.lower() not in self.__indexes:
+            raise LookupError('{} is not one of the columns: {}'.format(name, ', '.join(self.column_names)))
+        return self.__columns[self.__indexes[name.lower()]]
+
+    def get_total(self, name):
+        """
+        :return: total of the metric over all results (totalsForAllResults), not just the returned rows
+        """
+        return self.totals[name.lower()]
+
+    def get_row(self, index):
+        return tuple(column[index] for column in self.__columns)
+
+    def get_rows(self):
+        return list(zip(*self.__columns))
+
+    def get_order(self, name, descending=False):
+        """
+        :return: list of row indexes ordered by the column (stable, so ties keep GA's order)
+        """
+        column = self.get_column(name)
+        return sorted(range(len(column)), key=column.__getitem__, reverse=descending)
+
+    def take(self, indexes):
+        """
+        :return: new GAResult with only the rows at the indexes, in that order
+        """
+        columns = [array(column.typecode, map(column.__getitem__, indexes)) if isinstance(column, array)
+                   else [column[index] for index in indexes]
+                   for column in self.__columns]
+        result = GAResult(self.column_headers, columns)
+        result.totals = self.totals
+        return result
+
+    def sort(self, name, descending=False):
+        return self.take(self.get_order(name, descending))
+
+    def top(self, name, count):
+        """
+        :return: new GAResult with the count rows having the largest values of the column
+        """
+        return self.take(self.get_order(name, descending=True)[:count])
+
+    def get_share(self, name):
+        """
+        :return: array of each row's share (0-1) of the metric's total over all results
+        """
+        total = self.get_total(name)
+        if not total:
+            return array('d', [0.0] * len(self))
+        return array('d', (value / total for value in self.get_column(name)))
+
+    @staticmethod
+    def build(results):
+        """
+        :param results: response of GoogleAnalyticsWrapper.ga_get/ga_get_all
+        """
+        column_headers = results.get('columnHeaders', [])
+        rows = results.get('rows', [])
+        columns = []
+        for index, header in enumerate(column_headers):
+            values = [row[index] for row in rows]
+            if header.get('dataType') in COLUMN_TYPES:
+                typecode, convert = COLUMN_TYPES[header['dataType']]
+                values = array(typecode, map(convert, values))
+            columns.append(values)
+
+        data_types = {header['name'].lower(): header.get('dataType') for header in column_headers}
+        totals = {}
+        for name, value in results.get('totalsForAllResults', {}).items():
+            typecode, convert = COLUMN_TYPES.get(data_types.get(name.lower()), ('d', float))
+            totals[name] = convert(value)
+        return GAResult(column_headers, columns, totals)
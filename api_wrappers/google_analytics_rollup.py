@@ -0,0 +1,93 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from api_wrappers import google_analytics_metrics
+from api_wrappers.google_analytics_timeseries import GATimeSeriesStore
+
+ROLLUP_METRICS = ('ga:sessions', 'ga:pageviews', 'ga:uniquePageviews', 'ga:newUsers', 'ga:entrances', 'ga:bounces',
+                  'ga:timeOnPage', 'ga:exits')
+
+
+class GAPageRollup:
+    """
+    per-page daily table of additive metrics, built from bulk ga:date,ga:pagePath rows, with cumulative sums so the
+    total of any metric over any window within [start_date, end_date] is a difference of two prefix sums; ratio
+    metrics (e.g. ga:bounceRate, ga:avgTimeOnPage) are derived from their additive components.
+    Only the days a page has data for are stored (found with a binary search), so memory grows with the rows GA
+    returns rather than with pages x days.
+    """
+
+    def __init__(self, start_date, end_date, metrics=ROLLUP_METRICS):
+        self.start_date = GATimeSeriesStore.to_date(start_date)
+        self.end_date = GATimeSeriesStore.to_date(end_date)
+        self.metrics = [google_analytics_metrics.get_metric_key(metric) for metric in metrics]
+        self.__days = {}
+        self.__sums = {}
+        self.__rows = {}
+
+    def add_row(self, url_path, day, values):
+        """
+        :param day: 'YYYYMMDD' (as GA returns ga:date)
+        :param values: values of self.metrics, in order
+        """
+        day = datetime.strptime(day, '%Y%m%d').toordinal()
+        page_rows = self.__rows.setdefault(url_path, {})
+        previous = page_rows.get(day, [0.0] * len(self.metrics))
+        page_rows[day] = [total + float(value) for total, value in zip(previous, values)]
+
+    def build_index(self):
+        """
+        builds the cumulative sums from the added rows; called by build, or after adding rows manually
+        """
+        for url_path, page_rows in self.__rows.items():
+            days = array('l', sorted(page_rows))
+            sums = [array('d', [0.0]) for _ in self.metrics]
+            for day in days:
+                for index, value in enumerate(page_rows[day]):
+                    sums[index].append(sums[index][-1] + value)
+            self.__days[url_path] = days
+            self.__sums[url_path] = sums
+        self.__rows = {}
+
+    def get_totals(self, url_path, start_date, end_date):
+        """
+        :return: dictionary of metric key -> total over [start_date, end_date] (zeros for unknown paths)
+        """
+        start_date = GATimeSeriesStore.to_date(start_date)
+        end_date = GATimeSeriesStore.to_date(end_date)
+        if start_date < self.start_date or end_date > self.end_date:
+            raise ValueError('{} - {} is outside of the rollup range ({} - {})'
+                             .format(start_date, end_date, self.start_date, self.end_date))
+        if url_path not in self.__days:
+            return {metric: 0.0 for metric in self.metrics}
+
+        days = self.__days[url_path]
+        first = bisect_left(days, start_date.toordinal())
+        last = bisect_right(days, end_date.toordinal())
+        return {metric: sums[last] - sums[first] for metric, sums in zip(self.metrics, self.__sums[url_path])}
+
+    def get_metrics(self, url_path, metrics, start_date, end_date):
+        """
+        :param metrics: list of (additive or ratio) metric names, e.g. ['ga:pageViews', 'ga:bounceRate']
+        :return: dictionary of metric name -> value, formatted as the Core Reporting API returns it
+        """
+        totals = self.get_totals(url_path, start_date, end_date)
+        values = google_analytics_metrics.compute_metrics(metrics, totals)
+        return {metric: google_analytics_metrics.format_value(metric, value) for metric, value in values.items()}
+
+    def get_page_stats(self, url_path, start_date, end_date):
+        """
+        :return: same as GoogleAnalyticsWrapper.get_page_stats, but answered locally
+        """
+        return self.get_metrics(url_path, google_analytics_metrics.PAGE_STATS_METRICS.split(','), start_date, end_date)
+
+    @staticmethod
+    def build(rows, start_date, end_date, metrics=ROLLUP_METRICS):
+        """
+        :param rows: GA rows of [ga:pagePath, ga:date, metric values...]
+        """
+        rollup = GAPageRollup(start_date, end_date, metrics)
+        for row in rows:
+            rollup.add_row(row[0], row[1], row[2:])
+        rollup.build_index()
+        return rollup
@@ -0,0 +1,60 @@
+from datetime import timedelta
+from api_wrappers import google_analytics_metrics
+
+
+def split_window(start_date, end_date):
+    """
+    :return: the date range split into two halves, e.g. (2016-02-01, 2016-02-29) ->
+        [(2016-02-01, 2016-02-15), (2016-02-16, 2016-02-29)]
+    """
+    middle = start_date + timedelta(days=(end_date - start_date).days // 2)
+    return [(start_date, middle), (middle + timedelta(days=1), end_date)]
+
+
+def merge_responses(metrics, component_metrics, responses):
+    """
+    recombines the responses of (non-overlapping) date windows: the additive component metrics are summed per row
+    (i.e. per combination of dimension values), and the requested metrics are recomputed from them
+    :param metrics: requested metric names
+    :param component_metrics: metric keys each response contains (google_analytics_metrics.get_component_metrics)
+    :return: rows and totals (dictionary of metric name -> value) of the requested metrics, formatted as GA returns them
+    """
+    merged_rows = {}
+    totals = {component: 0.0 for component in component_metrics}
+    for response in responses:
+        dimension_count = len(response['columnHeaders']) - len(component_metrics)
+        for row in response.get('rows', []):
+            values = merged_rows.setdefault(tuple(row[:dimension_count]), [0.0] * len(component_metrics))
+            for index, value in enumerate(row[dimension_count:]):
+                values[index] += float(value)
+        for name, value in response['totalsForAllResults'].items():
+            totals[google_analytics_metrics.get_metric_key(name)] += float(value)
+
+    rows = []
+    for dimensions, values in merged_rows.items():
+        computed = google_analytics_metrics.compute_metrics(metrics, dict(zip(component_metrics, values)))
+        rows.append(list(dimensions) + [google_analytics_metrics.format_value(metric, computed[metric])
+                                        for metric in metrics])
+    computed = google_analytics_metrics.compute_metrics(metrics, totals)
+    totals = {metric: google_analytics_metrics.format_value(metric, computed[metric]) for metric in metrics}
+    return rows, totals
+
+
+def sort_rows(rows, column_headers, sort=None):
+    """
+    sorts rows the way GA does: by the sort parameter (e.g. '-ga:sessions,ga:source'), otherwise by the dimensions
+    :param column_headers: GA columnHeaders of the rows
+    """
+    names = [header['name'].lower() for header in column_headers]
+    is_metric = [header['columnType'] == 'METRIC' for header in column_headers]
+    if sort is None:
+        keys = [(index, False) for index, metric in enumerate(is_metric) if not metric]
+    else:
+        keys = [(names.index(key.strip().lstrip('-').lower()), key.strip().startswith('-')) for key in sort.split(',')]
+
+    for index, descending in reversed(keys):
+        if is_metric[index]:
+            rows.sort(key=lambda row: float(row[index]), reverse=descending)
+        else:
+            rows.sort(key=lambda row: row[index], reverse=descending)
+    return rows
@@ -0,0 +1,211 @@
+import bisect
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import httplib2
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from oauth2client import client, file, tools
+
+SCOPE = 'https://www.googleapis.com/auth/analytics.readonly'
+DISCOVERY_CACHE_PATH = 'analytics_discovery.json'
+DISCOVERY_CACHE_SECONDS = 7 * 24 * 60 * 60
+PROFILE_CACHE_PATH = 'analytics_profiles.json'
+
+_service_pools = {}
+_service_pools_lock = threading.Lock()
+
+
+def get_flags(argv=None):
+    """
+    :return: the command-line flags used by the OAuth2 flow (sample_tools.init parses these from argv)
+    """
+    return tools.argparser.parse_args(argv or [])
+
+
+def get_credentials(flags, client_secrets=None, storage_path='analytics.dat'):
+    """
+    loads the stored OAuth2 credentials, running through the native client flow if they don't exist or are invalid
+    (the same flow sample_tools.init uses; client_secrets.json is expected in the api_wrappers directory)
+    """
+    client_secrets = client_secrets or os.path.join(os.path.dirname(__file__), 'client_secrets.json')
+    storage = file.Storage(storage_path)
+    credentials = storage.get()
+    if credentials is None or credentials.invalid:
+        flow = client.flow_from_clientsecrets(client_secrets,
+                                              scope=SCOPE,
+                                              message=tools.message_if_missing(client_secrets))
+        credentials = tools.run_flow(flow, storage, flags)
+    return credentials
+
+
+def get_discovery_document(name='analytics', version='v3', cache_path=DISCOVERY_CACHE_PATH):
+    """
+    :param cache_path: file the discovery document is cached in (for DISCOVERY_CACHE_SECONDS); None to not cache it
+    """
+    if cache_path is not None and os.path.isfile(cache_path) and \
+            time.time() - os.path.getmtime(cache_path) < DISCOVERY_CACHE_SECONDS:
+        with open(cache_path) as cache_file:
+            return cache_file.read()
+
+    uri = discovery.DISCOVERY_URI.format(api=name, apiVersion=version)
+    response, content = httplib2.Http().request(uri)
+    if response.status >= 400:
+        raise HttpError(response, content, uri=uri)
+    document = content.decode('utf-8')
+
+    if cache_path is not None:
+        with open(cache_path, 'w') as cache_file:
+            cache_file.write(document)
+    return document
+
+
+def get_service_pool(size=10, client_secrets=None, storage_path='analytics.dat'):
+    """
+    :return: the GAServicePool shared by every wrapper using the same credentials (created on first use; `size` is
+        only used when the pool is created)
+    """
+    key = (client_secrets, storage_path)
+    with _service_pools_lock:
+        if key not in _service_pools:
+            credentials = get_credentials(get_flags(), client_secrets=client_secrets, storage_path=storage_path)
+            _service_pools[key] = GAServicePool(credentials, get_discovery_document(), size=size)
+        return _service_pools[key]
+
+
+def get_cached_profile(key, resolve_profile, cache_path=PROFILE_CACHE_PATH):
+    """
+    :param key: identifies the credentials the profile was resolved for
+    :param resolve_profile: function that resolves the profile (dictionary of account/webproperty/profile ids)
+    :return: the cached profile if there is one, otherwise the resolved profile (which is then cached)
+    """
+    profiles = {}
+    if os.path.isfile(cache_path):
+        with open(cache_path) as cache_file:
+            profiles = json.load(cache_file)
+    if key in profiles:
+        return profiles[key]
+
+    profiles[key] = resolve_profile()
+    with open(cache_path, 'w') as cache_file:
+        json.dump(profiles, cache_file)
+    return profiles[key]
+
+
+class GAServicePool:
+    """
+    pool of authorized service objects. httplib2.Http is not thread-safe, so every request borrows a service (each
+    with its own Http) from the pool for its duration; services are built on demand, up to `size` of them.
+    """
+
+    def __init__(self, credentials, discovery_document, size=10):
+        self.credentials = credentials
+        self.discovery_document = discovery_document
+        self.size = size
+        self.transfer_stats = GATransferStats()
+        self.__idle = queue.Queue()
+        self.__created = 0
+        self.__lock = threading.Lock()
+
+    def build_service(self):
+        http = self.credentials.authorize(GAHttp(self.transfer_stats))
+        return discovery.build_from_document(self.discovery_document, http=http)
+
+    @contextmanager
+    def service(self):
+        """
+        usage: with pool.service() as service: service.data().ga().get(...).execute()
+        blocks until a service is available if `size` services are already in use
+        """
+        with self.__lock:
+            if self.__idle.empty() and self.__created < self.size:
+                self.__created += 1
+                build = True
+            else:
+                build = False
+        if build:
+            try:
+                service = self.build_service()
+            except Exception:
+                with self.__lock:
+                    self.__created -= 1
+                raise
+        else:
+            service = self.__idle.get()
+
+        try:
+            yield service
+        finally:
+            self.__idle.put(service)
+
+
+class GATransferStats:
+    """
+    thread-safe counts of the responses received and their (decompressed) size, in total and per response (as a
+    histogram of the sizes)
+    """
+    SIZE_BUCKETS = [1024, 10 * 1024, 100 * 1024, 1024 * 1024] # upper bounds (bytes); the last bucket is everything larger
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.max_bytes = 0
+        self.gzip_responses = 0
+        self.size_histogram = [0] * (len(GATransferStats.SIZE_BUCKETS) + 1)
+        self.__lock = threading.Lock()
+
+    def record(self, response, content):
+        with self.__lock:
+            self.requests += 1
+            self.bytes += len(content)
+            self.max_bytes = max(self.max_bytes, len(content))
+            self.size_histogram[bisect.bisect_left(GATransferStats.SIZE_BUCKETS, len(content))] += 1
+            if response.get('-content-encoding') == 'gzip':
+                self.gzip_responses += 1
+
+    def get_stats(self):
+        """
+        :return: dictionary of requests, bytes, gzip_responses, bytes_per_request, max_bytes and size_histogram (list
+            of the number of responses per SIZE_BUCKETS bucket, plus the larger ones)
+        """
+        with self.__lock:
+            return {'requests': self.requests,
+                    'bytes': self.bytes,
+                    'gzip_responses': self.gzip_responses,
+                    'bytes_per_request': self.bytes / self.requests if self.requests else 0.0,
+                    'max_bytes': self.max_bytes,
+                    'size_histogram': list(self.size_histogram)}
+
+
+class GAHttp(httplib2.Http):
+    """
+    httplib2.Http that asks for gzip compressed responses and records every response in a GATransferStats. Google
+    APIs only compress responses for clients that send 'gzip' in their User-Agent (the discovery client does for
+    single requests, but not for batch requests), so '(gzip)' is added to it when missing.
+    """
+    USER_AGENT = 'api-wrappers (gzip)'
+
+    def __init__(self, transfer_stats=None, **kwargs):
+        super().__init__(**kwargs)
+        self.transfer_stats = transfer_stats
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                connection_type=None):
+        # same signature as httplib2.Http.request: oauth2client's authorize() calls it with positional arguments
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        if 'gzip' not in headers.get('user-agent', ''):
+            headers['user-agent'] = (headers.get('user-agent', '') + ' ' + GAHttp.USER_AGENT).strip()
+        headers.setdefault('accept-encoding', 'gzip, deflate')
+
+        response, content = super().request(uri,
+                                            method=method,
+                                            body=body,
+                                            headers=headers,
+                                            redirections=redirections,
+                                            connection_type=connection_type)
+        if self.transfer_stats is not None:
+            self.transfer_stats.record(response, content)
+        return response, content
@@ -0,0 +1,185 @@
+import math
+import os
+import struct
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+from api_wrappers import google_analytics_metrics
+
+HEADER = struct.Struct('<qq') # first day (ordinal), number of days
+
+
+class GADailySeries:
+    """
+    daily values of one metric for one profile, stored as contiguous arrays starting at `first_day` (so a date range
+    is a slice): `values` (doubles; NaN for days that haven't been fetched) and `final` (1 for days that were
+    fetched after GA finished processing them, i.e. that can no longer change)
+    """
+
+    def __init__(self, first_day=None, values=None, final=None):
+        self.first_day = first_day
+        self.values = values if values is not None else array('d')
+        self.final = final if final is not None else array('B')
+
+    def get(self, day):
+        index = self.get_index(day)
+        return math.nan if index is None else self.values[index]
+
+    def is_final(self, day):
+        index = self.get_index(day)
+        return index is not None and self.final[index] == 1
+
+    def set(self, day, value, final):
+        if self.first_day is None:
+            self.first_day = day
+        if day < self.first_day:
+            self.values[0:0] = array('d', [math.nan]) * (self.first_day - day)
+            self.final[0:0] = array('B', [0]) * (self.first_day - day)
+            self.first_day = day
+        index = day - self.first_day
+        if index >= len(self.values):
+            self.values.extend(array('d', [math.nan]) * (index - len(self.values) + 1))
+            self.final.extend(array('B', [0]) * (index - len(self.final) + 1))
+        self.values[index] = value
+        self.final[index] = 1 if final else 0
+
+    def get_index(self, day):
+        if self.first_day is None or day < self.first_day or day - self.first_day >= len(self.values):
+            return None
+        return day - self.first_day
+
+    def get_missing_days(self, first_day, last_day):
+        """
+        :return: the days in [first_day, last_day] that have not been fetched or may still change
+        """
+        return [day for day in range(first_day, last_day + 1) if not self.is_final(day)]
+
+    def get_missing_ranges(self, first_day, last_day):
+        """
+        :return: list of [first, last] ranges of contiguous missing days (see get_missing_days)
+        """
+        ranges = []
+        for day in self.get_missing_days(first_day, last_day):
+            if len(ranges) > 0 and ranges[-1][1] == day - 1:
+                ranges[-1][1] = day
+            else:
+                ranges.append([day, day])
+        return ranges
+
+    def slice(self, first_day, last_day):
+        if self.first_day is not None and first_day >= self.first_day and \
+                last_day - self.first_day < len(self.values):
+            return self.values[first_day - self.first_day:last_day - self.first_day + 1]
+        return array('d', (self.get(day) for day in range(first_day, last_day + 1)))
+
+    def to_bytes(self):
+        return HEADER.pack(self.first_day or 0, len(self.values)) + self.values.tobytes() + self.final.tobytes()
+
+    @staticmethod
+    def from_bytes(data):
+        first_day, length = HEADER.unpack_from(data)
+        values = array('d')
+        values.frombytes(data[HEADER.size:HEADER.size + length * values.itemsize])
+        final = array('B')
+        final.frombytes(data[HEADER.size + length * values.itemsize:])
+        return GADailySeries(first_day or None, values, final)
+
+
+class GATimeSeriesStore:
+    """
+    local store of daily metric values (e.g. ga:sessions by ga:date) per profile, kept in one small file per
+    profile/metric; a request only fetches the days that are missing or still within GA's processing latency window
+    (each series has its own lock, so fetching one series doesn't hold up requests for the others)
+    """
+
+    def __init__(self, directory='ga_timeseries', latency_days=2):
+        self.directory = directory
+        self.latency_days = latency_days
+        self.fetched_days = 0
+        self.__series = {}
+        self.__locks = {} # (profile_id, metric) -> lock of the series
+        self.__lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_daily(self, profile_id, metric, start_date, end_date, fetch, fetch_total=None):
+        """
+        :param fetch: function(start_date, end_date) returning (or yielding) GA rows of [date ('YYYYMMDD'), value]
+            for every day in the range
+        :param fetch_total: function(start_date, end_date) returning the total (string) of the range; required for
+            metrics that aren't additive (e.g. ga:users counts a user once, however many days they visited), whose
+            total isn't the sum of the days
+        :return: total (string) and list of [date ('YYYYMMDD'), value] rows, in the format GA returns them
+        """
+        is_additive = google_analytics_metrics.is_additive(metric)
+        if not is_additive and fetch_total is None:
+            raise ValueError("{} isn't additive: its total can't be computed from the days, pass fetch_total"
+                             .format(metric))
+        first_day = GATimeSeriesStore.to_date(start_date).toordinal()
+        last_day = GATimeSeriesStore.to_date(end_date).toordinal()
+        with self.get_lock(profile_id, metric):
+            series = self.get_series(profile_id, metric)
+            missing_ranges = series.get_missing_ranges(first_day, last_day)
+            if len(missing_ranges) > 0:
+                # one request per run of missing days (typically just the last day or two), so the days already
+                # stored between runs aren't fetched again
+                last_final_day = (date.today() - timedelta(days=self.latency_days + 1)).toordinal()
+                for fetch_first, fetch_last in missing_ranges:
+                    fetched = {}
+                    for row in fetch(date.fromordinal(fetch_first), date.fromordinal(fetch_last)):
+                        fetched[datetime.strptime(row[0], '%Y%m%d').toordinal()] = float(row[1])
+                    for day in range(fetch_first, fetch_last + 1):
+                        # GA doesn't return rows for days without data when include_empty_rows=false
+                        series.set(day, fetched.get(day, 0), final=day <= last_final_day)
+                    with self.__lock:
+                        self.fetched_days += fetch_last - fetch_first + 1
+                self.save_series(profile_id, metric, series)
+            values = series.slice(first_day, last_day)
+
+        rows = [[date.fromordinal(first_day + index).strftime('%Y%m%d'), GATimeSeriesStore.format_value(value)]
+                for index, value in enumerate(values)]
+        if is_additive:
+            return GATimeSeriesStore.format_value(sum(values)), rows
+        return fetch_total(date.fromordinal(first_day), date.fromordinal(last_day)), rows
+
+    def get_lock(self, profile_id, metric):
+        with self.__lock:
+            return self.__locks.setdefault((profile_id, metric), threading.Lock())
+
+    def get_series(self, profile_id, metric):
+        """
+        must be called with the lock of the series (see get_lock) held
+        """
+        key = (profile_id, metric)
+        with self.__lock:
+            series = self.__series.get(key)
+        if series is None:
+            path = self.get_path(profile_id, metric)
+            if os.path.isfile(path):
+                with open(path, 'rb') as series_file:
+                    series = GADailySeries.from_bytes(series_file.read())
+            else:
+                series = GADailySeries()
+            with self.__lock:
+                self.__series[key] = series
+        return series
+
+    def save_series(self, profile_id, metric, series):
+        path = self.get_path(profile_id, metric)
+        with open(path + '.tmp', 'wb') as series_file:
+            series_file.write(series.to_bytes())
+        os.replace(path + '.tmp', path)
+
+    def get_path(self, profile_id, metric):
+        return os.path.join(self.directory, '{}_{}.series'.format(profile_id, metric.replace(':', '_')))
+
+    @staticmethod
+    def to_date(value):
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    @staticmethod
+    def format_value(value):
+        return str(int(value)) if value.is_integer() else repr(value)
@@ -1,87 +1,269 @@
+import re
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
-from googleapiclient import sample_tools
+from api_wrappers import google_analytics_metrics, google_analytics_sampling
+from api_wrappers.google_analytics_quota import GARateLimiter
+from api_wrappers.google_analytics_reporting_v4 import GAReportingV4Backend
+from api_wrappers.google_analytics_result import GAResult
+from api_wrappers.google_analytics_rollup import GAPageRollup, ROLLUP_METRICS
+from api_wrappers.google_analytics_timeseries import GATimeSeriesStore
+from api_wrappers.google_analytics_service import get_service_pool, get_cached_profile
 
 
 class GoogleAnalyticsWrapper:
-
-    def get_sessions(self):
+    MAX_RESULTS_PER_PAGE = 10000
+    MAX_REQUESTS_PER_BATCH = 10
+    MAX_FILTER_LENGTH = 3000 # keeps the request url well under the API's url length limit
+    PAGE_STATS_METRICS = google_analytics_metrics.PAGE_STATS_METRICS
+    PAGEVIEWS_SOURCE_METRICS = 'ga:pageViews,ga:uniquePageViews,ga:newUsers,ga:bounceRate,ga:avgTimeOnPage,ga:entrances'
+    # partial responses (the fields parameter) of just what the high-level methods read
+    TOTALS_FIELDS = 'totalsForAllResults'
+    ROWS_FIELDS = 'columnHeaders(name,columnType,dataType),rows,totalsForAllResults,containsSampledData'
+    PAGING_FIELDS = 'totalResults,itemsPerPage' # needed to follow start_index
+    SAMPLING_FIELDS = ('containsSampledData', 'columnHeaders(name,columnType,dataType)') # needed to split sampled data
+
+    def get_sessions(self, start_date=None, end_date=None):
         """
         :return: total number of sessions and a list of sessions for each date
         """
-        results = self.ga_get(metrics='ga:sessions',dimensions='ga:date')
-        total_sessions = results['totalsForAllResults']['ga:sessions']
-        session_list = results['rows']
-        return total_sessions, session_list
+        return self.get_daily_series('ga:sessions', start_date=start_date, end_date=end_date)
 
-    def get_total_sesssion_campaign(self, campaign_name):
-        return self.get_total_sessions(filters='ga:campaign=={}'.format(campaign_name))
+    def get_total_sesssion_campaign(self, campaign_name, start_date=None, end_date=None):
+        return self.get_total_sessions(filters='ga:campaign=={}'.format(campaign_name),
+                                       start_date=start_date,
+                                       end_date=end_date)
 
-    def get_total_sessions(self, filters=None):
+    def get_total_sessions(self, filters=None, start_date=None, end_date=None):
         """
         :return: 2 values: 1) total users 2) new_users
         """
         results = self.ga_get(metrics='ga:sessions',
                               dimensions='ga:userType',
-                              filters=filters)
-        sessions = int(results['totalsForAllResults']['ga:sessions'])
+                              filters=filters,
+                              start_date=start_date,
+                              end_date=end_date,
+                              fields=GoogleAnalyticsWrapper.ROWS_FIELDS)
+        result = GAResult.build(results)
+        sessions = result.get_total('ga:sessions')
         sessions_new_user = None
         sessions_returning_user = None
-        for row in results['rows']:
-            if row[0] == 'New Visitor':
-                sessions_new_user = int(row[1])
-            elif row[0] == 'Returning Visitor':
-                sessions_returning_user = int(row[1])
+        for user_type, user_type_sessions in zip(result.get_column('ga:userType'), result.get_column('ga:sessions')):
+            if user_type == 'New Visitor':
+                sessions_new_user = user_type_sessions
+            elif user_type == 'Returning Visitor':
+                sessions_returning_user = user_type_sessions
             else:
                 raise LookupError('unexpected value in get_total_sessions')
         return sessions, sessions_new_user, sessions_returning_user
 
-    def get_users(self):
+    def get_users(self, start_date=None, end_date=None):
         """
         :return: total number of users and a list of sessions for each date
         """
-        results = self.ga_get(metrics='ga:users',dimensions='ga:date')
-        total_sessions = results['totalsForAllResults']['ga:users']
-        session_list = results['rows']
-        return total_sessions, session_list
+        return self.get_daily_series('ga:users', start_date=start_date, end_date=end_date)
 
-    def get_total_users(self, filters=None):
+    def get_daily_series(self, metric, start_date=None, end_date=None):
+        """
+        :return: total and list of [date ('YYYYMMDD'), value] rows of the metric for each date; if there is a
+            timeseries_store, only the days it doesn't have (or that may still change) are requested, and the total
+            of a metric that isn't additive (e.g. ga:users) is requested on its own
+        """
+        start_date = start_date or self.start_date
+        end_date = end_date or self.end_date
+        try:
+            start_date = GATimeSeriesStore.to_date(start_date)
+            end_date = GATimeSeriesStore.to_date(end_date)
+            is_storable = True
+        except ValueError:
+            is_storable = False # relative dates (e.g. '7daysAgo') are sent to GA as they are
+
+        if self.timeseries_store is None or not is_storable:
+            results = self.ga_get_all(metrics=metric,
+                                      dimensions='ga:date',
+                                      start_date=start_date,
+                                      end_date=end_date,
+                                      fields=GoogleAnalyticsWrapper.ROWS_FIELDS)
+            return results['totalsForAllResults'][metric], results['rows']
+
+        def fetch(fetch_start_date, fetch_end_date):
+            return self.ga_iter_rows(metric,
+                                     dimensions='ga:date',
+                                     start_date=fetch_start_date,
+                                     end_date=fetch_end_date,
+                                     fields=GoogleAnalyticsWrapper.ROWS_FIELDS)
+
+        def fetch_total(fetch_start_date, fetch_end_date):
+            # a totals-only query (answered from the cache, if there is one)
+            return self.ga_get(metric,
+                               start_date=fetch_start_date,
+                               end_date=fetch_end_date,
+                               fields=GoogleAnalyticsWrapper.TOTALS_FIELDS)['totalsForAllResults'][metric]
+
+        return self.timeseries_store.get_daily(self.profile_id, metric, start_date, end_date, fetch,
+                                               fetch_total=fetch_total)
+
+    def get_total_users(self, filters=None, start_date=None, end_date=None):
         """
         :return: 2 values: 1) total users 2) new_users
         """
-        results = self.ga_get(metrics='ga:users,ga:newUsers', filters=filters)
+        results = self.ga_get(metrics='ga:users,ga:newUsers',
+                              filters=filters,
+                              start_date=start_date,
+                              end_date=end_date,
+                              fields=GoogleAnalyticsWrapper.TOTALS_FIELDS)
         total_users = int(results['totalsForAllResults']['ga:users'])
         new_users = int(results['totalsForAllResults']['ga:newUsers'])
         return total_users, new_users
 
-    def get_total_users_campaign(self, campaign_name):
-        return self.get_total_users(filters='ga:campaign=={}'.format(campaign_name))
+    def get_total_users_campaign(self, campaign_name, start_date=None, end_date=None):
+        return self.get_total_users(filters='ga:campaign=={}'.format(campaign_name),
+                                    start_date=start_date,
+                                    end_date=end_date)
 
-    def get_page_stats(self, url_path):
-        results = self.ga_get(metrics='ga:visits,ga:pageViews,ga:uniquePageViews,ga:newUsers,ga:bounceRate,ga:avgTimeOnPage,ga:entrances',
-                              filters='ga:pagePath=={}'.format(url_path))
+    def get_page_stats(self, url_path, start_date=None, end_date=None):
+        results = self.ga_get(metrics=GoogleAnalyticsWrapper.PAGE_STATS_METRICS,
+                              filters='ga:pagePath=={}'.format(url_path),
+                              start_date=start_date,
+                              end_date=end_date,
+                              fields=GoogleAnalyticsWrapper.TOTALS_FIELDS)
 
         return results['totalsForAllResults']
 
-    def get_pageviews_source(self, url_path):
-        results = self.ga_get(metrics="ga:pageViews,ga:uniquePageViews,ga:newUsers,ga:bounceRate,ga:avgTimeOnPage,ga:entrances",
+    def get_page_stats_date_ranges(self, url_path, date_ranges):
+        """
+        same as get_page_stats, but for several date ranges (e.g. the first 30 days and the lifetime of a page) at once
+        :param date_ranges: list of (start_date, end_date)
+        :return: list of dictionaries in the format get_page_stats returns, one per date range
+        """
+        return [results['totalsForAllResults']
+                for results in self.ga_get_date_ranges(GoogleAnalyticsWrapper.PAGE_STATS_METRICS,
+                                                       date_ranges,
+                                                       filters='ga:pagePath=={}'.format(url_path),
+                                                       fields=GoogleAnalyticsWrapper.TOTALS_FIELDS)]
+
+    def get_page_stats_bulk(self, url_paths, start_date=None, end_date=None):
+        """
+        same as get_page_stats, but for many paths using as few queries as possible
+        :return: dictionary of url_path -> dictionary in the same format get_page_stats returns
+        """
+        page_stats = {}
+        empty_stats = None
+        for results in self.ga_get_page_paths(url_paths,
+                                              metrics=GoogleAnalyticsWrapper.PAGE_STATS_METRICS,
+                                              start_date=start_date,
+                                              end_date=end_date,
+                                              fields=GoogleAnalyticsWrapper.ROWS_FIELDS):
+            metric_headers = results['columnHeaders'][1:]
+            empty_stats = {header['name']: '0' if header['dataType'] == 'INTEGER' else '0.0'
+                           for header in metric_headers}
+            for row in results.get('rows', []):
+                page_stats[row[0]] = {header['name']: value for header, value in zip(metric_headers, row[1:])}
+
+        return {url_path: page_stats.get(url_path, dict(empty_stats)) for url_path in url_paths}
+
+    def get_pageviews_source(self, url_path, start_date=None, end_date=None):
+        results = self.ga_get_all(metrics=GoogleAnalyticsWrapper.PAGEVIEWS_SOURCE_METRICS,
                               dimensions="ga:sourceMedium",
-                              filters='ga:pagePath=={}'.format(url_path))
+                              filters='ga:pagePath=={}'.format(url_path),
+                              start_date=start_date,
+                              end_date=end_date,
+                              fields=GoogleAnalyticsWrapper.ROWS_FIELDS)
         if 'rows' not in results:
             return None, None, None
 
-        page_views = results['totalsForAllResults']['ga:pageViews']
-        unique_page_views = results['totalsForAllResults']['ga:uniquePageViews']
-        source_mediums = results['rows']
-        source_mediums = sorted(source_mediums,key=lambda l:int(l[1]), reverse=True)
-        return int(page_views), int(unique_page_views), source_mediums
+        result = GAResult.build(results)
+        page_views = result.get_total('ga:pageViews')
+        unique_page_views = result.get_total('ga:uniquePageViews')
+        source_mediums = [results['rows'][index] for index in result.get_order('ga:pageViews', descending=True)]
+        return page_views, unique_page_views, source_mediums
 
-    def get_top_keywords(self, max_results=10):
+    def get_pageviews_source_bulk(self, url_paths, start_date=None, end_date=None):
+        """
+        same as get_pageviews_source, but for many paths using as few queries as possible
+        :return: dictionary of url_path -> (page_views, unique_page_views, source_mediums) tuple
+        """
+        source_mediums = {}
+        for results in self.ga_get_page_paths(url_paths,
+                                              metrics=GoogleAnalyticsWrapper.PAGEVIEWS_SOURCE_METRICS,
+                                              dimensions='ga:sourceMedium',
+                                              start_date=start_date,
+                                              end_date=end_date,
+                                              fields=GoogleAnalyticsWrapper.ROWS_FIELDS):
+            for row in results.get('rows', []):
+                source_mediums.setdefault(row[0], []).append(row[1:])
+
+        pageviews_source = {}
+        for url_path in url_paths:
+            if url_path not in source_mediums:
+                pageviews_source[url_path] = (None, None, None)
+                continue
+            rows = sorted(source_mediums[url_path], key=lambda l: int(l[1]), reverse=True)
+            pageviews_source[url_path] = (sum(int(row[1]) for row in rows), sum(int(row[2]) for row in rows), rows)
+        return pageviews_source
+
+    def get_page_rollup(self, url_paths=None, start_date=None, end_date=None, metrics=ROLLUP_METRICS):
+        """
+        pulls the daily stats of many pages at once (ga:date,ga:pagePath) so stats over any window within
+        [start_date, end_date] can be answered locally, e.g. rollup.get_page_stats(url_path, window_start, window_end)
+        :param url_paths: pages to include; every page if None
+        :return: GAPageRollup
+        """
+        start_date = start_date or self.start_date
+        end_date = end_date or self.end_date
+        metrics = ','.join(metrics)
+        if url_paths is None:
+            rows = self.ga_iter_rows(metrics,
+                                     dimensions='ga:pagePath,ga:date',
+                                     start_date=start_date,
+                                     end_date=end_date)
+        else:
+            rows = (row
+                    for results in self.ga_get_page_paths(url_paths,
+                                                          metrics=metrics,
+                                                          dimensions='ga:date',
+                                                          start_date=start_date,
+                                                          end_date=end_date,
+                                                          fields=GoogleAnalyticsWrapper.ROWS_FIELDS)
+                    for row in results.get('rows', []))
+        return GAPageRollup.build(rows, start_date, end_date, metrics.split(','))
+
+    def ga_get_page_paths(self, url_paths, metrics, dimensions=None, **parameters):
+        """
+        queries many ga:pagePath values at once by OR-ing them into filters (each no longer than MAX_FILTER_LENGTH);
+        ga:pagePath is added as the first dimension so the rows can be split back up per path
+        :param parameters: any other ga_get parameters
+        :return: list of responses (one per filter), each containing all of its rows
+        """
+        dimensions = 'ga:pagePath' if dimensions is None else 'ga:pagePath,' + dimensions
+        if parameters.get('fields') is not None and 'totalResults' not in parameters['fields']:
+            parameters['fields'] += ',' + GoogleAnalyticsWrapper.PAGING_FIELDS
+        queries = [dict(parameters,
+                        metrics=metrics,
+                        dimensions=dimensions,
+                        filters=filters,
+                        max_results=GoogleAnalyticsWrapper.MAX_RESULTS_PER_PAGE)
+                   for filters in GoogleAnalyticsWrapper.get_or_filters('ga:pagePath', url_paths)]
+
+        responses = []
+        for query, (results, exception) in zip(queries, self.ga_get_many(queries)):
+            if exception is not None:
+                raise exception
+            if results.get('totalResults', 0) > len(results.get('rows', [])):
+                results = self.ga_get_all(**query)
+            responses.append(results)
+        return responses
+
+    def get_top_keywords(self, max_results=10, start_date=None, end_date=None):
         results = self.ga_get(metrics='ga:visits',
                               dimensions='ga:source,ga:keyword',
                               sort='-ga:visits',
                               filters='ga:medium==organic',
-                              max_results=max_results)
+                              max_results=max_results,
+                              start_date=start_date,
+                              end_date=end_date,
+                              fields=GoogleAnalyticsWrapper.ROWS_FIELDS)
         total_visits = int(results['totalsForAllResults']['ga:visits'])
         keywords = results['rows']
         return total_visits, keywords
@@ -104,27 +286,308 @@ class GoogleAnalyticsWrapper:
                prettyPrint=None,
                userIp=None,
                quotaUser=None,
-               key=None):
-        return self.service.data().ga().get(
-            ids=ids or 'ga:' + self.profile_id,
-            start_date=start_date or self.get_start_date(),
-            end_date=end_date or self.get_end_date(),
-            metrics=metrics,
-            dimensions=dimensions,
-            sort=sort,
-            filters=filters,
-            segment=segment,
-            samplingLevel=samplingLevel,
-            include_empty_rows=include_empty_rows,
-            start_index=start_index,
-            max_results=max_results,
-            output=output,
-            fields=fields,
-            prettyPrint=prettyPrint,
-            userIp=userIp,
-            quotaUser=quotaUser,
-            key=key
-            ).execute()
+               key=None,
+               split_sampled=False):
+        """
+        :param split_sampled: if GA returns sampled data, split the date range into windows that aren't sampled and
+            recombine them (see ga_get_unsampled)
+        """
+        query = self.build_query(metrics=metrics,
+                                 ids=ids,
+                                 start_date=start_date,
+                                 end_date=end_date,
+                                 dimensions=dimensions,
+                                 sort=sort,
+                                 filters=filters,
+                                 segment=segment,
+                                 samplingLevel=samplingLevel,
+                                 include_empty_rows=include_empty_rows,
+                                 start_index=start_index,
+                                 max_results=max_results,
+                                 output=output,
+                                 fields=fields,
+                                 prettyPrint=prettyPrint,
+                                 userIp=userIp,
+                                 quotaUser=quotaUser,
+                                 key=key)
+        if split_sampled:
+            return self.ga_get_unsampled(query)
+        return self.execute_query(query)
+
+    def ga_get_unsampled(self, query):
+        """
+        executes a query built by build_query; if the results contain sampled data, the date range is split in half
+        (repeatedly, down to single days) and the windows are fetched in parallel until none are sampled. The
+        windows are then recombined: additive metrics are summed exactly, and ratio metrics (e.g. ga:bounceRate) are
+        recomputed from their components, so only metrics known to google_analytics_metrics can be recombined.
+        The windows are sorted locally (GA only sorts by metrics in the query, which ratio metrics aren't once they are
+        replaced by their components), and metric filters (e.g. 'ga:bounceRate>50') can't be split, since each window
+        would apply them to its own partial rows: ValueError is raised if a query with one is sampled.
+        :return: same as ga_get, plus 'splitReport': list of {'start_date', 'end_date', 'sampled'} for each window
+        """
+        if query.get('fields') is not None:
+            # a field mask would otherwise hide whether the results are sampled, and the headers they are sorted by
+            query = dict(query)
+            for field in GoogleAnalyticsWrapper.SAMPLING_FIELDS:
+                if field.split('(')[0] not in query['fields']:
+                    query['fields'] += ',' + field
+        results = self.execute_query(query)
+        if not results.get('containsSampledData'):
+            results['splitReport'] = [{'start_date': query['start_date'], 'end_date': query['end_date'], 'sampled': False}]
+            return results
+
+        metric_filters = [name for name in re.findall(r'ga:\w+', query.get('filters') or '')
+                          if google_analytics_metrics.is_additive(name) or google_analytics_metrics.is_ratio(name)]
+        if len(metric_filters) > 0:
+            raise ValueError("results are sampled, and the metric filters ({}) can't be applied to split date ranges"
+                             .format(', '.join(metric_filters)))
+        metrics = query['metrics'].split(',')
+        component_metrics = google_analytics_metrics.get_component_metrics(metrics)
+        window_query = {name: value for name, value in query.items()
+                        if name not in ('start_index', 'max_results', 'fields', 'start_date', 'end_date', 'sort')}
+        window_query['metrics'] = ','.join(component_metrics)
+
+        def fetch(window):
+            return self.ga_get_all(start_date=window[0], end_date=window[1], **window_query)
+
+        windows = google_analytics_sampling.split_window(GATimeSeriesStore.to_date(query['start_date']),
+                                                         GATimeSeriesStore.to_date(query['end_date']))
+        fetched = []
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            while len(windows) > 0:
+                next_windows = []
+                for window, response in zip(windows, executor.map(fetch, windows)):
+                    if response.get('containsSampledData') and window[0] < window[1]:
+                        next_windows.extend(google_analytics_sampling.split_window(*window))
+                    else:
+                        fetched.append((window, response))
+                windows = next_windows
+
+        fetched.sort(key=lambda window_response: window_response[0])
+        rows, totals = google_analytics_sampling.merge_responses(metrics,
+                                                                 component_metrics,
+                                                                 [response for _, response in fetched])
+        rows = google_analytics_sampling.sort_rows(rows, results['columnHeaders'], query.get('sort'))
+        start_index = (query.get('start_index') or 1) - 1
+        max_results = query.get('max_results') or len(rows)
+
+        results['totalResults'] = len(rows)
+        results['rows'] = rows[start_index:start_index + max_results]
+        results['totalsForAllResults'] = totals
+        results['containsSampledData'] = any(response.get('containsSampledData') for _, response in fetched)
+        results.pop('sampleSize', None)
+        results.pop('sampleSpace', None)
+        results['splitReport'] = [{'start_date': GoogleAnalyticsWrapper.format_date(window[0]),
+                                   'end_date': GoogleAnalyticsWrapper.format_date(window[1]),
+                                   'sampled': bool(response.get('containsSampledData'))}
+                                  for window, response in fetched]
+        return results
+
+    def ga_iter_pages(self, metrics, max_results=MAX_RESULTS_PER_PAGE, **parameters):
+        """
+        yields every page of results (i.e. the ga_get response for each page), following start_index until
+        totalResults; the next page is requested while the current page is being consumed
+        :param parameters: same parameters as ga_get
+        """
+        query = self.build_query(metrics, max_results=max_results, **parameters)
+        if query.get('fields') is not None and 'totalResults' not in query['fields']:
+            query['fields'] += ',' + GoogleAnalyticsWrapper.PAGING_FIELDS
+        start_index = query.get('start_index') or 1
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = executor.submit(self.execute_query, dict(query, start_index=start_index))
+            while next_page is not None:
+                results = next_page.result()
+                rows = results.get('rows', [])
+                start_index += len(rows)
+                if len(rows) > 0 and start_index <= results.get('totalResults', 0):
+                    next_page = executor.submit(self.execute_query, dict(query, start_index=start_index))
+                else:
+                    next_page = None
+                yield results
+
+    def ga_iter_rows(self, metrics, max_results=MAX_RESULTS_PER_PAGE, **parameters):
+        """
+        yields every row of the results, one page at a time, so memory use does not grow with the number of rows
+        :param parameters: same parameters as ga_get
+        """
+        for results in self.ga_iter_pages(metrics, max_results=max_results, **parameters):
+            yield from results.get('rows', [])
+
+    def ga_get_all(self, metrics, max_results=MAX_RESULTS_PER_PAGE, **parameters):
+        """
+        same as ga_get, but 'rows' contains the rows of every page rather than just the first
+        """
+        pages = self.ga_iter_pages(metrics, max_results=max_results, **parameters)
+        results = next(pages)
+        for page in pages:
+            results['rows'].extend(page['rows'])
+        return results
+
+    def ga_get_many(self, queries):
+        """
+        executes many queries in a few HTTP round trips, packing up to MAX_REQUESTS_PER_BATCH Core Reporting calls
+        into each (multipart) batch request
+        :param queries: list of dictionaries of ga_get parameters, e.g. {'metrics': 'ga:users', 'filters': ...}
+        :return: list of (results, exception) tuples in the same order as queries; exception is None if the query
+            succeeded, otherwise results is None
+        """
+        queries = [self.build_query(**dict({'max_results': 50}, **query)) for query in queries]
+        responses = [None] * len(queries)
+        pending = []
+        for index, query in enumerate(queries):
+            results = self.cache.get(query) if self.cache is not None else None
+            if results is None:
+                pending.append(index)
+            else:
+                responses[index] = (results, None)
+
+        def callback(request_id, results, exception):
+            index = int(request_id)
+            responses[index] = (results, exception)
+            if exception is None and self.cache is not None:
+                self.cache.put(queries[index], results)
+
+        if self.backend is not None:
+            for index, (results, exception) in zip(pending, self.backend.get_many([queries[index] for index in pending],
+                                                                                  self.rate_limiter)):
+                callback(str(index), None if results is None else results[0], exception)
+            return responses
+
+        attempt = 0
+        while len(pending) > 0:
+            for start in range(0, len(pending), self.MAX_REQUESTS_PER_BATCH):
+                with self.service_pool.service() as service:
+                    batch = service.new_batch_http_request(callback=callback)
+                    for index in pending[start:start + self.MAX_REQUESTS_PER_BATCH]:
+                        self.rate_limiter.acquire(queries[index]['ids'])
+                        batch.add(service.data().ga().get(**queries[index]), request_id=str(index))
+                    batch.execute()
+
+            # queries that failed with retryable errors (e.g. userRateLimitExceeded) are sent again after backing off
+            pending = [index for index in pending
+                       if responses[index][1] is not None and self.rate_limiter.should_retry(responses[index][1], attempt)]
+            if len(pending) > 0:
+                self.rate_limiter.backoff(attempt)
+                attempt += 1
+        return responses
+
+    def ga_get_date_ranges(self, metrics, date_ranges, **parameters):
+        """
+        executes the same query for several date ranges, e.g. a campaign's window and its lifetime; with the v4
+        backend the date ranges are part of a single report (GAReportingV4Backend.MAX_DATE_RANGES per report),
+        otherwise a query is sent per date range (in one batch)
+        :param date_ranges: list of (start_date, end_date)
+        :param parameters: other ga_get parameters
+        :return: list of results (same as ga_get), one per date range
+        """
+        if self.backend is None:
+            responses = self.ga_get_many([dict(parameters, metrics=metrics, start_date=start_date, end_date=end_date)
+                                          for start_date, end_date in date_ranges])
+        else:
+            date_ranges = [(GoogleAnalyticsWrapper.format_date(start_date), GoogleAnalyticsWrapper.format_date(end_date))
+                           for start_date, end_date in date_ranges]
+            queries = []
+            for start in range(0, len(date_ranges), GAReportingV4Backend.MAX_DATE_RANGES):
+                query = self.build_query(metrics, **dict({'max_results': 50}, **parameters))
+                query['date_ranges'] = date_ranges[start:start + GAReportingV4Backend.MAX_DATE_RANGES]
+                queries.append(query)
+            responses = [(range_results, exception)
+                         for results, exception in self.backend.get_many(queries, self.rate_limiter)
+                         for range_results in (results or [None])]
+
+        for results, exception in responses:
+            if exception is not None:
+                raise exception
+        return [results for results, _ in responses]
+
+    def ga_get_concurrent(self, queries, max_workers=None):
+        """
+        executes many queries in parallel, each on its own service object from the pool (so at most
+        service_pool.size are in flight at once)
+        :param queries: list of dictionaries of ga_get parameters, e.g. {'metrics': 'ga:users', 'start_date': ...}
+        :return: list of (results, exception) tuples in the same order as queries (same as ga_get_many)
+        """
+        def execute(query):
+            try:
+                return self.ga_get(**query), None
+            except Exception as exception:
+                return None, exception
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.service_pool.size) as executor:
+            return list(executor.map(execute, queries))
+
+    def ga_get_profiles(self, profile_ids, max_workers=None, **query):
+        """
+        executes the same query against many profiles (views) in parallel; each profile is throttled by its own
+        rate_limiter bucket, so the whole takes about as long as the slowest profile rather than the sum of them
+        :param query: ga_get parameters (other than ids)
+        :return: dictionary of profile id -> (results, exception) tuple (see ga_get_many)
+        """
+        queries = [dict(query, ids='ga:{}'.format(profile_id)) for profile_id in profile_ids]
+        return dict(zip(profile_ids, self.ga_get_concurrent(queries, max_workers=max_workers)))
+
+    def ga_get_portfolio_totals(self, profile_ids, metrics, **query):
+        """
+        totals of the metrics over all profiles: additive metrics are summed and ratio metrics (e.g. ga:bounceRate)
+        are recomputed from their summed components; metrics such as ga:users can't be combined (raises ValueError)
+        :param metrics: comma separated metric names
+        :param query: other ga_get parameters (e.g. start_date, filters)
+        :return: 2 values: 1) dictionary of metric -> portfolio total 2) dictionary of profile id -> dictionary of
+            metric -> total of the profile
+        """
+        metrics = metrics.split(',')
+        component_metrics = google_analytics_metrics.get_component_metrics(metrics)
+        portfolio_totals = {metric: 0.0 for metric in component_metrics}
+        profile_totals = {}
+        for profile_id, (results, exception) in self.ga_get_profiles(profile_ids,
+                                                                     metrics=','.join(component_metrics),
+                                                                     **query).items():
+            if exception is not None:
+                raise exception
+            totals = {google_analytics_metrics.get_metric_key(metric): float(value)
+                      for metric, value in results['totalsForAllResults'].items()}
+            for metric in component_metrics:
+                portfolio_totals[metric] += totals[metric]
+            profile_totals[profile_id] = {metric: google_analytics_metrics.format_value(metric, value) for metric, value
+                                          in google_analytics_metrics.compute_metrics(metrics, totals).items()}
+
+        portfolio_totals = {metric: google_analytics_metrics.format_value(metric, value) for metric, value
+                            in google_analytics_metrics.compute_metrics(metrics, portfolio_totals).items()}
+        return portfolio_totals, profile_totals
+
+    def build_query(self, metrics, ids=None, start_date=None, end_date=None, **parameters):
+        """
+        :return: dictionary of Core Reporting API parameters, with the profile id and date range filled in
+        """
+        query = {'ids': ids or 'ga:' + self.profile_id,
+                 'start_date': GoogleAnalyticsWrapper.format_date(start_date or self.start_date),
+                 'end_date': GoogleAnalyticsWrapper.format_date(end_date or self.end_date),
+                 'metrics': metrics}
+        query.update(parameters)
+        return query
+
+    def execute_query(self, query):
+        """
+        executes a query built by build_query, answering from the cache (if there is one) when possible
+        """
+        if self.cache is not None:
+            results = self.cache.get(query)
+            if results is not None:
+                return results
+
+        def request():
+            if self.backend is not None:
+                results, exception = self.backend.get_many([query])[0]
+                if exception is not None:
+                    raise exception
+                return results[0]
+            with self.service_pool.service() as service:
+                return service.data().ga().get(**query).execute()
+
+        results = self.rate_limiter.execute(query['ids'], request)
+        if self.cache is not None:
+            self.cache.put(query, results)
+        return results
 
     def get_account_by_id(self, id):
         """
@@ -132,7 +595,8 @@ class GoogleAnalyticsWrapper:
         :param id: (GA -> Admin -> Account ID)
         :return dictionary
         """
-        accounts = self.service.management().accounts().list().execute()['items']
+        with self.service_pool.service() as service:
+            accounts = service.management().accounts().list().execute()['items']
         for account in accounts:
             if account['id'] == id:
                 return account
@@ -140,7 +604,14 @@ class GoogleAnalyticsWrapper:
         return None
 
     def get_first_profile_id(self):
-        """Traverses Management API to return the first profile id.
+        """
+        :return: the first profile id (see get_first_profile), None if there isn't one
+        """
+        profile = self.get_first_profile()
+        return None if profile is None else profile['profile_id']
+
+    def get_first_profile(self):
+        """Traverses Management API to return the first profile.
 
         This first queries the Accounts collection to get the first account ID.
         This ID is used to query the Webproperties collection to retrieve the first
@@ -151,29 +622,65 @@ class GoogleAnalyticsWrapper:
         service: The service object built by the Google API Python client library.
 
         Returns:
-        A string with the first profile ID. None if a user does not have any
-        accounts, webproperties, or profiles.
+        A dictionary with the account_id, webproperty_id and profile_id of the
+        first profile. None if a user does not have any accounts, webproperties,
+        or profiles.
         """
 
-        accounts = self.service.management().accounts().list().execute()
+        with self.service_pool.service() as service:
+            accounts = service.management().accounts().list().execute()
 
-        if accounts.get('items'):
-            firstAccountId = accounts.get('items')[0].get('id')
-            webproperties = self.service.management().webproperties().list(
-                accountId=firstAccountId).execute()
+            if accounts.get('items'):
+                firstAccountId = accounts.get('items')[0].get('id')
+                webproperties = service.management().webproperties().list(
+                    accountId=firstAccountId).execute()
 
-        if webproperties.get('items'):
-            firstWebpropertyId = webproperties.get('items')[0].get('id')
-            profiles = self.service.management().profiles().list(
-                accountId=firstAccountId,
-                webPropertyId=firstWebpropertyId).execute()
+            if webproperties.get('items'):
+                firstWebpropertyId = webproperties.get('items')[0].get('id')
+                profiles = service.management().profiles().list(
+                    accountId=firstAccountId,
+                    webPropertyId=firstWebpropertyId).execute()
 
         if profiles.get('items'):
-            return profiles.get('items')[0].get('id')
+            return {'account_id': firstAccountId,
+                    'webproperty_id': firstWebpropertyId,
+                    'profile_id': profiles.get('items')[0].get('id')}
 
         return None
 
+    def get_transfer_stats(self):
+        """
+        :return: number of responses received and their size, of every wrapper sharing the service pool (or backend);
+            see GATransferStats.get_stats
+        """
+        if self.backend is not None:
+            return self.backend.transfer_stats.get_stats()
+        return self.service_pool.transfer_stats.get_stats()
+
+    @property
+    def service_pool(self):
+        with self.__lock:
+            if self.__service_pool is None:
+                self.__service_pool = get_service_pool(size=self.pool_size)
+            return self.__service_pool
+
+    @property
+    def profile_id(self):
+        if self.__profile_id is None:
+            profile = get_cached_profile(self.service_pool.credentials.client_id, self.get_first_profile)
+            with self.__lock:
+                self.__profile_id = None if profile is None else profile['profile_id']
+        return self.__profile_id
+
+    @profile_id.setter
+    def profile_id(self, profile_id):
+        self.__profile_id = profile_id
+
     def set_date_range(self, start_date, end_date):
+        """
+        sets the default date range used by queries that aren't given a start_date/end_date; note that this is
+        shared by every thread using the wrapper, so pass the dates per call when running queries concurrently
+        """
         self.start_date = start_date
         self.end_date = end_date
 
@@ -183,19 +690,58 @@ class GoogleAnalyticsWrapper:
     def get_start_date(self):
         return self.start_date.strftime('%Y-%m-%d')
 
-    def __init__(self, profile_id=None):
-        self.service, self.flags = sample_tools.init(
-                [], 'analytics', 'v3', __doc__, __file__,
-                scope='https://www.googleapis.com/auth/analytics.readonly')
-
-        if profile_id is None:
-            self.profile_id = self.get_first_profile_id()
-        else:
-            self.profile_id = profile_id
-
+    def __init__(self, profile_id=None, cache=None, pool_size=10, rate_limiter=None, timeseries_store=None,
+                 backend=None):
+        """
+        :param profile_id: GA profile (view) id; the first profile of the first account is used if not set
+        :param cache: optional GACache; responses are answered from/stored in it
+        :param pool_size: maximum number of service objects (i.e. concurrent requests) in the service pool
+        :param rate_limiter: GARateLimiter shared by the wrappers using the same project; one is created if not set
+        :param timeseries_store: optional GATimeSeriesStore that get_sessions/get_users answer from
+        :param backend: optional GAReportingV4Backend queries are sent through instead of the Core Reporting API (v3)
+
+        nothing is loaded until it is first needed: the (shared) service pool is created by the first request, and
+        the first profile id is resolved (and cached on disk) the first time profile_id is used
+        """
+        self.cache = cache
+        self.rate_limiter = rate_limiter or GARateLimiter()
+        self.timeseries_store = timeseries_store
+        self.backend = backend
+        self.pool_size = pool_size
+        self.__service_pool = None
+        self.__profile_id = profile_id
+        self.__lock = threading.Lock()
         self.start_date=(datetime.now()-timedelta(days=30))
         self.end_date=datetime.now()
 
+    @staticmethod
+    def format_date(date):
+        """
+        :param date: datetime/date, or a string the API understands (e.g. '2016-02-01', 'today', '7daysAgo')
+        """
+        if isinstance(date, str):
+            return date
+        return date.strftime('%Y-%m-%d')
+
+    @staticmethod
+    def get_or_filters(name, values, max_length=MAX_FILTER_LENGTH):
+        """
+        :return: list of filters of the form 'name==a,name==b,...', each no longer than max_length (unless a single
+            value is longer), that together match every value
+        """
+        filters = []
+        current = ''
+        for value in dict.fromkeys(values):
+            value = value.replace('\\', '\\\\').replace(',', '\\,').replace(';', '\\;')
+            expression = '{}=={}'.format(name, value)
+            if current and len(current) + 1 + len(expression) > max_length:
+                filters.append(current)
+                current = ''
+            current = expression if current == '' else current + ',' + expression
+        if current:
+            filters.append(current)
+        return filters
+
     @staticmethod
     def get_google_url(url, source, medium, name):
         """
@@ -0,0 +1,24 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host, pool_size=10):
+    """
+    :param host: host the session is for, e.g. 'us12.api.mailchimp.com'; every caller asking for the same host shares
+        the session, so its connections are kept alive and reused across calls and wrapper objects
+    :param pool_size: connections kept open for concurrent calls (only used when the session is created)
+    :return: requests.Session asking for gzip compressed responses, created on first use
+    """
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _sessions[host] = session
+        return _sessions[host]
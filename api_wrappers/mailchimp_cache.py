@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+class MailchimpCache:
+    """
+    persistent (sqlite) cache of Mailchimp API responses, keyed by the endpoint and its parameters (fields,
+    exclude_fields, ...)
+    - campaigns and reports (anything with a send_time) expire after fresh_max_age seconds during the first
+      fresh_days after they were sent, and after max_age seconds from then on: a sent campaign's settings don't
+      change, but its report_summary (opens, clicks, ...) keeps changing like its report does
+    - other responses expire after fresh_max_age seconds
+    expired responses that have an ETag are revalidated with If-None-Match, so an unchanged response isn't downloaded
+    again (see MailchimpWrapper.generic_get)
+    """
+
+    def __init__(self, path='mailchimp_cache.sqlite', fresh_days=7, fresh_max_age=3600, max_age=86400):
+        """
+        :param path: sqlite file the responses are stored in (':memory:' for a non-persistent cache)
+        :param fresh_days: number of days after the send time during which reports are still changing quickly
+        :param fresh_max_age: how long (seconds) responses that are still changing quickly are kept before refreshing
+        :param max_age: how long (seconds) responses sent more than fresh_days ago are kept before refreshing
+        """
+        self.path = path
+        self.fresh_days = fresh_days
+        self.fresh_max_age = fresh_max_age
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.bytes_saved = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                                      '(key TEXT PRIMARY KEY, response TEXT, etag TEXT, expires REAL)')
+
+    def get(self, endpoint, params):
+        """
+        :param endpoint: url of the endpoint
+        :param params: parameters of the request (see MailchimpWrapper.get_params)
+        :return: (response, etag, expired) tuple, or None if the response is not cached; a response that hasn't
+            expired is counted as a hit
+        """
+        key = MailchimpCache.get_key(endpoint, params)
+        with self.__lock:
+            row = self.__connection.execute('SELECT response, etag, expires FROM responses WHERE key = ?',
+                                            (key,)).fetchone()
+            if row is None:
+                return None
+            expired = row[2] is not None and row[2] < time.time()
+            if not expired:
+                self.hits += 1
+                self.bytes_saved += len(row[0])
+            return json.loads(row[0]), row[1], expired
+
+    def put(self, endpoint, params, response, etag=None):
+        """
+        stores a response that was downloaded (counted as a miss)
+        """
+        content = json.dumps(response)
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                      (MailchimpCache.get_key(endpoint, params),
+                                       content,
+                                       etag,
+                                       self.get_expires(response, time.time())))
+            self.misses += 1
+
+    def revalidate(self, endpoint, params):
+        """
+        renews an expired response the server reported as not modified (304)
+        """
+        key = MailchimpCache.get_key(endpoint, params)
+        with self.__lock, self.__connection:
+            content, = self.__connection.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            self.__connection.execute('UPDATE responses SET expires = ? WHERE key = ?',
+                                      (self.get_expires(json.loads(content), time.time()), key))
+            self.revalidations += 1
+            self.bytes_saved += len(content)
+
+    def clear(self):
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM responses')
+
+    def get_stats(self):
+        """
+        :return: dictionary with the number of hits, misses, revalidations (304 Not Modified), bytes of responses
+            that didn't have to be downloaded and cached responses
+        """
+        with self.__lock:
+            entries = self.__connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'bytes_saved': self.bytes_saved,
+                'entries': entries}
+
+    def get_expires(self, response, now):
+        """
+        :return: time (seconds since the epoch) the response expires at
+        """
+        try:
+            send_time = datetime.fromisoformat(response['send_time']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return now + self.fresh_max_age
+        if now - send_time < self.fresh_days * 86400:
+            return now + self.fresh_max_age
+        return now + self.max_age
+
+    @staticmethod
+    def get_key(endpoint, params):
+        return json.dumps([endpoint, params], sort_keys=True)
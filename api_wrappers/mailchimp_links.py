@@ -0,0 +1,103 @@
+import urllib.parse
+from array import array
+
+TRACKING_PARAMETERS = ('mc_cid', 'mc_eid')
+TRACKING_PREFIXES = ('utm_',)
+
+
+def is_tracking_parameter(name):
+    return name.lower() in TRACKING_PARAMETERS or name.lower().startswith(TRACKING_PREFIXES)
+
+
+def normalize_url(url):
+    """
+    e.g. 'HTTP://IntelliTect.com/code-reviews/?utm_source=newsletter1&mc_cid=17c90e3ad8&mc_eid=[UNIQID]' ->
+    ('http://intellitect.com/code-reviews', {'utm_source': 'newsletter1', 'mc_cid': '17c90e3ad8', 'mc_eid': '[UNIQID]'})
+    :return: canonical url (scheme and host lowercased, no trailing slash, no fragment, other query parameters
+        sorted) and dictionary of the tracking parameters (mc_cid, mc_eid, utm_*) that were taken out of it
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    tracking = {}
+    parameters = []
+    for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True):
+        if is_tracking_parameter(name):
+            tracking[name] = value
+        else:
+            parameters.append((name, value))
+    canonical = urllib.parse.urlunsplit((parts.scheme.lower(),
+                                         parts.netloc.lower(),
+                                         parts.path.rstrip('/'),
+                                         urllib.parse.urlencode(sorted(parameters)),
+                                         ''))
+    return canonical, tracking
+
+
+class MailchimpClickIndex:
+    """
+    click details (reports/{campaign_id}/click-details) of a campaign, aggregated by canonical url (see
+    normalize_url), so the same link with different tracking parameters or trailing slashes is counted once;
+    the values of each field are kept in an array, in the order the urls were first seen
+    """
+    FIELDS = {'total_clicks': 'q',
+              'unique_clicks': 'q',
+              'click_percentage': 'd',
+              'unique_click_percentage': 'd'}
+
+    def __init__(self, campaign_id=None):
+        self.campaign_id = campaign_id
+        self.urls = []
+        self.columns = {field: array(type_code) for field, type_code in MailchimpClickIndex.FIELDS.items()}
+        self.__positions = {}
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __contains__(self, url):
+        return normalize_url(url)[0] in self.__positions
+
+    def add(self, link):
+        """
+        :param link: item of urls_clicked; its values are added to those of the other links with the same canonical url
+        """
+        url = normalize_url(link['url'])[0]
+        position = self.__positions.get(url)
+        if position is None:
+            position = self.__positions[url] = len(self.urls)
+            self.urls.append(url)
+            for field, column in self.columns.items():
+                column.append(link.get(field, 0))
+        else:
+            for field, column in self.columns.items():
+                column[position] += link.get(field, 0)
+
+    def get(self, url, field):
+        """
+        :param url: url of the link, with or without its tracking parameters
+        :param field: one of FIELDS
+        """
+        return self.columns[field][self.get_position(url)]
+
+    def get_link(self, url):
+        """
+        :return: dictionary of the url (canonical) and every field of the link
+        """
+        position = self.get_position(url)
+        link = {field: column[position] for field, column in self.columns.items()}
+        link['url'] = self.urls[position]
+        return link
+
+    def get_position(self, url):
+        canonical = normalize_url(url)[0]
+        if canonical not in self.__positions:
+            raise LookupError("no clicks of {} in campaign {}".format(canonical, self.campaign_id))
+        return self.__positions[canonical]
+
+    @staticmethod
+    def build(campaign_id, links):
+        """
+        :param links: items of urls_clicked (e.g. from MailchimpWrapper.generic_iter)
+        """
+        index = MailchimpClickIndex(campaign_id)
+        for link in links:
+            index.add(link)
+        return index
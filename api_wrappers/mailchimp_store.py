@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import threading
+
+
+class MailchimpCampaignStore:
+    """
+    local (sqlite) store of the campaigns and reports of Mailchimp accounts, kept up to date incrementally by
+    MailchimpWrapper.sync_campaigns: a watermark (latest create_time and send_time seen) is kept per account and list,
+    so a sync only requests the campaigns created or sent after it
+    """
+
+    def __init__(self, path='mailchimp_campaigns.sqlite'):
+        """
+        :param path: sqlite file the campaigns are stored in (':memory:' for a non-persistent store)
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS campaigns '
+                                      '(account TEXT, id TEXT, list_id TEXT, create_time TEXT, send_time TEXT, '
+                                      'campaign TEXT, report TEXT, PRIMARY KEY (account, id))')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS watermarks '
+                                      '(account TEXT, list_id TEXT, create_time TEXT, send_time TEXT, '
+                                      'PRIMARY KEY (account, list_id))')
+            # list_id -> campaigns by send time, so per-list (and time range) lookups are index range scans
+            self.__connection.execute('CREATE INDEX IF NOT EXISTS campaigns_list_send_time '
+                                      'ON campaigns (account, list_id, send_time)')
+
+    def upsert_campaigns(self, account, campaigns):
+        """
+        inserts the campaigns, or replaces the ones already stored (keeping their reports)
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany('INSERT INTO campaigns (account, id, list_id, create_time, send_time, campaign) '
+                                          'VALUES (?, ?, ?, ?, ?, ?) '
+                                          'ON CONFLICT (account, id) DO UPDATE SET list_id = excluded.list_id, '
+                                          'create_time = excluded.create_time, send_time = excluded.send_time, '
+                                          'campaign = excluded.campaign',
+                                          [(account,
+                                            campaign['id'],
+                                            campaign.get('recipients', {}).get('list_id'),
+                                            campaign.get('create_time') or None,
+                                            campaign.get('send_time') or None,
+                                            json.dumps(campaign))
+                                           for campaign in campaigns])
+
+    def upsert_report(self, account, campaign_id, report):
+        with self.__lock, self.__connection:
+            self.__connection.execute('UPDATE campaigns SET report = ? WHERE account = ? AND id = ?',
+                                      (json.dumps(report), account, campaign_id))
+
+    def get_campaigns(self, account, list_id=None, status=None, since_send_time=None, before_send_time=None):
+        """
+        :param status: only campaigns with the status (e.g. 'sent')
+        :param since_send_time: only campaigns sent after the time (ISO 8601, as the API returns it)
+        :param before_send_time: only campaigns sent before the time
+        :return: the stored campaigns (of the list, if list_id is set), by send time (campaigns that weren't sent last)
+        """
+        query = 'SELECT campaign FROM campaigns WHERE account = ?'
+        parameters = [account]
+        for condition, value in [(' AND list_id = ?', list_id),
+                                 (" AND json_extract(campaign, '$.status') = ?", status),
+                                 (' AND send_time > ?', since_send_time),
+                                 (' AND send_time < ?', before_send_time)]:
+            if value is not None:
+                query += condition
+                parameters.append(value)
+        query += ' ORDER BY send_time IS NULL, send_time, create_time'
+        with self.__lock:
+            return [json.loads(row[0]) for row in self.__connection.execute(query, parameters)]
+
+    def get_report(self, account, campaign_id):
+        """
+        :return: the stored report of the campaign, or None if it has none
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT report FROM campaigns WHERE account = ? AND id = ?',
+                                            (account, campaign_id)).fetchone()
+        return None if row is None or row[0] is None else json.loads(row[0])
+
+    def get_sent_since(self, account, send_time, list_id=None):
+        """
+        :return: ids of the campaigns sent at or after send_time (ISO 8601, as the API returns it)
+        """
+        query = 'SELECT id FROM campaigns WHERE account = ? AND send_time >= ?'
+        parameters = [account, send_time]
+        if list_id is not None:
+            query += ' AND list_id = ?'
+            parameters.append(list_id)
+        with self.__lock:
+            return [row[0] for row in self.__connection.execute(query + ' ORDER BY send_time', parameters)]
+
+    def get_watermark(self, account, list_id=None):
+        """
+        :return: (create_time, send_time) of the latest campaign created and sent seen by the last sync of the
+            account/list, (None, None) if it was never synced
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT create_time, send_time FROM watermarks '
+                                            'WHERE account = ? AND list_id = ?',
+                                            (account, list_id or '')).fetchone()
+        return (None, None) if row is None else row
+
+    def is_synced(self, account, list_id=None):
+        """
+        :return: True if every campaign of the account (list) has been synced, by a sync of the list or of every list
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT COUNT(*) FROM watermarks WHERE account = ? AND list_id IN (?, ?)',
+                                            (account, '', list_id or '')).fetchone()
+        return row[0] > 0
+
+    def set_watermark(self, account, create_time, send_time, list_id=None):
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)',
+                                      (account, list_id or '', create_time, send_time))
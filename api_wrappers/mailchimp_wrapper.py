@@ -1,7 +1,15 @@
+import csv
 import os
+import random
+import tarfile
+import time
 import requests
 import json
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from api_wrappers.http_session import get_session
+from api_wrappers.mailchimp_links import MailchimpClickIndex
 
 
 class MailChimpConfig:
@@ -36,38 +44,168 @@ class MailChimpConfig:
 
 
 class MailchimpWrapper:
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000 # maximum count the API allows
+    MAX_CONNECTIONS = 10 # maximum simultaneous connections the API allows per account
+    DEFAULT_TIMEOUT = (10, 60) # seconds to connect, seconds to wait for (each part of) the response
+    MAX_RETRY_DELAY = 32
+    MAX_BATCH_WAIT = 3600 # seconds a batch operation is waited for
+    MEMBER_COLUMNS = ['id', 'email_address', 'status', 'timestamp_opt', 'last_changed', 'stats/avg_open_rate',
+                      'stats/avg_click_rate']
 
-    def get_lists(self):
-        json = self.generic_get(endpoint='lists', fields='lists.id,lists.name,lists.stats.member_count')
-        return json['lists']
+    def get_lists(self, page_size=DEFAULT_PAGE_SIZE):
+        return list(self.generic_iter('lists',
+                                      items_key='lists',
+                                      fields='lists.id,lists.name,lists.stats.member_count',
+                                      page_size=page_size))
 
-    def get_campaigns(self, list_id=None, pagination_count=None):
-        json = self.generic_get('campaigns',
-                                fields=MailchimpWrapper.get_campaign_fields(False),
-                                pagination_count=pagination_count or 30)
-        if list_id is None:
-            return json['campaigns']
-        else:
-            list = [campaign for campaign in json['campaigns'] if campaign['recipients']['list_id'] == list_id]
-            return list
+    def export_members(self, list_id, output, output_format='ndjson', columns=None, page_size=MAX_PAGE_SIZE,
+                       since_last_changed=None, offset=0):
+        """
+        streams the members of a list to output, a page at a time (only two pages are held in memory, see
+        generic_iter), so lists of any size can be exported
+        :param output: text file object the members are written to
+        :param output_format: 'ndjson' (one json object per line, with the requested fields) or 'csv' (one column per
+            path, with a header row unless the export is resumed)
+        :param columns: paths of the fields exported, e.g. ['email_address', 'stats/avg_open_rate'] (by default
+            MEMBER_COLUMNS)
+        :param page_size: number of members requested at a time, up to MAX_PAGE_SIZE
+        :param since_last_changed: only members changed after the time (ISO 8601), for incremental exports
+        :param offset: number of members to skip, e.g. the 'offset' returned by an interrupted export to resume it
+        :return: dictionary with the number of members exported, the offset to resume from, the seconds it took and
+            the members per second; if the export fails, the offset to resume it from is set on the exception raised
+            (exception.offset)
+        """
+        if output_format not in ('ndjson', 'csv'):
+            raise ValueError("unknown output_format: {}".format(output_format))
+        columns = columns or MailchimpWrapper.MEMBER_COLUMNS
+        fields = ','.join('members.' + column.replace('/', '.') for column in columns)
+        writer = csv.writer(output) if output_format == 'csv' else None
+        if writer is not None and offset == 0:
+            writer.writerow(columns)
+
+        start = time.perf_counter()
+        count = 0
+        try:
+            for member in self.generic_iter('lists/{}/members'.format(list_id),
+                                            items_key='members',
+                                            fields=fields,
+                                            page_size=page_size,
+                                            filters={'since_last_changed': since_last_changed},
+                                            offset=offset):
+                if writer is None:
+                    output.write(json.dumps(member) + '\n')
+                else:
+                    writer.writerow([MailchimpWrapper.get_path_value(member, column) for column in columns])
+                count += 1
+        except Exception as exception:
+            exception.offset = offset + count
+            raise
+        seconds = time.perf_counter() - start
+        return {'members': count,
+                'offset': offset + count,
+                'seconds': seconds,
+                'members_per_second': count / seconds if seconds > 0 else 0}
+
+    @staticmethod
+    def get_path_value(item, path):
+        """
+        :return: value of the path (e.g. 'stats/avg_open_rate') in the item, or None if it doesn't have it
+        """
+        for part in path.split('/'):
+            if not isinstance(item, dict) or part not in item:
+                return None
+            item = item[part]
+        return item
+
+    def get_campaigns(self, list_id=None, pagination_count=None, status=None, since_send_time=None,
+                      before_send_time=None):
+        """
+        answered from the store (if there is one, and the account/list was synced into it, see sync_campaigns) without
+        any request, otherwise requested with the filters applied by the API
+        :param pagination_count: number of campaigns requested per page; every campaign is returned
+        :param status: only campaigns with the status, e.g. 'sent'
+        :param since_send_time: only campaigns sent after the time (ISO 8601, e.g. '2016-01-01T00:00:00+00:00')
+        :param before_send_time: only campaigns sent before the time
+        """
+        if self.store is not None and self.store.is_synced(self.get_account_id(), list_id=list_id):
+            return self.store.get_campaigns(self.get_account_id(),
+                                            list_id=list_id,
+                                            status=status,
+                                            since_send_time=since_send_time,
+                                            before_send_time=before_send_time)
+        return list(self.iter_campaigns(list_id=list_id,
+                                        page_size=pagination_count or MailchimpWrapper.DEFAULT_PAGE_SIZE,
+                                        status=status,
+                                        since_send_time=since_send_time,
+                                        before_send_time=before_send_time))
+
+    def iter_campaigns(self, list_id=None, page_size=DEFAULT_PAGE_SIZE, status=None, since_send_time=None,
+                       before_send_time=None):
+        """
+        yields every campaign matching the filters (see get_campaigns), one page at a time
+        """
+        return self.generic_iter('campaigns',
+                                 items_key='campaigns',
+                                 fields=MailchimpWrapper.get_campaign_fields(False),
+                                 page_size=page_size,
+                                 filters={'list_id': list_id,
+                                          'status': status,
+                                          'since_send_time': since_send_time,
+                                          'before_send_time': before_send_time})
 
     def get_campaign(self, campaign_id):
         json = self.generic_get("campaigns/{}/".format(campaign_id),
-                                fields=MailchimpWrapper.get_campaign_fields(True))
+                                fields=MailchimpWrapper.get_campaign_fields(True),
+                                use_cache=True)
         return json
 
     def get_campaign_report(self, campaign_id):
-        json = self.generic_get("reports/{}/".format(campaign_id))
+        json = self.generic_get("reports/{}/".format(campaign_id), use_cache=True)
         return json
 
-    def get_campaign_links(self, campaign_id):
+    def get_campaigns_bulk(self, campaign_ids, campaign=True, report=True, links=False, click_index=False,
+                           max_workers=MAX_CONNECTIONS):
+        """
+        gets the campaign (get_campaign), report (get_campaign_report) and/or click details (get_campaign_links,
+        get_click_index) of many campaigns concurrently, with at most max_workers (up to MAX_CONNECTIONS) requests
+        at a time
+        :return: dictionary of campaign id -> (results, exception) tuple; results is a dictionary with the requested
+            'campaign', 'report', 'links' and 'click_index', or None if any of them failed (exception is the first error)
+        """
+        getters = [(name, getter) for name, getter, requested in [('campaign', self.get_campaign, campaign),
+                                                                   ('report', self.get_campaign_report, report),
+                                                                   ('links', self.get_campaign_links, links),
+                                                                   ('click_index', self.get_click_index, click_index)]
+                   if requested]
+        tasks = [(campaign_id, name, getter) for campaign_id in dict.fromkeys(campaign_ids) for name, getter in getters]
+
+        def execute(task):
+            campaign_id, _, getter = task
+            try:
+                return getter(campaign_id), None
+            except Exception as exception:
+                return None, exception
+
+        results = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, MailchimpWrapper.MAX_CONNECTIONS)) as executor:
+            for (campaign_id, name, _), (result, exception) in zip(tasks, executor.map(execute, tasks)):
+                results.setdefault(campaign_id, {})[name] = result
+                if exception is not None:
+                    errors.setdefault(campaign_id, exception)
+
+        return {campaign_id: (None, errors[campaign_id]) if campaign_id in errors else (campaign_results, None)
+                for campaign_id, campaign_results in results.items()}
+
+    def get_campaign_links(self, campaign_id, page_size=MAX_PAGE_SIZE):
         exclude_fields = 'urls_clicked._links,urls_clicked.last_click'
-        json = self.generic_get("reports/{}/click-details/"
-                                .format(campaign_id),
-                                exclude_fields=exclude_fields,
-                                pagination_count=100)
-        results = {'campaign_id': json['campaign_id'], 'urls_clicked': {}}
-        for link in json['urls_clicked']:
+        links = self.generic_iter("reports/{}/click-details/".format(campaign_id),
+                                  items_key='urls_clicked',
+                                  exclude_fields=exclude_fields,
+                                  page_size=page_size)
+        results = {'campaign_id': campaign_id, 'urls_clicked': {}}
+        for link in links:
             if link['url'] in results['urls_clicked']:
                 results['urls_clicked'][link['url']]['click_percentage'] += link['click_percentage']
                 results['urls_clicked'][link['url']]['total_clicks'] += link['total_clicks']
@@ -78,13 +216,163 @@ class MailchimpWrapper:
 
         return results
 
+    def sync_campaigns(self, store, list_id=None, refresh_days=7, page_size=DEFAULT_PAGE_SIZE):
+        """
+        brings the campaigns (of the list, if list_id is set) in the store up to date: only the campaigns created or
+        sent after the store's watermark for the account/list are requested (every campaign on the first sync), and
+        the campaigns sent in the last refresh_days (whose report_summary is still changing) and their reports are
+        refreshed
+        :param store: MailchimpCampaignStore
+        :return: every stored campaign of the account (list), by send time
+        """
+        account = self.get_account_id()
+        create_watermark, send_watermark = store.get_watermark(account, list_id)
+        refresh_since = (datetime.now(timezone.utc) - timedelta(days=refresh_days)).isoformat(timespec='seconds')
+        if create_watermark is None:
+            filters = [{'list_id': list_id}]
+        else:
+            filters = [{'list_id': list_id, 'since_create_time': create_watermark},
+                       {'list_id': list_id, 'since_send_time': send_watermark or create_watermark},
+                       {'list_id': list_id, 'since_send_time': refresh_since}]
+
+        campaigns = {}
+        for campaign_filters in filters:
+            for campaign in self.generic_iter('campaigns',
+                                              items_key='campaigns',
+                                              fields=MailchimpWrapper.get_campaign_fields(False),
+                                              page_size=page_size,
+                                              filters=campaign_filters):
+                campaigns[campaign['id']] = campaign
+        store.upsert_campaigns(account, campaigns.values())
+
+        campaign_ids = list(dict.fromkeys(store.get_sent_since(account, refresh_since, list_id=list_id) +
+                                          [campaign['id'] for campaign in campaigns.values()
+                                           if campaign.get('send_time')]))
+        for campaign_id, (results, exception) in self.get_campaigns_bulk(campaign_ids, campaign=False).items():
+            if exception is not None:
+                raise exception
+            store.upsert_report(account, campaign_id, results['report'])
+
+        create_times = [campaign['create_time'] for campaign in campaigns.values() if campaign.get('create_time')]
+        send_times = [campaign['send_time'] for campaign in campaigns.values() if campaign.get('send_time')]
+        store.set_watermark(account,
+                            max(create_times + [create_watermark or '']) or None,
+                            max(send_times + [send_watermark or '']) or None,
+                            list_id=list_id)
+        return store.get_campaigns(account, list_id=list_id)
+
+    def get_account_id(self):
+        if self.account_id is None:
+            self.account_id = self.generic_get('', fields='account_id')['account_id']
+        return self.account_id
+
+    def get_click_index(self, campaign_id, page_size=MAX_PAGE_SIZE):
+        """
+        :return: MailchimpClickIndex of the click details of the campaign, aggregated by canonical url
+        """
+        return MailchimpClickIndex.build(campaign_id,
+                                         self.generic_iter("reports/{}/click-details/".format(campaign_id),
+                                                           items_key='urls_clicked',
+                                                           fields='urls_clicked.url,urls_clicked.total_clicks,'
+                                                                  'urls_clicked.click_percentage,'
+                                                                  'urls_clicked.unique_clicks,'
+                                                                  'urls_clicked.unique_click_percentage',
+                                                           page_size=page_size))
+
     @staticmethod
     def get_campaign_fields(is_single_campaign):
-        return '{0}id,{0}emails_sent,{0}send_time,{0}recipients.list_id,{0}settings.title,{0}settings.from_name,{0}settings.subject_line,{0}report_summary,{0}variate_settings'.format('' if is_single_campaign else "campaigns.")
+        return '{0}id,{0}status,{0}emails_sent,{0}create_time,{0}send_time,{0}recipients.list_id,{0}settings.title,{0}settings.from_name,{0}settings.subject_line,{0}report_summary,{0}variate_settings'.format('' if is_single_campaign else "campaigns.")
 
-    def generic_get(self, endpoint, fields=None, exclude_fields=None, pagination_count=None, pagination_offset=None):
+    def generic_iter(self, endpoint, items_key, fields=None, exclude_fields=None, page_size=DEFAULT_PAGE_SIZE,
+                     filters=None, offset=0):
+        """
+        yields every item of a collection (e.g. 'campaigns'), following count/offset until total_items; the next
+        page is requested while the current page is being consumed, and only those two pages are held in memory
+        :param items_key: key of the items in the response, e.g. 'campaigns' or 'urls_clicked'
+        :param fields: fields to return (total_items is added, since it is needed to page)
+        :param page_size: number of items per request, up to MAX_PAGE_SIZE
+        :param filters: dictionary of other parameters of the request, e.g. {'since_send_time': ...}
+        :param offset: number of items to skip
+        """
+        if page_size > MailchimpWrapper.MAX_PAGE_SIZE:
+            raise ValueError("page_size ({}) is larger than {}".format(page_size, MailchimpWrapper.MAX_PAGE_SIZE))
+        if fields is not None and 'total_items' not in fields.split(','):
+            fields += ',total_items'
+
+        def get_page(offset):
+            return self.generic_get(endpoint,
+                                    fields=fields,
+                                    exclude_fields=exclude_fields,
+                                    pagination_count=page_size,
+                                    pagination_offset=offset,
+                                    filters=filters)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = executor.submit(get_page, offset)
+            while next_page is not None:
+                page = next_page.result()
+                items = page.get(items_key, [])
+                offset += len(items)
+                if len(items) > 0 and offset < page.get('total_items', 0):
+                    next_page = executor.submit(get_page, offset)
+                else:
+                    next_page = None
+                yield from items
+
+    def generic_get(self, endpoint, fields=None, exclude_fields=None, pagination_count=None, pagination_offset=None,
+                    filters=None, use_cache=False):
+        """
+        :param filters: dictionary of other parameters of the request (see get_params)
+        :param use_cache: answer from/store in the cache (if there is one); an expired response is revalidated with
+            its ETag, and not downloaded again if it hasn't changed
+        """
         endpoint = urllib.parse.urljoin(self.config.api_root, endpoint)
-        params = {}
+        params = MailchimpWrapper.get_params(fields=fields,
+                                             exclude_fields=exclude_fields,
+                                             pagination_count=pagination_count,
+                                             pagination_offset=pagination_offset,
+                                             filters=filters)
+        self.last_params = params # used for testing and so client can get params used
+        cached = None
+        headers = {}
+        if use_cache and self.cache is not None:
+            cached = self.cache.get(endpoint, params)
+            if cached is not None:
+                results, etag, expired = cached
+                if not expired:
+                    return results
+                if etag is not None:
+                    headers['If-None-Match'] = etag
+
+        attempt = 0
+        while True:
+            response = self.session.get(endpoint,
+                                        auth=('apikey', self.config.api_key),
+                                        params=params,
+                                        headers=headers,
+                                        timeout=self.timeout)
+            if response.status_code != 429 or attempt >= self.max_retries:
+                break
+            self.sleep(MailchimpWrapper.get_retry_delay(response, attempt))
+            attempt += 1
+
+        if response.status_code == 304 and cached is not None:
+            self.cache.revalidate(endpoint, params)
+            return cached[0]
+        response.raise_for_status()
+        results = response.json()
+        if use_cache and self.cache is not None:
+            self.cache.put(endpoint, params, results, etag=response.headers.get('ETag'))
+        return results
+
+    @staticmethod
+    def get_params(fields=None, exclude_fields=None, pagination_count=None, pagination_offset=None, filters=None):
+        """
+        :param filters: dictionary of other parameters, e.g. {'list_id': ..., 'since_send_time': ...}; None values are
+            left out
+        :return: query string parameters of a GET (see generic_get)
+        """
+        params = {name: value for name, value in (filters or {}).items() if value is not None}
         if fields is not None:
             params['fields'] = fields
 
@@ -97,24 +385,121 @@ class MailchimpWrapper:
             params['offset'] = pagination_offset
         elif pagination_offset is not None:
             raise ValueError("pagination_offset set to {}, but pagination_count not set".format(pagination_offset))
+        return params
 
-        self.last_params = params # used for testing and so client can get params used
-        response = requests.get(endpoint,
-                                auth=('apikey', self.config.api_key),
-                                params=params,
-                                verify=False)
+    def batch_get(self, operations, poll_delay=1, max_wait=MAX_BATCH_WAIT):
+        """
+        runs many GETs as a single batch operation (POST /batches): waits for the batch to finish, polling its status
+        with backoff, then streams the gzipped tar archive of responses, decoding one file of it at a time
+        :param operations: list of dictionaries of generic_get parameters, e.g.
+            [{'endpoint': 'campaigns/17c90e3ad8/', 'fields': 'id,emails_sent'}, {'endpoint': 'reports/17c90e3ad8/'}]
+        :param poll_delay: seconds to wait before the first status check (doubled for each following check)
+        :param max_wait: seconds to wait for the batch to finish before raising TimeoutError
+        :return: yields (index of the operation, results, exception) tuples in the order the archive has them;
+            exception is None if the operation succeeded, otherwise results is None
+        """
+        batch = self.submit_batch(operations)
+        batch = self.wait_for_batch(batch['id'], poll_delay=poll_delay, max_wait=max_wait)
+        yield from self.iter_batch_results(batch['response_body_url'])
 
+    def submit_batch(self, operations):
+        """
+        :param operations: see batch_get
+        :return: the batch (status) created
+        """
+        body = {'operations': [{'method': 'GET',
+                                'path': '/' + operation['endpoint'].lstrip('/'),
+                                'operation_id': str(index),
+                                'params': MailchimpWrapper.get_params(**{name: value for name, value in operation.items()
+                                                                         if name != 'endpoint'})}
+                               for index, operation in enumerate(operations)]}
+        response = self.session.post(urllib.parse.urljoin(self.config.api_root, 'batches'),
+                                     auth=('apikey', self.config.api_key),
+                                     json=body,
+                                     timeout=self.timeout)
         response.raise_for_status()
         return response.json()
 
-    def __init__(self, credentials_json=None, api_key=None):
+    def wait_for_batch(self, batch_id, poll_delay=1, max_wait=MAX_BATCH_WAIT):
+        """
+        :param max_wait: seconds (waited between status checks) after which TimeoutError is raised
+        :return: the batch status once it is finished
+        """
+        attempt = 0
+        waited = 0
+        while waited < max_wait:
+            delay = min(MailchimpWrapper.MAX_RETRY_DELAY, poll_delay * 2 ** attempt, max_wait - waited)
+            self.sleep(delay)
+            waited += delay
+            batch = self.generic_get('batches/{}'.format(batch_id))
+            if batch['status'] == 'finished':
+                return batch
+            attempt += 1
+        raise TimeoutError("batch {} not finished after {} seconds".format(batch_id, max_wait))
+
+    def iter_batch_results(self, response_body_url):
+        """
+        streams the gzipped tar archive of a finished batch: each file of it is a json list of the responses of
+        some of the operations
+        :return: yields (index of the operation, results, exception) tuples
+        """
+        # the archive is served from a pre-signed url (on another host), so the api key is not sent, and it isn't
+        # fetched through the shard's session, whose connection pool it would take over
+        response = requests.get(response_body_url, stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+            with tarfile.open(fileobj=response.raw, mode='r|gz') as archive:
+                for member in archive:
+                    if not member.isfile() or not member.name.endswith('.json'):
+                        continue
+                    for operation in json.load(archive.extractfile(member)):
+                        if operation['status_code'] >= 400:
+                            error = requests.exceptions.HTTPError('{} Error for operation {}: {}'
+                                                                  .format(operation['status_code'],
+                                                                          operation['operation_id'],
+                                                                          operation['response']))
+                            yield int(operation['operation_id']), None, error
+                        else:
+                            yield int(operation['operation_id']), json.loads(operation['response']), None
+        finally:
+            response.close()
+
+    @staticmethod
+    def get_retry_delay(response, attempt):
+        """
+        :return: seconds to wait before retrying a throttled response: its Retry-After header if it has one,
+            otherwise exponential backoff (with jitter)
+        """
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            delay = min(MailchimpWrapper.MAX_RETRY_DELAY, 2 ** attempt)
+            return random.uniform(delay / 2, delay)
+
+    def __init__(self, credentials_json=None, api_key=None, timeout=DEFAULT_TIMEOUT, pool_size=MAX_CONNECTIONS,
+                 max_retries=5, sleep=time.sleep, cache=None, store=None):
+        """
+        :param timeout: requests timeout of every call: seconds, or (connect, read) tuple
+        :param pool_size: connections kept open to the shard (see http_session.get_session)
+        :param max_retries: number of times a call that was throttled (429 Too Many Requests) is retried
+        :param sleep: function used to wait before retrying (replaceable in tests)
+        :param cache: optional MailchimpCache campaigns and reports are answered from/stored in
+        :param store: optional MailchimpCampaignStore get_campaigns is answered from, once synced (see sync_campaigns)
+        """
         self.config = MailChimpConfig(credentials_json=credentials_json, api_key=api_key)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.cache = cache
+        self.store = store
+        self.account_id = None
+        self.session = get_session('{}.api.mailchimp.com'.format(self.config.shard), pool_size=pool_size)
 
     def temp(self):
 
         endpoint = self.config.api_root
 
-        response = requests.get(endpoint, auth=('apikey', self.config.api_key))
+        response = self.session.get(endpoint, auth=('apikey', self.config.api_key), timeout=self.timeout)
         print(response.url)
 
         try: